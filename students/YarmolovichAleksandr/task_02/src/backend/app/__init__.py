@@ -1,17 +1,21 @@
 from flask import Flask
 from .config import Config
 from .extensions import db, migrate, jwt, ma, api
+from .cache import cache
 
 
 def create_app(config_object: str | None = None):
     app = Flask(__name__)
     app.config.from_object(Config)
+    if config_object:
+        app.config.from_object(config_object)
 
     # init extensions
     db.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
     ma.init_app(app)
+    cache.init_app(app)
 
     @jwt.unauthorized_loader
     def unauthorized_callback(err):
@@ -38,7 +42,8 @@ def create_app(config_object: str | None = None):
         return {'status': 'error', 'error': {'code': 'not_found', 'message': 'Not found'}}, 404
 
     # frontend blueprint FIRST (highest priority)
-    from .frontend import bp as frontend_bp
+    from .frontend import bp as frontend_bp, check_sendfile_mode
+    check_sendfile_mode(app.config['UPLOAD_SENDFILE'])
     if 'frontend' not in app.blueprints:
         app.register_blueprint(frontend_bp)
 
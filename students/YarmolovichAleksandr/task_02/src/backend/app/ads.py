@@ -1,10 +1,22 @@
 from flask_restx import Namespace, Resource, fields
 from flask import request, current_app, url_for
-from .models import Ad, Media
+from .models import Ad, Media, Conversation, Report
 from .extensions import db
+from sqlalchemy.orm import joinedload
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from .utils import role_required
+from . import search, facets
+from .cache import cache, cached
+from .categories import subtree_ids
+from .media import attach_files, remove_ad_media, delete_files
+from .uploads import remove_ad_sessions, discard_partials
+from . import images
+from .conditional import conditional_get, etag_from_body, weak_etag
+from .pagination import encode_cursor, decode_cursor, get_limit, InvalidCursor, invalid_cursor_response
+from datetime import datetime
+from decimal import Decimal
 import os
+import uuid
 
 ns = Namespace('ads', description='Ads operations')
 
@@ -16,9 +28,81 @@ ad_model = ns.model('Ad', {
     'location': fields.String()
 })
 
+# listing fields: changing any of them can move an ad in or out of a cached list page
+LIST_FIELDS = ('title', 'description', 'price', 'status', 'category_id')
+
+
+# cache tags: 'ad:<id>' is the detail entry, 'ad-card:<id>' every list page showing
+# that ad, 'ads:list' every list page
+def _list_tags(body, **kwargs):
+    return ['ads:list'] + ['ad-card:' + a['id'] for a in body.get('data', [])]
+
+
+def _ad_tags(body, id):
+    # the body also shows the category name and author username, which change without the ad
+    ad = body.get('data') or {}
+    return ['ad:' + id] + (['category:' + ad['category_id'], 'author:' + ad['author_id']] if 'category_id' in ad else [])
+
+
+def _facet_tags(body, **kwargs):
+    return ['ads:list']
+
+
+def _stamp(a):
+    return (a.updated_at or a.created_at).isoformat()
+
+
+def _list_stamps(body):
+    return [a['id'] + a['updated_at'] for a in body['data']] + [body.get('next_cursor')], None
+
+
+def _ad_stamps(body):
+    ad = body['data']
+    return [ad['updated_at'], ad['status']], datetime.fromisoformat(ad['updated_at'])
+
+
+def _media_validator(id):
+    ad = db.session.query(Ad.updated_at, Ad.created_at).filter(Ad.id == id).first()
+    if ad is None:
+        return None
+    updated_at = ad.updated_at or ad.created_at
+    return weak_etag('media', id, updated_at.isoformat()), updated_at
+
+
+# sort name -> (key column, direction, cursor key parser); id is always the
+# tie-breaker so the order is total. 'relevance' sorts by the search rank column.
+AD_SORTS = {
+    'newest': (Ad.created_at, 'desc', datetime.fromisoformat),
+    'price_asc': (Ad.price, 'asc', Decimal),
+    'price_desc': (Ad.price, 'desc', Decimal),
+    'relevance': (None, 'asc', float),
+}
+
+
+def _check_files(files):
+    if len(files) > current_app.config['UPLOAD_MAX_FILES']:
+        return {'status':'error','error':{'code':'validation_failed','message':'At most %d files per request' % current_app.config['UPLOAD_MAX_FILES']}},400
+    if any(not f.filename for f in files):
+        return {'status':'error','error':{'code':'validation_failed','message':'No file provided'}},400
+    return None
+
+
+def _spool(files):
+    """Save uploaded files next to the resumable uploads; returns (path, filename) pairs for attach_files."""
+    tmp_dir = current_app.config['UPLOAD_PARTIAL_FOLDER']
+    os.makedirs(tmp_dir, exist_ok=True)
+    items = []
+    for f in files:
+        path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        f.save(path)
+        items.append((path, f.filename))
+    return items
+
 
 @ns.route('')
 class AdsList(Resource):
+    @etag_from_body(_list_stamps)
+    @cached(_list_tags)
     def get(self):
         author_id = request.args.get('authorId')
         current_user = None
@@ -38,13 +122,20 @@ class AdsList(Resource):
         query = request.args.get('query')
         price_from = request.args.get('price_from', type=float)
         price_to = request.args.get('price_to', type=float)
-        limit = int(request.args.get('limit', 50))
-        offset = int(request.args.get('offset', 0))
+        matches = search.matches(query) if query else None
+        sort = request.args.get('sort', 'newest' if matches is None else 'relevance')
+        cursor = request.args.get('cursor')
+        limit = get_limit()
+        offset = request.args.get('offset', 0, type=int)
+
+        if sort not in AD_SORTS:
+            return {'status': 'error', 'error': {'code': 'validation_failed', 'message': 'Unknown sort: ' + sort}}, 400
 
         if category_id:
-            q = q.filter_by(category_id=category_id)
-        if query:
-            q = q.filter(Ad.title.ilike(f"%{query}%"))
+            # the category and everything below it
+            q = q.filter(Ad.category_id.in_(subtree_ids(category_id)))
+        if matches is not None:
+            q = q.join(matches, matches.c.ad_id == Ad.id)
         if price_from is not None:
             q = q.filter(Ad.price >= price_from)
         if price_to is not None:
@@ -52,30 +143,99 @@ class AdsList(Resource):
         if author_id and author_id != current_user:
             q = q.filter_by(author_id=author_id)
 
-        items = q.limit(limit).offset(offset).all()
+        column, direction, parse_key = AD_SORTS[sort]
+        if sort == 'relevance':
+            if matches is None:
+                return {'status': 'error', 'error': {'code': 'validation_failed', 'message': 'sort=relevance requires a search query'}}, 400
+            column = matches.c.rank
+        if cursor:
+            # keyset pagination: continue strictly after the last row of the previous page
+            try:
+                key, last_id = decode_cursor(cursor, 2)
+                key = parse_key(key)
+            except (InvalidCursor, ValueError, TypeError, ArithmeticError):
+                return invalid_cursor_response()
+            after = db.tuple_(column, Ad.id)
+            q = q.filter(after < (key, last_id) if direction == 'desc' else after > (key, last_id))
+            offset = 0
+        if direction == 'desc':
+            q = q.order_by(column.desc(), Ad.id.desc())
+        else:
+            q = q.order_by(column.asc(), Ad.id.asc())
+
+        # author is joined into the page query and the cover comes from the ad row itself,
+        # so the page is a single query whatever its size
+        q = q.options(joinedload(Ad.author)).add_columns(column)
+        # fetch one extra row to know whether there is a next page
+        rows = q.offset(offset).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last, key = rows[-1]
+            next_cursor = encode_cursor(key, last.id)
+        items = [row[0] for row in rows]
         data = []
         for a in items:
-            images = [m.url for m in a.media]
-            data.append({'id': a.id, 'title': a.title, 'price': float(a.price), 'status': a.status, 'author_id': a.author_id, 'author_username': getattr(a.author, 'username', None), 'images': images})
-        return {'status': 'ok', 'data': data}
+            data.append({'id': a.id, 'title': a.title, 'price': float(a.price), 'status': a.status, 'author_id': a.author_id, 'author_username': getattr(a.author, 'username', None), 'cover_url': a.cover_url, 'image_count': a.image_count or 0, 'updated_at': _stamp(a)})
+        return {'status': 'ok', 'data': data, 'next_cursor': next_cursor}
 
     @jwt_required()
+    @ns.doc(consumes=['application/json', 'multipart/form-data'])
     def post(self):
-        data = request.json
+        # JSON, or multipart form fields plus any number of "files" parts to create the ad with its images at once
+        multipart = request.mimetype == 'multipart/form-data'
+        data = request.form if multipart else request.json
         current_user = get_jwt_identity()
         # basic validation per spec
         if not data.get('title') or len(data.get('title')) < 1:
             return {'status': 'error', 'error': {'code': 'validation_failed', 'message': 'Введите заголовок.'}}, 400
         if not data.get('category_id'):
             return {'status': 'error', 'error': {'code': 'validation_failed', 'message': 'Укажите категорию.'}}, 400
-        ad = Ad(author_id=current_user, category_id=data['category_id'], title=data['title'], description=data.get('description',''), price=data.get('price',0), location=data.get('location'))
+        price = data.get('price', 0)
+        if multipart:
+            try:
+                price = Decimal(price or 0)
+            except ArithmeticError:
+                return {'status': 'error', 'error': {'code': 'validation_failed', 'message': 'Invalid price'}}, 400
+        files = request.files.getlist('files') if multipart else []
+        error = _check_files(files)
+        if error:
+            return error
+        ad = Ad(author_id=current_user, category_id=data['category_id'], title=data['title'], description=data.get('description',''), price=price, location=data.get('location'))
         db.session.add(ad)
+        db.session.flush()
+        search.index_ad(ad)
+        facets.track(None, facets.facet_key(ad))
+        # one transaction for the ad and all its media
+        media = attach_files(ad, _spool(files)) if files else []
         db.session.commit()
-        return {'status': 'ok', 'data': {'id': ad.id}}, 201
+        for m in media:
+            images.process_later(m)
+        cache.purge('ads:list')
+        result = {'id': ad.id}
+        if multipart:
+            result['media'] = [{'id': m.id, 'url': m.url} for m in media]
+        return {'status': 'ok', 'data': result}, 201
+
+
+@ns.route('/facets')
+class AdsFacets(Resource):
+    @cached(_facet_tags)
+    def get(self):
+        # same filters as the public listing
+        category_id = request.args.get('categoryId')
+        query = request.args.get('query')
+        price_from = request.args.get('price_from', type=float)
+        price_to = request.args.get('price_to', type=float)
+        matches = search.matches(query) if query else None
+        rows = facets.counts(category_ids=subtree_ids(category_id) if category_id else None, price_from=price_from, price_to=price_to, matches=matches)
+        return {'status': 'ok', 'data': facets.summarize(rows)}
 
 
 @ns.route('/<string:id>')
 class AdItem(Resource):
+    @etag_from_body(_ad_stamps)
+    @cached(_ad_tags)
     def get(self, id):
         a = Ad.query.get_or_404(id)
         if a.status in ('banned', 'closed'):
@@ -86,8 +246,8 @@ class AdItem(Resource):
             if current_user != a.author_id and not (claims and claims.get('role') in ('admin', 'moderator')):
                 return {'status': 'error', 'error': {'code': 'not_found', 'message': 'Ad not found'}}, 404
         category = a.category
-        images = [m.url for m in a.media]
-        return {'status': 'ok', 'data': {'id': a.id, 'title': a.title, 'description': a.description, 'price': float(a.price), 'status': a.status, 'author_id': a.author_id, 'author_username': getattr(a.author, 'username', None), 'created_at': a.created_at.isoformat(), 'location': a.location, 'category_id': a.category_id, 'category_name': getattr(category, 'name', 'Unknown'), 'images': images}}
+        gallery = [images.variant_url(m, 'full') for m in a.media]
+        return {'status': 'ok', 'data': {'id': a.id, 'title': a.title, 'description': a.description, 'price': float(a.price), 'status': a.status, 'author_id': a.author_id, 'author_username': getattr(a.author, 'username', None), 'created_at': a.created_at.isoformat(), 'location': a.location, 'category_id': a.category_id, 'category_name': getattr(category, 'name', 'Unknown'), 'images': gallery, 'updated_at': _stamp(a)}}
 
     @jwt_required()
     def put(self, id):
@@ -97,12 +257,20 @@ class AdItem(Resource):
         if current != a.author_id and claims.get('role') not in ('admin', 'moderator'):
             return {'status': 'error', 'error': {'code':'forbidden','message':'Not allowed'}}, 403
         data = request.json
+        before = [getattr(a, f) for f in LIST_FIELDS]
+        facet_key = facets.facet_key(a)
         a.title = data.get('title', a.title)
         a.description = data.get('description', a.description)
         a.price = data.get('price', a.price)
         a.location = data.get('location', a.location)
         a.status = data.get('status', a.status)
+        search.index_ad(a)
+        facets.track(facet_key, facets.facet_key(a))
         db.session.commit()
+        if before != [getattr(a, f) for f in LIST_FIELDS]:
+            cache.purge('ad:' + a.id, 'ads:list')
+        else:
+            cache.purge('ad:' + a.id)
         return {'status': 'ok', 'data': {'id': a.id}}
 
     @jwt_required()
@@ -112,8 +280,19 @@ class AdItem(Resource):
         claims = get_jwt()
         if current != a.author_id and claims.get('role') not in ('admin', 'moderator'):
             return {'status': 'error', 'error': {'code':'forbidden','message':'Not allowed'}}, 403
+        search.remove_ad(a.id)
+        facets.track(facets.facet_key(a), None)
+        files = remove_ad_media(a)
+        partials = remove_ad_sessions(a)
+        # reports and conversations stay for the history, without the ad
+        Report.query.filter_by(ad_id=a.id).update({'ad_id': None}, synchronize_session=False)
+        Conversation.query.filter_by(ad_id=a.id).update({'ad_id': None}, synchronize_session=False)
+        db.session.expire(a, ['media', 'reports'])
         db.session.delete(a)
         db.session.commit()
+        delete_files(files)
+        discard_partials(partials)
+        cache.purge('ad:' + id, 'ad-card:' + id, 'ads:list')
         return {'status': 'ok'}
 
 
@@ -126,22 +305,24 @@ class AdMedia(Resource):
         current = get_jwt_identity()
         if current != a.author_id and get_jwt().get('role') not in ('admin','moderator'):
             return {'status':'error','error':{'code':'forbidden','message':'Not allowed'}},403
-        if 'file' not in request.files:
+        # "file" attaches one file; "files" (repeated) attaches several and returns a list
+        files = request.files.getlist('files')
+        if not files and 'file' not in request.files:
             return {'status':'error','error':{'code':'validation_failed','message':'No file provided'}},400
-        file = request.files['file']
-        uploads_dir = os.path.join(current_app.root_path, '..', 'uploads')
-        os.makedirs(uploads_dir, exist_ok=True)
-        filename = f"{id}_{file.filename}"
-        path = os.path.join(uploads_dir, filename)
-        file.save(path)
-        url_path = f"/uploads/{filename}"
-        m = Media(ad_id=id, url=url_path, type='image')
-        db.session.add(m)
+        error = _check_files(files or [request.files['file']])
+        if error:
+            return error
+        media = attach_files(a, _spool(files or [request.files['file']]))
         db.session.commit()
-        return {'status':'ok','data':{'id':m.id,'url':m.url}},201
+        for m in media:
+            images.process_later(m)
+        cache.purge('ad:' + id, 'ad-card:' + id)
+        data = [{'id': m.id, 'url': m.url} for m in media]
+        return {'status':'ok','data':data if files else data[0]},201
 
+    @conditional_get(_media_validator)
     def get(self, id):
         # list media for ad
-        items = Media.query.filter_by(ad_id=id).all()
-        data = [{'id': m.id, 'url': m.url, 'type': m.type} for m in items]
+        items = Media.query.filter_by(ad_id=id).order_by(Media.created_at, Media.id).all()
+        data = [{'id': m.id, 'url': m.url, 'type': m.type, **{name: images.variant_url(m, name) for name in images.VARIANTS}} for m in items]
         return {'status': 'ok', 'data': data}
\ No newline at end of file
@@ -0,0 +1,135 @@
+"""Publish/subscribe fan-out of live events (new chat messages).
+
+Write handlers ``publish`` a JSON-able payload on a channel after they commit;
+streaming endpoints ``subscribe`` and read from the subscription. The broker only
+carries notifications: the database stays the record, and a reconnecting client
+catches up from it, so an event lost on the way costs nothing but latency.
+
+* ``LocalBroker`` fans out inside one process; enough for a single worker;
+* ``RedisBroker`` goes through Redis pub/sub (or anything speaking it), so a
+  message posted to one worker reaches streams held by the others.
+
+``BROKER_URL`` picks the implementation; ``get_broker()`` returns the app's instance.
+"""
+import json
+import queue
+import threading
+from flask import current_app
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+_lock = threading.Lock()
+
+# events buffered per subscriber; past that new ones are dropped (the client catches up on reconnect)
+QUEUE_SIZE = 1000
+
+
+class LocalSubscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(QUEUE_SIZE)
+
+    def put(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            pass
+
+    def get(self, timeout=None):
+        """Next payload, or None if nothing arrived within timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+
+class LocalBroker:
+    name = 'local'
+
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, payload):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for sub in subscribers:
+            sub.put(payload)
+
+    def subscribe(self, channel):
+        sub = LocalSubscription(self, channel)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            subscribers = self._channels.get(sub.channel)
+            if subscribers is not None:
+                subscribers.discard(sub)
+                if not subscribers:
+                    del self._channels[sub.channel]
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get(self, timeout=None):
+        message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        return json.loads(message['data']) if message else None
+
+    def close(self):
+        self.pubsub.close()
+
+
+class RedisBroker:
+    name = 'redis'
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError('BROKER_URL=redis://... needs the redis package installed')
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def publish(self, channel, payload):
+        self.client.publish(channel, json.dumps(payload))
+
+    def subscribe(self, channel):
+        pubsub = self.client.pubsub()
+        pubsub.subscribe(channel)
+        return RedisSubscription(pubsub)
+
+
+def create_broker(config):
+    url = config['BROKER_URL']
+    if url and url.split(':', 1)[0] in ('redis', 'rediss', 'unix'):
+        return RedisBroker(url)
+    return LocalBroker()
+
+
+def get_broker():
+    app = current_app._get_current_object()
+    broker = app.extensions.get('broker')
+    if broker is None:
+        with _lock:
+            broker = app.extensions.get('broker')
+            if broker is None:
+                broker = app.extensions['broker'] = create_broker(app.config)
+    return broker
+
+
+def publish(channel, payload):
+    """Publish after the commit; a broker outage must not fail the write that triggered it."""
+    try:
+        get_broker().publish(channel, payload)
+    except Exception:
+        current_app.logger.warning('could not publish to %s', channel, exc_info=True)
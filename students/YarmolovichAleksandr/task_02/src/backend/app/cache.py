@@ -0,0 +1,185 @@
+"""In-process response cache for anonymous GET endpoints.
+
+Entries are keyed on the path plus the normalized query string and carry
+surrogate keys (tags) such as ``ad:<id>`` or ``ads:list``; write handlers purge
+tags after they commit. An expired entry is still served for
+``RESPONSE_CACHE_STALE_TTL`` seconds while one background thread rebuilds it,
+so a hot key never sends a burst of identical queries to the database.
+
+The cache lives in each worker process: purges are immediate in the worker that
+handled the write, other workers converge within ``RESPONSE_CACHE_TTL``.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request, copy_current_request_context
+
+CACHEABLE_STATUS = (200, 404)
+
+
+class _Entry:
+    __slots__ = ('value', 'tags', 'fresh_until', 'stale_until')
+
+    def __init__(self, value, tags, fresh_until, stale_until):
+        self.value = value
+        self.tags = tags
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class CacheStore:
+    def __init__(self, ttl, stale_ttl, max_entries, clock=time.monotonic):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self._refreshing = {}
+        # bumped by every purge; a rebuild that started before a purge must not store its result
+        self.generation = 0
+
+    def lookup(self, key):
+        """Return (value, state) where state is 'fresh', 'stale' or None."""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            if now < entry.fresh_until:
+                self._entries.move_to_end(key)
+                return entry.value, 'fresh'
+            if now < entry.stale_until:
+                return entry.value, 'stale'
+            self._remove(key)
+            return None, None
+
+    def store(self, key, value, tags, generation):
+        now = self.clock()
+        with self._lock:
+            if generation != self.generation:
+                return False
+            self._remove(key)
+            self._entries[key] = _Entry(value, frozenset(tags), now + self.ttl, now + self.ttl + self.stale_ttl)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            return True
+
+    def purge(self, *tags):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def start_refresh(self, key, target):
+        """Run target in a background thread unless a refresh of key is already running."""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            thread = threading.Thread(target=self._run_refresh, args=(key, target), daemon=True)
+            self._refreshing[key] = thread
+        thread.start()
+        return True
+
+    def wait_refreshes(self, timeout=None):
+        for thread in list(self._refreshing.values()):
+            thread.join(timeout)
+
+    def _run_refresh(self, key, target):
+        try:
+            target()
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class ResponseCache:
+    def init_app(self, app):
+        app.config.setdefault('RESPONSE_CACHE_TTL', 30)
+        app.config.setdefault('RESPONSE_CACHE_STALE_TTL', 10)
+        app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', 2000)
+        if app.config['RESPONSE_CACHE_TTL'] > 0:
+            app.extensions['response_cache'] = CacheStore(
+                app.config['RESPONSE_CACHE_TTL'],
+                app.config['RESPONSE_CACHE_STALE_TTL'],
+                app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+            )
+
+    @property
+    def store(self):
+        return current_app.extensions.get('response_cache')
+
+    def purge(self, *tags):
+        store = self.store
+        if store is not None:
+            store.purge(*tags)
+
+
+cache = ResponseCache()
+
+
+def cache_key():
+    args = sorted((k, v) for k, v in request.args.items(multi=True) if v != '')
+    return request.path + '?' + '&'.join(f'{k}={v}' for k, v in args)
+
+
+def _split(rv):
+    if isinstance(rv, tuple):
+        return rv[0], rv[1] if len(rv) > 1 else 200
+    return rv, 200
+
+
+def cached(tags):
+    """Cache an anonymous GET handler; tags(body, **kwargs) returns its surrogate keys."""
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            store = cache.store
+            if store is None or request.headers.get('Authorization'):
+                return fn(*args, **kwargs)
+            key = cache_key()
+            value, state = store.lookup(key)
+            if state == 'fresh':
+                return value
+
+            def build():
+                generation = store.generation
+                rv = fn(*args, **kwargs)
+                body, status = _split(rv)
+                if status in CACHEABLE_STATUS:
+                    store.store(key, rv, tags(body, **kwargs), generation)
+                return rv
+
+            if state == 'stale':
+                store.start_refresh(key, copy_current_request_context(build))
+                return value
+            return build()
+        return decorator
+    return wrapper
@@ -1,9 +1,13 @@
+import threading
+from datetime import datetime
 from flask_restx import Namespace, Resource, fields
-from flask import request
-from .models import Category
-from .extensions import db
-from .utils import role_required
+from flask import request, current_app
 from flask_jwt_extended import jwt_required
+from .models import Category, CategoryClosure, VersionCounter, Ad
+from .extensions import db
+from .cache import cache
+from .utils import role_required, increment
+from .conditional import conditional_get, weak_etag
 
 ns = Namespace('categories', description='Category operations')
 
@@ -14,8 +18,120 @@ category_model = ns.model('Category', {
 })
 
 
+def subtree_ids(category_id):
+    """Select of category_id and all of its descendants: one indexed closure lookup."""
+    return db.select(CategoryClosure.descendant_id).where(CategoryClosure.ancestor_id == category_id)
+
+
+def closure_rows(parents):
+    """(ancestor_id, descendant_id, depth) rows for a {id: parent_id} mapping."""
+    rows = []
+    for category_id in parents:
+        node, depth, seen = category_id, 0, set()
+        while node is not None and node in parents and node not in seen:
+            rows.append((node, category_id, depth))
+            seen.add(node)
+            node, depth = parents[node], depth + 1
+    return rows
+
+
+def rebuild_closure():
+    db.session.query(CategoryClosure).delete()
+    parents = dict(db.session.query(Category.id, Category.parent_id).all())
+    db.session.add_all([CategoryClosure(ancestor_id=a, descendant_id=d, depth=n) for a, d, n in closure_rows(parents)])
+    db.session.commit()
+
+
+def _attach(category_id, parent_id):
+    """Link the subtree rooted at category_id under parent_id and all of its ancestors."""
+    if not parent_id:
+        return
+    above = db.aliased(CategoryClosure)
+    below = db.aliased(CategoryClosure)
+    db.session.execute(db.insert(CategoryClosure).from_select(
+        ['ancestor_id', 'descendant_id', 'depth'],
+        db.select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+        .select_from(above).join(below, db.true())
+        .where(above.descendant_id == parent_id, below.ancestor_id == category_id),
+    ))
+
+
+def _detach(category_id):
+    """Drop the paths that lead into the subtree of category_id from outside it."""
+    subtree = subtree_ids(category_id)
+    db.session.execute(db.delete(CategoryClosure).where(
+        CategoryClosure.descendant_id.in_(subtree), CategoryClosure.ancestor_id.not_in(subtree)))
+
+
+def _move(category, parent_id):
+    _detach(category.id)
+    category.parent_id = parent_id
+    _attach(category.id, parent_id)
+
+
+def _invalid_parent(category_id, parent_id):
+    if not parent_id:
+        return None
+    if db.session.get(Category, parent_id) is None:
+        return 'Родительская категория не найдена.'
+    if category_id and db.session.get(CategoryClosure, (category_id, parent_id)) is not None:
+        return 'Категория не может быть вложена в саму себя.'
+    return None
+
+
+def categories_version():
+    row = db.session.get(VersionCounter, 'categories')
+    return row.value if row else 0
+
+
+def _bump_version():
+    # part of the admin write's transaction, so readers never see a new version without the change
+    increment(VersionCounter, {'name': 'categories'}, 'value')
+
+
+def _categories_validator(**kwargs):
+    return weak_etag('categories', categories_version()), None
+
+
+def _tree_validator(**kwargs):
+    return weak_etag('category-tree', categories_version()), None
+
+
+def _build_tree(categories):
+    nodes = {c.id: {'id': c.id, 'name': c.name, 'parent_id': c.parent_id, 'children': []} for c in categories}
+    roots = []
+    for node in sorted(nodes.values(), key=lambda n: n['name'].lower()):
+        parent = nodes.get(node['parent_id'])
+        (parent['children'] if parent else roots).append(node)
+    return roots
+
+
+class _TreeMemo:
+    """The tree of the last seen version, built at most once per version in each process."""
+
+    def __init__(self):
+        self.version = None
+        self.tree = None
+        self.lock = threading.Lock()
+
+    def get(self, version):
+        if self.version != version:
+            with self.lock:
+                if self.version != version:
+                    self.tree = _build_tree(Category.query.all())
+                    self.version = version
+        return self.tree
+
+
+def category_tree():
+    memo = current_app.extensions.setdefault('category_tree', _TreeMemo())
+    version = categories_version()
+    return version, memo.get(version)
+
+
 @ns.route('')
 class CategoryList(Resource):
+    @conditional_get(_categories_validator)
     def get(self):
         cats = Category.query.all()
         data = [{'id': c.id, 'name': c.name, 'parent_id': c.parent_id} for c in cats]
@@ -28,12 +144,28 @@ class CategoryList(Resource):
         data = request.json
         if not data.get('name'):
             return {'status': 'error', 'error': {'code': 'validation_failed', 'message': 'Введите название категории.'}}, 400
-        cat = Category(name=data['name'], parent_id=data.get('parent_id'))
+        parent_id = data.get('parent_id') or None
+        error = _invalid_parent(None, parent_id)
+        if error:
+            return {'status': 'error', 'error': {'code': 'validation_failed', 'message': error}}, 400
+        cat = Category(name=data['name'], parent_id=parent_id)
         db.session.add(cat)
+        db.session.flush()
+        db.session.add(CategoryClosure(ancestor_id=cat.id, descendant_id=cat.id, depth=0))
+        _attach(cat.id, parent_id)
+        _bump_version()
         db.session.commit()
         return {'status': 'ok', 'data': {'id': cat.id, 'name': cat.name}}, 201
 
 
+@ns.route('/tree')
+class CategoryTree(Resource):
+    @conditional_get(_tree_validator)
+    def get(self):
+        version, tree = category_tree()
+        return {'status': 'ok', 'data': tree, 'version': version}
+
+
 @ns.route('/<string:id>')
 class CategoryItem(Resource):
     def get(self, id):
@@ -46,15 +178,35 @@ class CategoryItem(Resource):
     def put(self, id):
         c = Category.query.get_or_404(id)
         data = request.json
+        renamed = data.get('name', c.name) != c.name
         c.name = data.get('name', c.name)
-        c.parent_id = data.get('parent_id', c.parent_id)
+        if renamed:
+            # ad pages show the category name: move their stamps so ETag/Last-Modified change with it
+            db.session.query(Ad).filter(Ad.category_id == c.id).update({Ad.updated_at: datetime.utcnow()}, synchronize_session=False)
+        parent_id = data.get('parent_id', c.parent_id) or None
+        moved = parent_id != c.parent_id
+        if moved:
+            error = _invalid_parent(c.id, parent_id)
+            if error:
+                return {'status': 'error', 'error': {'code': 'validation_failed', 'message': error}}, 400
+            _move(c, parent_id)
+        _bump_version()
         db.session.commit()
+        if moved or renamed:
+            cache.purge('ads:list', 'category:' + c.id)
         return {'status': 'ok', 'data': {'id': c.id, 'name': c.name}}
 
     @jwt_required()
     @role_required(['admin'])
     def delete(self, id):
         c = Category.query.get_or_404(id)
+        # children move up to the deleted category's parent so their subtrees stay reachable
+        for child in Category.query.filter_by(parent_id=c.id).all():
+            _move(child, c.parent_id)
+        db.session.query(CategoryClosure).filter(
+            (CategoryClosure.ancestor_id == c.id) | (CategoryClosure.descendant_id == c.id)).delete(synchronize_session=False)
         db.session.delete(c)
+        _bump_version()
         db.session.commit()
+        cache.purge('ads:list')
         return {'status': 'ok'}
\ No newline at end of file
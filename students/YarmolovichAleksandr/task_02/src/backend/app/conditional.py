@@ -0,0 +1,84 @@
+"""Weak ETag / Last-Modified support for GET handlers.
+
+ETags are built from a few version stamps (ids and ``updated_at`` values), never
+by hashing the serialized response, so answering a revalidation is cheap:
+
+* ``conditional_get(validator)`` asks the validator *before* running the handler
+  and answers 304 without building the response at all;
+* ``etag_from_body(stamps)`` derives the tag from the stamps already present in
+  the (usually cached) response body.
+"""
+import hashlib
+from functools import wraps
+from flask import request, Response
+from werkzeug.http import http_date, quote_etag
+
+
+def weak_etag(*parts):
+    digest = hashlib.sha1('|'.join('' if p is None else str(p) for p in parts).encode()).hexdigest()[:20]
+    return quote_etag(digest, weak=True)
+
+
+def _not_modified(etag, last_modified):
+    # If-None-Match wins over If-Modified-Since when both are sent (RFC 9110 13.2.2)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag.split('"')[1])
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def _headers(etag, last_modified):
+    headers = {'ETag': etag}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def _attach(rv, headers):
+    if isinstance(rv, Response):
+        rv.headers.update(headers)
+        return rv
+    if isinstance(rv, tuple):
+        body, status = rv[0], rv[1] if len(rv) > 1 else 200
+        if status != 200:
+            return rv
+        extra = dict(rv[2]) if len(rv) > 2 else {}
+        extra.update(headers)
+        return body, status, extra
+    return rv, 200, headers
+
+
+def conditional_get(validator):
+    """validator(**kwargs) -> (etag, last_modified or None), or None to skip."""
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            validators = validator(**kwargs)
+            if validators is None:
+                return fn(*args, **kwargs)
+            headers = _headers(*validators)
+            if _not_modified(*validators):
+                return Response(status=304, headers=headers)
+            return _attach(fn(*args, **kwargs), headers)
+        return decorator
+    return wrapper
+
+
+def etag_from_body(stamps):
+    """stamps(body) -> (list of version parts, last_modified or None)."""
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            rv = fn(*args, **kwargs)
+            body, status = (rv[0], rv[1] if len(rv) > 1 else 200) if isinstance(rv, tuple) else (rv, 200)
+            if status != 200:
+                return rv
+            parts, last_modified = stamps(body)
+            etag = weak_etag(request.full_path, *parts)
+            headers = _headers(etag, last_modified)
+            if _not_modified(etag, last_modified):
+                return Response(status=304, headers=headers)
+            return _attach(rv, headers)
+        return decorator
+    return wrapper
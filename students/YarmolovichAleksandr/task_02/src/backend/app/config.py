@@ -9,3 +9,55 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI", "sqlite:///dev.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     RESTX_MASK_SWAGGER = False
+    # list endpoints: default page size and hard cap for ?limit=
+    DEFAULT_PAGE_LIMIT = int(os.getenv("DEFAULT_PAGE_LIMIT", 50))
+    MAX_PAGE_LIMIT = int(os.getenv("MAX_PAGE_LIMIT", 100))
+    # anonymous GET /api/ads and /api/ads/<id> response cache (0 disables it)
+    RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 30))
+    RESPONSE_CACHE_STALE_TTL = int(os.getenv("RESPONSE_CACHE_STALE_TTL", 10))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 2000))
+    # uploaded media; unfinished resumable uploads live outside it so they are never served
+    UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads"))
+    UPLOAD_PARTIAL_FOLDER = os.getenv("UPLOAD_PARTIAL_FOLDER", os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads_partial"))
+    UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 25 * 1024 * 1024))
+    # media storage driver: "local" (UPLOAD_FOLDER) or "s3" (any S3-compatible service, needs boto3)
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+    S3_BUCKET = os.getenv("S3_BUCKET")
+    S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+    S3_REGION = os.getenv("S3_REGION")
+    S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID")
+    S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY")
+    # base URL media is served from (bucket website, CDN); defaults to the bucket URL
+    S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL")
+    # lifetime in seconds of presigned direct-upload URLs
+    S3_PRESIGN_EXPIRES = int(os.getenv("S3_PRESIGN_EXPIRES", 900))
+    # Cache-Control max-age of /uploads: content-addressed files are immutable, older names are not
+    UPLOAD_MAX_AGE = int(os.getenv("UPLOAD_MAX_AGE", 3600))
+    UPLOAD_IMMUTABLE_MAX_AGE = int(os.getenv("UPLOAD_IMMUTABLE_MAX_AGE", 365 * 24 * 3600))
+    # hand /uploads transfers to the proxy: "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd)
+    UPLOAD_SENDFILE = os.getenv("UPLOAD_SENDFILE") or None
+    # internal nginx location that maps to UPLOAD_FOLDER (x-accel-redirect mode)
+    UPLOAD_ACCEL_PREFIX = os.getenv("UPLOAD_ACCEL_PREFIX", "/_uploads/")
+    # threads hashing/storing the files of one multi-file upload, and the most files it may carry
+    UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 4))
+    UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", 10))
+    # threads rendering image thumbnails/WebP renditions (0 disables them)
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+    # live message events: "redis://..." fans out across workers (needs redis), unset = within one process
+    BROKER_URL = os.getenv("BROKER_URL") or None
+    # seconds between keep-alive comments on an event stream, and before the server ends it
+    SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", 15))
+    SSE_MAX_DURATION = float(os.getenv("SSE_MAX_DURATION", 300))
+    # batch chat messages posted within GROUP_COMMIT_WINDOW seconds (up to GROUP_COMMIT_MAX_BATCH) into one commit
+    MESSAGE_GROUP_COMMIT = os.getenv("MESSAGE_GROUP_COMMIT", "").lower() in ("1", "true", "yes")
+    GROUP_COMMIT_WINDOW = float(os.getenv("GROUP_COMMIT_WINDOW", 0.005))
+    GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", 100))
+    # seconds a request waits for its batch to be committed
+    GROUP_COMMIT_TIMEOUT = float(os.getenv("GROUP_COMMIT_TIMEOUT", 5))
+    # seconds an upload session survives without receiving a chunk
+    UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 3600))
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
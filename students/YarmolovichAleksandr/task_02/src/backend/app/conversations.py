@@ -1,7 +1,17 @@
 from flask_restx import Namespace, Resource, fields
-from flask import request
+from flask import request, current_app, Response
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from datetime import datetime
+import json
+import time
 from .models import Conversation, Message, Ad, User
 from .extensions import db
+from .broker import get_broker, publish
+from . import search
+from .group_commit import get_committer, GroupCommitTimeout
+from .pagination import encode_cursor, decode_cursor, get_limit, InvalidCursor, invalid_cursor_response
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 ns = Namespace('conversations', description='Conversations and messages')
@@ -16,19 +26,134 @@ msg_model = ns.model('Message', {
 })
 
 
+# characters of the last message shown in the inbox
+PREVIEW_LENGTH = 100
+
+
+def _slot(conv, user_id):
+    """1 or 2: which user*_ columns of conv belong to user_id."""
+    return 1 if user_id == conv.user1_id else 2
+
+
+def _add_unread(conv, user_id, delta):
+    """Move user_id's unread counter of conv, and their total, by delta (atomic SQL increments)."""
+    column = getattr(Conversation, f'user{_slot(conv, user_id)}_unread')
+    db.session.query(Conversation).filter(Conversation.id == conv.id).update({column: column + delta}, synchronize_session=False)
+    db.session.query(User).filter(User.id == user_id).update({User.unread_messages: User.unread_messages + delta}, synchronize_session=False)
+    db.session.expire(conv, [column.key])
+
+
+def mark_read(conv, user_id, at=None):
+    """Everything in conv up to `at` (default: all of it) has been seen by user_id.
+
+    Moves the read marker forward only and resets the unread counters to what is left after
+    it; returns the new marker, or None if it did not move.
+    """
+    slot = _slot(conv, user_id)
+    read_at = getattr(conv, f'user{slot}_read_at')
+    if at is not None and read_at is not None and at <= read_at:
+        return None
+    # writing the marker first takes the conversation row, as posting does, so no message
+    # can land between reading the counter and resetting it
+    setattr(conv, f'user{slot}_read_at', at or datetime.utcnow())
+    db.session.flush()
+    unread_column = getattr(Conversation, f'user{slot}_unread')
+    unread, last_activity_at = db.session.query(unread_column, Conversation.last_activity_at).filter(Conversation.id == conv.id).one()
+    if at is None or at >= last_activity_at:
+        remaining = 0
+    else:
+        # what is left: a range of ix_messages_conversation_created_at_id
+        remaining = Message.query.filter(Message.conversation_id == conv.id, Message.author_id != user_id, Message.created_at > at).count()
+    if remaining != unread:
+        _add_unread(conv, user_id, remaining - unread)
+    return getattr(conv, f'user{slot}_read_at')
+
+
+def recount_unread():
+    """Recount every unread counter from the read markers, e.g. after messages were removed by hand."""
+    for n in (1, 2):
+        read_at = getattr(Conversation, f'user{n}_read_at')
+        count = db.select(db.func.count(Message.id)).where(
+            Message.conversation_id == Conversation.id, Message.author_id != getattr(Conversation, f'user{n}_id'),
+            db.or_(read_at.is_(None), Message.created_at > read_at)).scalar_subquery()
+        db.session.query(Conversation).update({getattr(Conversation, f'user{n}_unread'): count}, synchronize_session=False)
+    totals = [db.select(db.func.coalesce(db.func.sum(getattr(Conversation, f'user{n}_unread')), 0)).where(
+        getattr(Conversation, f'user{n}_id') == User.id).scalar_subquery() for n in (1, 2)]
+    db.session.query(User).update({User.unread_messages: totals[0] + totals[1]}, synchronize_session=False)
+    db.session.commit()
+
+
+def _publish_read(conv, user_id, read_at):
+    publish(message_channel(conv.id), {'event': 'read', 'data': {'user_id': user_id, 'read_at': read_at.isoformat()}})
+
+
+def open_conversation(ad_id, user_a, user_b):
+    """The conversation of two users about an ad, created if missing; returns (conversation, created).
+
+    The pair is stored in canonical order, so both sides hit the same row of
+    uq_conversations_ad_users, and the insert skips a conflicting row instead of checking
+    first: concurrent opens end up with one conversation.
+    """
+    user1_id, user2_id = sorted((user_a, user_b))
+    keys = {'ad_id': ad_id, 'user1_id': user1_id, 'user2_id': user2_id}
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite if dialect == 'sqlite' else postgresql).insert(Conversation).values(**keys)
+        created = db.session.execute(insert.on_conflict_do_nothing(index_elements=list(keys))).rowcount == 1
+    else:
+        try:
+            with db.session.begin_nested():
+                db.session.add(Conversation(**keys))
+            created = True
+        except IntegrityError:
+            created = False
+    return Conversation.query.filter_by(**keys).one(), created
+
+
+def inbox_query(user_id):
+    """One row per conversation of user_id: (conversation, partner name, ad title, last message preview,
+    its author, its time, unread count), all from a single statement."""
+    mine = Conversation.user1_id == user_id
+    partner = aliased(User)
+    last = aliased(Message)
+    partner_id = db.case((mine, Conversation.user2_id), else_=Conversation.user1_id)
+    unread = db.case((mine, Conversation.user1_unread), else_=Conversation.user2_unread)
+    return db.session.query(
+        Conversation, partner.username, Ad.title, db.func.substr(last.text, 1, PREVIEW_LENGTH), last.author_id, last.created_at, unread,
+    ).outerjoin(partner, partner.id == partner_id).outerjoin(Ad, Ad.id == Conversation.ad_id).outerjoin(
+        last, last.id == Conversation.last_message_id,
+    ).filter(mine | (Conversation.user2_id == user_id))
+
+
 @ns.route('')
 class ConversationList(Resource):
     @jwt_required()
     def get(self):
+        # inbox, most recently active first; keyset-paginated with ?cursor=
         user_id = get_jwt_identity()
-        convs = Conversation.query.filter((Conversation.user1_id==user_id)|(Conversation.user2_id==user_id)).all()
+        limit = get_limit()
+        q = inbox_query(user_id)
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                key, last_id = decode_cursor(cursor, 2)
+                key = datetime.fromisoformat(key)
+            except (InvalidCursor, ValueError, TypeError):
+                return invalid_cursor_response()
+            q = q.filter(db.tuple_(Conversation.last_activity_at, Conversation.id) < (key, last_id))
+        rows = q.order_by(Conversation.last_activity_at.desc(), Conversation.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1][0]
+            next_cursor = encode_cursor(last.last_activity_at.isoformat(), last.id)
         data = []
-        for c in convs:
+        for c, partner_username, ad_title, preview, author_id, sent_at, unread in rows:
             partner_id = c.user1_id if c.user2_id == user_id else c.user2_id
-            partner = User.query.get(partner_id)
-            ad = Ad.query.get(c.ad_id)
-            data.append({'id': c.id, 'ad_id': c.ad_id, 'ad_title': getattr(ad, 'title', None), 'partner_id': partner_id, 'partner_username': getattr(partner, 'username', None)})
-        return {'status':'ok','data':data}
+            last_message = {'text': preview, 'author_id': author_id, 'created_at': sent_at.isoformat()} if sent_at else None
+            data.append({'id': c.id, 'ad_id': c.ad_id, 'ad_title': ad_title, 'partner_id': partner_id, 'partner_username': partner_username,
+                         'last_message': last_message, 'unread_count': unread, 'last_activity_at': c.last_activity_at.isoformat()})
+        return {'status':'ok','data':data,'next_cursor':next_cursor}
 
     @ns.expect(create_conv_model)
     @jwt_required()
@@ -39,16 +164,56 @@ class ConversationList(Resource):
         partner = data['partnerId']
         if partner == user_id:
             return {'status':'error','error':{'code':'validation_failed','message':'Cannot create conversation with self'}},400
-        # ensure conversation doesn't exist
-        c = Conversation.query.filter_by(ad_id=ad.id).filter(
-            ((Conversation.user1_id==user_id)&(Conversation.user2_id==partner))|((Conversation.user1_id==partner)&(Conversation.user2_id==user_id))
-        ).first()
-        if c:
-            return {'status':'ok','data':{'id':c.id}},200
-        conv = Conversation(ad_id=ad.id, user1_id=user_id, user2_id=partner)
-        db.session.add(conv)
+        conv, created = open_conversation(ad.id, user_id, partner)
         db.session.commit()
-        return {'status':'ok','data':{'id':conv.id}},201
+        return {'status':'ok','data':{'id':conv.id}},201 if created else 200
+
+
+@ns.route('/unread')
+class ConversationUnread(Resource):
+    @jwt_required()
+    def get(self):
+        # header badge: one primary key read
+        total = db.session.query(User.unread_messages).filter(User.id == get_jwt_identity()).scalar()
+        return {'status':'ok','data':{'unread':total or 0}}
+
+
+@ns.route('/search')
+class ConversationSearch(Resource):
+    @jwt_required()
+    def get(self):
+        """Messages of my conversations matching ?query=, best match first; keyset-paginated with ?cursor=."""
+        user_id = get_jwt_identity()
+        query = (request.args.get('query') or '').strip()
+        matches = search.message_matches(query, user_id) if query else None
+        if matches is None:
+            return {'status':'error','error':{'code':'validation_failed','message':'query is required'}},400
+        limit = get_limit()
+        partner = aliased(User)
+        mine = Conversation.user1_id == user_id
+        partner_id = db.case((mine, Conversation.user2_id), else_=Conversation.user1_id)
+        q = db.session.query(Message, matches.c.rank, Ad.title, partner.username).join(
+            matches, matches.c.message_id == Message.id,
+        ).join(Conversation, Conversation.id == Message.conversation_id).outerjoin(
+            Ad, Ad.id == Conversation.ad_id,
+        ).outerjoin(partner, partner.id == partner_id).filter(mine | (Conversation.user2_id == user_id))
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                rank, last_id = decode_cursor(cursor, 2)
+                rank = float(rank)
+            except (InvalidCursor, ValueError, TypeError):
+                return invalid_cursor_response()
+            q = q.filter(db.tuple_(matches.c.rank, Message.id) > (rank, last_id))
+        rows = q.order_by(matches.c.rank, Message.id).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0].id)
+        data = [{'id': m.id, 'conversation_id': m.conversation_id, 'author_id': m.author_id, 'created_at': m.created_at.isoformat(),
+                 'ad_title': ad_title, 'partner_username': partner_username, 'snippet': search.highlight(m.text, query)}
+                for m, _, ad_title, partner_username in rows]
+        return {'status':'ok','data':data,'next_cursor':next_cursor}
 
 
 @ns.route('/<string:id>')
@@ -64,6 +229,44 @@ class ConversationItem(Resource):
         return {'status':'ok','data':{'id':conv.id,'ad_id':conv.ad_id,'user1_id':conv.user1_id,'user1_username':getattr(user1,'username',None),'user2_id':conv.user2_id,'user2_username':getattr(user2,'username',None)}}
 
 
+def message_channel(conversation_id):
+    return 'conversation:' + conversation_id
+
+
+def serialize_message(m, author_username):
+    return {'id': m.id, 'conversation_id': m.conversation_id, 'text': m.text, 'author_id': m.author_id,
+            'author_username': author_username, 'created_at': m.created_at.isoformat()}
+
+
+def write_message(conversation_id, user_id, text):
+    """Add a message and the conversation state that follows from it (not committed); returns its event payload."""
+    conv = db.session.get(Conversation, conversation_id)
+    msg = Message(conversation_id=conversation_id, author_id=user_id, text=text, created_at=datetime.utcnow())
+    db.session.add(msg)
+    db.session.flush()
+    conv.last_message_id = msg.id
+    conv.last_activity_at = msg.created_at
+    mark_read(conv, user_id, msg.created_at)
+    _add_unread(conv, conv.user2_id if _slot(conv, user_id) == 1 else conv.user1_id, 1)
+    search.index_message(msg, conv)
+    author = db.session.get(User, user_id)
+    return serialize_message(msg, getattr(author, 'username', None))
+
+
+def _sse(event, data, id=None):
+    lines = ([f'id: {id}'] if id else []) + [f'event: {event}', 'data: ' + json.dumps(data)]
+    return '\n'.join(lines) + '\n\n'
+
+
+def _message_cursor(m):
+    return encode_cursor(m.created_at.isoformat(), m.id)
+
+
+def _message_key(cursor):
+    created_at, id = decode_cursor(cursor, 2)
+    return datetime.fromisoformat(created_at), id
+
+
 @ns.route('/<string:id>/messages')
 class ConversationMessages(Resource):
     @jwt_required()
@@ -72,12 +275,37 @@ class ConversationMessages(Resource):
         conv = Conversation.query.get_or_404(id)
         if user_id not in (conv.user1_id, conv.user2_id):
             return {'status':'error','error':{'code':'forbidden','message':'Not a participant'}},403
-        msgs = Message.query.filter_by(conversation_id=id).order_by(Message.created_at.asc()).all()
-        data = []
-        for m in msgs:
-            author = User.query.get(m.author_id)
-            data.append({'id': m.id, 'text': m.text, 'author_id': m.author_id, 'author_username': getattr(author, 'username', None), 'created_at': m.created_at.isoformat()})
-        return {'status':'ok','data':data}
+        # a page of history in chronological order: the newest messages by default,
+        # ?before=<cursor> for older ones, ?after=<cursor> for newer ones (polling)
+        limit = get_limit()
+        before, after = request.args.get('before'), request.args.get('after')
+        key = Message.created_at, Message.id
+        q = Message.query.filter(Message.conversation_id == id)
+        try:
+            if before:
+                q = q.filter(db.tuple_(*key) < _message_key(before))
+            if after:
+                q = q.filter(db.tuple_(*key) > _message_key(after))
+        except (InvalidCursor, ValueError, TypeError):
+            return invalid_cursor_response()
+        if after:
+            # polling resumes from after_cursor either way, so no look-ahead row is needed
+            msgs = q.order_by(Message.created_at.asc(), Message.id.asc()).limit(limit).all()
+            older = True
+        else:
+            msgs = q.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1).all()
+            older = len(msgs) > limit
+            msgs = msgs[:limit][::-1]
+        # only the two participants can have written: their names in one query, not one per message
+        names = dict(db.session.query(User.id, User.username).filter(User.id.in_((conv.user1_id, conv.user2_id))))
+        data = [{'id': m.id, 'text': m.text, 'author_id': m.author_id, 'author_username': names.get(m.author_id), 'created_at': m.created_at.isoformat()} for m in msgs]
+        partner_read_at = conv.user2_read_at if _slot(conv, user_id) == 1 else conv.user1_read_at
+        # reading history has no side effects: clients mark what was shown with POST /<id>/read
+        return {'status':'ok','data':data,
+                'before_cursor':_message_cursor(msgs[0]) if msgs and older else None,
+                'after_cursor':_message_cursor(msgs[-1]) if msgs else after,
+                # read receipt: the partner has seen my messages up to here
+                'partner_read_at':partner_read_at.isoformat() if partner_read_at else None}
 
     @ns.expect(msg_model)
     @jwt_required()
@@ -89,7 +317,97 @@ class ConversationMessages(Resource):
         data = request.json
         if not data.get('text'):
             return {'status':'error','error':{'code':'validation_failed','message':'Message text required'}},400
-        msg = Message(conversation_id=id, author_id=user_id, text=data['text'])
-        db.session.add(msg)
+        if current_app.config['MESSAGE_GROUP_COMMIT']:
+            # end this session's read transaction: the writer thread needs the database lock
+            db.session.close()
+            try:
+                event = get_committer().submit(write_message, id, user_id, data['text'], timeout=current_app.config['GROUP_COMMIT_TIMEOUT'])
+            except GroupCommitTimeout:
+                return {'status':'error','error':{'code':'unavailable','message':'Message was not stored in time, retry later'}},503
+        else:
+            event = write_message(id, user_id, data['text'])
+            db.session.commit()
+        publish(message_channel(id), {'event': 'message', 'data': event})
+        return {'status':'ok','data':{'id':event['id'],'text':event['text'],'created_at':event['created_at']}},201
+
+
+@ns.route('/<string:id>/read')
+class ConversationRead(Resource):
+    @jwt_required()
+    def post(self, id):
+        """Mark the conversation read, up to {"message_id": ...} or entirely."""
+        user_id = get_jwt_identity()
+        conv = Conversation.query.get_or_404(id)
+        if user_id not in (conv.user1_id, conv.user2_id):
+            return {'status':'error','error':{'code':'forbidden','message':'Not a participant'}},403
+        at = None
+        message_id = (request.get_json(silent=True) or {}).get('message_id')
+        if message_id:
+            m = db.session.get(Message, message_id)
+            if m is None or m.conversation_id != id:
+                return {'status':'error','error':{'code':'not_found','message':'Message not found'}},404
+            at = m.created_at
+        read_at = mark_read(conv, user_id, at)
+        slot = _slot(conv, user_id)
+        data = {'read_at': getattr(conv, f'user{slot}_read_at').isoformat(), 'unread': getattr(conv, f'user{slot}_unread')}
+        data['total_unread'] = db.session.query(User.unread_messages).filter(User.id == user_id).scalar()
         db.session.commit()
-        return {'status':'ok','data':{'id':msg.id,'text':msg.text,'created_at':msg.created_at.isoformat()}},201
\ No newline at end of file
+        if read_at:
+            _publish_read(conv, user_id, read_at)
+        return {'status':'ok','data':data}
+
+
+@ns.route('/<string:id>/events')
+class ConversationEvents(Resource):
+    @jwt_required()
+    def get(self, id):
+        """Server-Sent Events stream of new messages (event "message", id = message id) and
+        read receipts (event "read": a participant has seen everything up to read_at).
+
+        A client that reconnects with Last-Event-ID (or ?last_event_id=) first gets the
+        messages it missed from the database; if there are more than MAX_PAGE_LIMIT of
+        them it gets a "reset" event and should reload the history instead.
+        """
+        user_id = get_jwt_identity()
+        conv = Conversation.query.get_or_404(id)
+        if user_id not in (conv.user1_id, conv.user2_id):
+            return {'status':'error','error':{'code':'forbidden','message':'Not a participant'}},403
+        # subscribe before reading the backlog, so nothing posted in between is lost
+        sub = get_broker().subscribe(message_channel(id))
+        backlog, reset = [], False
+        seen = db.session.get(Message, request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or '')
+        if seen is not None and seen.conversation_id == id:
+            limit = current_app.config['MAX_PAGE_LIMIT']
+            missed = Message.query.filter(Message.conversation_id == id, db.tuple_(Message.created_at, Message.id) > (seen.created_at, seen.id)).order_by(
+                Message.created_at.asc(), Message.id.asc()).limit(limit + 1).all()
+            if len(missed) > limit:
+                reset = True
+            else:
+                names = dict(db.session.query(User.id, User.username).filter(User.id.in_((conv.user1_id, conv.user2_id))))
+                backlog = [serialize_message(m, names.get(m.author_id)) for m in missed]
+        heartbeat = current_app.config['SSE_HEARTBEAT']
+        # streams end now and then; EventSource-style clients reconnect with Last-Event-ID
+        deadline = time.monotonic() + current_app.config['SSE_MAX_DURATION']
+
+        def stream():
+            # the stream runs after the request context is gone: no database access in here
+            yield 'retry: 3000\n\n'
+            if reset:
+                yield _sse('reset', {})
+            sent = set()
+            for message in backlog:
+                sent.add(message['id'])
+                yield _sse('message', message, message['id'])
+            while time.monotonic() < deadline:
+                event = sub.get(timeout=heartbeat)
+                if event is None:
+                    yield ': keep-alive\n\n'
+                elif event['event'] == 'message':
+                    if event['data']['id'] not in sent:
+                        yield _sse('message', event['data'], event['data']['id'])
+                else:
+                    yield _sse(event['event'], event['data'])
+
+        response = Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        response.call_on_close(sub.close)
+        return response
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""Facet counts for the ads catalogue.
+
+``ad_facet_counts`` holds one row per (status, category, price bucket) with the
+number of ads in it. Write handlers move an ad between rows with ``track`` in
+the same transaction as the change, so the common facet requests (no filter or
+a category filter) aggregate a table of a few hundred rows instead of ``ads``.
+"""
+from .extensions import db
+from .models import Ad, AdFacetCount
+from .utils import increment
+
+# lower edges of the price buckets; the last bucket is open-ended
+PRICE_BUCKETS = (0, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+def price_bucket(price):
+    price = float(price or 0)
+    bucket = 0
+    for i, edge in enumerate(PRICE_BUCKETS):
+        if price >= edge:
+            bucket = i
+    return bucket
+
+
+def price_bucket_expr(column):
+    """SQL version of price_bucket for aggregating over ads directly."""
+    return db.case(*[(column < edge, i - 1) for i, edge in enumerate(PRICE_BUCKETS) if i > 0], else_=len(PRICE_BUCKETS) - 1)
+
+
+def facet_key(ad):
+    return (ad.status, ad.category_id, price_bucket(ad.price))
+
+
+def _bump(key, delta):
+    status, category_id, bucket = key
+    increment(AdFacetCount, {'status': status, 'category_id': category_id, 'price_bucket': bucket}, 'count', delta)
+
+
+def track(old_key, new_key):
+    """Move one ad from old_key to new_key; None means created / deleted."""
+    if old_key == new_key:
+        return
+    if old_key is not None:
+        _bump(old_key, -1)
+    if new_key is not None:
+        _bump(new_key, 1)
+
+
+def rebuild():
+    """Recount everything from ads, e.g. after changing PRICE_BUCKETS."""
+    bucket = price_bucket_expr(Ad.price)
+    db.session.query(AdFacetCount).delete()
+    rows = db.session.query(Ad.status, Ad.category_id, bucket, db.func.count(Ad.id)).group_by(Ad.status, Ad.category_id, bucket).all()
+    db.session.add_all([AdFacetCount(status=s, category_id=c, price_bucket=b, count=n) for s, c, b, n in rows])
+    db.session.commit()
+    return len(rows)
+
+
+def counts(category_ids=None, price_from=None, price_to=None, matches=None):
+    """(category_id, bucket, count) rows for active ads matching the filters."""
+    if price_from is None and price_to is None and matches is None:
+        q = db.session.query(AdFacetCount.category_id, AdFacetCount.price_bucket, db.func.sum(AdFacetCount.count)).filter(
+            AdFacetCount.status == 'active', AdFacetCount.count > 0)
+        if category_ids is not None:
+            q = q.filter(AdFacetCount.category_id.in_(category_ids))
+        return q.group_by(AdFacetCount.category_id, AdFacetCount.price_bucket).all()
+    # price ranges do not line up with bucket edges and search results are not
+    # counted ahead of time: one grouped pass over the matching ads instead
+    bucket = price_bucket_expr(Ad.price)
+    q = db.session.query(Ad.category_id, bucket, db.func.count(Ad.id)).filter(Ad.status == 'active')
+    if matches is not None:
+        q = q.join(matches, matches.c.ad_id == Ad.id)
+    if category_ids is not None:
+        q = q.filter(Ad.category_id.in_(category_ids))
+    if price_from is not None:
+        q = q.filter(Ad.price >= price_from)
+    if price_to is not None:
+        q = q.filter(Ad.price <= price_to)
+    return q.group_by(Ad.category_id, bucket).all()
+
+
+def summarize(rows):
+    by_category = {}
+    by_bucket = [0] * len(PRICE_BUCKETS)
+    total = 0
+    for category_id, bucket, count in rows:
+        count = int(count)
+        by_category[category_id] = by_category.get(category_id, 0) + count
+        by_bucket[bucket] += count
+        total += count
+    edges = list(PRICE_BUCKETS) + [None]
+    return {
+        'total': total,
+        'categories': [{'category_id': c, 'count': n} for c, n in sorted(by_category.items(), key=lambda item: -item[1]) if n],
+        'price_buckets': [{'from': edges[i], 'to': edges[i + 1], 'count': n} for i, n in enumerate(by_bucket)],
+    }
@@ -1,5 +1,9 @@
-from flask import Blueprint, render_template, send_from_directory, current_app
+from flask import Blueprint, render_template, send_from_directory, current_app, abort
+from werkzeug.security import safe_join
+from urllib.parse import quote
+import mimetypes
 import os
+import re
 
 static_folder = os.path.join(os.path.dirname(__file__), 'static')
 template_folder = os.path.join(os.path.dirname(__file__), 'templates')
@@ -53,8 +57,48 @@ def moderator():
 def admin():
     return render_template('admin.html')
 
+# UPLOAD_SENDFILE values: the header the fronting server understands (unset: Flask sends the file)
+SENDFILE_MODES = ('x-accel-redirect', 'x-sendfile')
+
+
+def check_sendfile_mode(mode):
+    """Fail at startup on a mode the proxy would silently ignore (every upload would come back empty)."""
+    if mode and mode not in SENDFILE_MODES:
+        raise RuntimeError('UPLOAD_SENDFILE must be one of %s or unset, got %r' % (', '.join(SENDFILE_MODES), mode))
+
+
+# content-addressed files (see app/media.py) and their renditions never change under the same URL
+IMMUTABLE_UPLOAD = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)*$')
+
+
+def _offload(uploads_dir, filename, mode):
+    """Empty response telling the fronting server which file to send."""
+    path = safe_join(uploads_dir, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    response = current_app.response_class(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    if mode == 'x-accel-redirect':
+        response.headers['X-Accel-Redirect'] = current_app.config['UPLOAD_ACCEL_PREFIX'].rstrip('/') + '/' + quote(filename)
+    else:
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+    return response
+
+
 # Serve uploaded files
 @bp.route('/uploads/<path:filename>')
 def uploads(filename):
-    uploads_dir = os.path.join(current_app.root_path, '..', 'uploads')
-    return send_from_directory(uploads_dir, filename)
\ No newline at end of file
+    uploads_dir = current_app.config['UPLOAD_FOLDER']
+    immutable = bool(IMMUTABLE_UPLOAD.match(filename))
+    max_age = current_app.config['UPLOAD_IMMUTABLE_MAX_AGE' if immutable else 'UPLOAD_MAX_AGE']
+    mode = current_app.config['UPLOAD_SENDFILE']
+    if mode in SENDFILE_MODES:
+        # the proxy streams the bytes and answers Range / conditional requests itself
+        response = _offload(uploads_dir, filename, mode)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        # conditional: ETag, If-Modified-Since and Range are answered by werkzeug
+        response = send_from_directory(uploads_dir, filename, max_age=max_age)
+    if immutable:
+        response.cache_control.immutable = True
+    return response
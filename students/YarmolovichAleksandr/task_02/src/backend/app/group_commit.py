@@ -0,0 +1,123 @@
+"""Group commit: many small writes from concurrent requests in one transaction.
+
+A request hands its write to ``submit`` and waits. A single writer thread per app
+takes the first queued write, keeps collecting for ``GROUP_COMMIT_WINDOW`` seconds
+(or until ``GROUP_COMMIT_MAX_BATCH`` writes), opens one transaction, runs each
+write in its own savepoint (only to isolate failures) and commits them together, so a burst pays for one commit (one fsync on SQLite)
+instead of one per request. Every caller still gets its own result, or its own
+exception if its write, or the shared commit, failed.
+"""
+import queue
+import threading
+import time
+from flask import current_app
+from .extensions import db
+
+_lock = threading.Lock()
+
+
+class GroupCommitTimeout(Exception):
+    pass
+
+
+class _Write:
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+def _begin():
+    """Open the batch's transaction on the driver connection.
+
+    pysqlite only sends BEGIN before INSERT/UPDATE/DELETE, never before SAVEPOINT:
+    without this every per-write savepoint would start outside a transaction and
+    its RELEASE would commit on its own.
+    """
+    conn = db.session.connection()
+    if conn.dialect.name == 'sqlite' and not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql('BEGIN')
+
+
+class GroupCommitter:
+    def __init__(self, app, window, max_batch):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, timeout=None):
+        """Run fn(*args) in the next batch and return its result once the batch is committed.
+
+        fn runs on the writer thread with its own session, so it must take and
+        return plain values, not ORM objects of the caller's session.
+        """
+        write = _Write(fn, args)
+        self.queue.put(write)
+        if not write.done.wait(timeout):
+            # still queued or being written: the write may yet be committed
+            raise GroupCommitTimeout('group commit did not finish in time')
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._write(batch)
+            except Exception as e:
+                # the thread must survive whatever a batch does
+                for write in batch:
+                    if not write.done.is_set():
+                        write.error = e
+                        write.done.set()
+
+    def _write(self, batch):
+        with self.app.app_context():
+            _begin()
+            written = []
+            for write in batch:
+                try:
+                    with db.session.begin_nested():
+                        write.result = write.fn(*write.args)
+                    written.append(write)
+                except Exception as e:
+                    write.error = e
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.warning('group commit of %d writes failed', len(written), exc_info=True)
+                for write in written:
+                    write.result, write.error = None, e
+            finally:
+                for write in batch:
+                    write.done.set()
+
+
+def get_committer():
+    app = current_app._get_current_object()
+    committer = app.extensions.get('group_commit')
+    if committer is None:
+        with _lock:
+            committer = app.extensions.get('group_commit')
+            if committer is None:
+                committer = app.extensions['group_commit'] = GroupCommitter(
+                    app, app.config['GROUP_COMMIT_WINDOW'], app.config['GROUP_COMMIT_MAX_BATCH'])
+    return committer
@@ -0,0 +1,133 @@
+"""Resized WebP derivatives of uploaded images.
+
+Every uploaded image gets a ``thumb``, ``card`` and ``full`` rendition next to
+the original. They are rendered in a small per-app thread pool after the upload
+has been committed, so the request never waits for decoding/encoding; when they
+are ready ``Media.variants`` is filled in and, for the cover image, the ad's
+``cover_url`` switches to the card rendition. Until then (and without Pillow
+installed) every size falls back to the original file.
+"""
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from flask import current_app
+from .extensions import db
+from .cache import cache
+from .models import Media, MediaBlob
+from .storage import get_storage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+# name -> longest edge in pixels; images are never upscaled
+VARIANTS = {'thumb': 160, 'card': 480, 'full': 1600}
+WEBP_QUALITY = 80
+
+_pool_lock = threading.Lock()
+
+
+def variant_url(m, name):
+    """URL of a rendition of media m, or of the original until it exists."""
+    return (m.variants or {}).get(name) or m.url
+
+
+def variant_keys(key):
+    base = os.path.splitext(key)[0]
+    return {name: f'{base}.{name}.webp' for name in VARIANTS}
+
+
+def render_variants(source, directory):
+    """Write every rendition of the image at source into directory; returns {name: path}."""
+    paths = {}
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        for name, edge in VARIANTS.items():
+            copy = img.copy()
+            copy.thumbnail((edge, edge), Image.LANCZOS)
+            paths[name] = os.path.join(directory, f'{name}.webp')
+            copy.save(paths[name], 'WEBP', quality=WEBP_QUALITY, method=4)
+    return paths
+
+
+class _Pool:
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='images')
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        future = self.executor.submit(fn, *args)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def wait(self, timeout=None):
+        with self.lock:
+            pending = list(self.pending)
+        wait(pending, timeout=timeout)
+
+
+def _pool(app):
+    pool = app.extensions.get('image_pool')
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get('image_pool')
+            if pool is None:
+                pool = app.extensions['image_pool'] = _Pool(app.config['IMAGE_WORKERS'])
+    return pool
+
+
+def _process(app, media_id, key, blob_hash):
+    with app.app_context():
+        storage = get_storage()
+        keys = variant_keys(key)
+        try:
+            with storage.local_copy(key) as source, tempfile.TemporaryDirectory() as tmp:
+                for name, path in render_variants(source, tmp).items():
+                    storage.save(keys[name], path)
+        except Exception:
+            # a corrupt or unsupported file keeps being served as the original
+            app.logger.warning('could not render variants of %s', key, exc_info=True)
+            return
+        m = db.session.get(Media, media_id)
+        if m is None:
+            # deleted while rendering; renditions of shared content stay for the other references
+            if not (blob_hash and db.session.get(MediaBlob, blob_hash) is not None):
+                for variant in keys.values():
+                    storage.delete(variant)
+            return
+        m.variants = {name: storage.url(k) for name, k in keys.items()}
+        ad = m.ad
+        if ad.cover_url == m.url:
+            ad.cover_url = m.variants['card']
+        ad.updated_at = datetime.utcnow()
+        db.session.commit()
+        cache.purge('ad:' + ad.id, 'ad-card:' + ad.id)
+
+
+def process_later(m):
+    """Queue rendering of committed media m."""
+    app = current_app._get_current_object()
+    if Image is None or not app.config['IMAGE_WORKERS'] or m.type != 'image' or m.variants:
+        return None
+    key = get_storage().key_for(m.url)
+    if key is None:
+        return None
+    return _pool(app).submit(_process, app, m.id, key, m.blob_hash)
+
+
+def wait_pending(timeout=None):
+    """Block until queued renders are done (scripts and tests)."""
+    pool = current_app.extensions.get('image_pool')
+    if pool is not None:
+        pool.wait(timeout)
@@ -1,12 +1,182 @@
 from flask_restx import Namespace, Resource
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from .models import Media
+from werkzeug.utils import secure_filename
+from .models import Media, MediaBlob
 from .extensions import db
+from .cache import cache
+from .images import variant_url
+from .utils import increment
+from .storage import get_storage
 from flask import current_app
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
+import re
+from datetime import datetime
 
 ns = Namespace('media', description='Media operations')
 
+# bytes read per block when hashing a file
+HASH_BUFFER = 64 * 1024
+
+
+def blob_key(digest, ext):
+    # two levels of 256 shards keep every directory (or key prefix) small
+    return f'{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def file_extension(filename):
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    return ext if re.fullmatch(r'\.[a-z0-9]{1,8}', ext) else ''
+
+
+def file_digest(path):
+    """(sha256 hex, size) of the file at path."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BUFFER), b''):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def store_file(src, filename):
+    """Move the file at src into the content-addressed store; returns (hash, ext, size, url).
+
+    Takes a reference on the blob in the current transaction. A file whose content
+    is already stored is dropped and the stored copy reused.
+    """
+    return store_files([(src, filename)])[0]
+
+
+def store_files(items):
+    """store_file for a list of (src, filename); one (hash, ext, size, url) per item.
+
+    Hashing and storage writes of the files run in parallel (UPLOAD_WORKERS threads);
+    the database is only used from the calling thread.
+    """
+    storage = get_storage()
+    workers = max(min(len(items), current_app.config['UPLOAD_WORKERS']), 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='store') as pool:
+        digests = list(pool.map(file_digest, [src for src, _ in items]))
+        refs = Counter(digest for digest, _ in digests)
+        first = {}
+        for (_, filename), (digest, size) in zip(items, digests):
+            first.setdefault(digest, (file_extension(filename), size))
+        # take the references before deciding which files to keep: from here on a
+        # concurrent release of the same content cannot delete the blob (its
+        # decrement waits for this transaction, or went before it)
+        for digest, (ext, size) in first.items():
+            increment(MediaBlob, {'hash': digest}, 'refcount', refs[digest], defaults={'ext': ext, 'size': size})
+        blobs = {h: (ext, refcount) for h, ext, refcount in db.session.query(MediaBlob.hash, MediaBlob.ext, MediaBlob.refcount).filter(MediaBlob.hash.in_(first))}
+        results, saves, duplicates = [], {}, []
+        for (src, _), (digest, size) in zip(items, digests):
+            # the same content twice in one batch is stored once, under the stored blob's name
+            ext = blobs[digest][0]
+            key = blob_key(digest, ext)
+            if key in saves:
+                duplicates.append(src)
+            else:
+                saves[key] = (src, digest)
+            results.append((digest, ext, size, storage.url(key)))
+        # a blob holding only the references taken above was (re)created just now:
+        # whatever file is stored under its key may belong to a release still
+        # deleting it, so keep the uploaded copy
+        fresh = {digest for digest in first if blobs[digest][1] == refs[digest]}
+
+        def save(key, item):
+            src, digest = item
+            if digest not in fresh and storage.exists(key):
+                os.remove(src)
+            else:
+                storage.save(key, src)
+
+        list(pool.map(save, saves.keys(), saves.values()))
+    for src in duplicates:
+        os.remove(src)
+    return results
+
+
+def add_media(ad, url, type='image', blob_hash=None):
+    """Attach a media row to ad, keeping its cover_url and image_count in step."""
+    m = Media(ad_id=ad.id, url=url, type=type, blob_hash=blob_hash)
+    if blob_hash:
+        # the same content was uploaded before: reuse its renditions
+        rendered = Media.query.filter(Media.blob_hash == blob_hash, Media.variants.isnot(None)).first()
+        m.variants = rendered.variants if rendered else None
+    db.session.add(m)
+    if not ad.cover_url:
+        ad.cover_url = variant_url(m, 'card')
+    ad.image_count = (ad.image_count or 0) + 1
+    ad.updated_at = datetime.utcnow()
+    return m
+
+
+def attach_blob(ad, digest, ext, size, url, type='image'):
+    """Attach content already in the storage to ad, taking a reference on its blob."""
+    increment(MediaBlob, {'hash': digest}, 'refcount', 1, defaults={'ext': ext, 'size': size})
+    return add_media(ad, url, type, blob_hash=digest)
+
+
+def attach_file(ad, src, filename, type='image'):
+    """Store the file at src (it is moved away) and attach it to ad."""
+    digest, _, _, url = store_file(src, filename)
+    return add_media(ad, url, type, blob_hash=digest)
+
+
+def attach_files(ad, items, type='image'):
+    """attach_file for a list of (src, filename), storing the files in parallel; returns the media in order."""
+    return [add_media(ad, url, type, blob_hash=digest) for digest, _, _, url in store_files(items)]
+
+
+def _release(m):
+    """Drop the reference of deleted (and flushed) media m; returns the URLs nothing uses any more."""
+    files = [m.url] + sorted(set((m.variants or {}).values()))
+    if m.blob_hash is None:
+        return files
+    # shared content: the files go with the last reference only
+    increment(MediaBlob, {'hash': m.blob_hash}, 'refcount', -1)
+    unused = db.session.query(MediaBlob).filter(MediaBlob.hash == m.blob_hash, MediaBlob.refcount <= 0).delete(synchronize_session=False)
+    return files if unused else []
+
+
+def remove_media(m):
+    """Detach m from its ad; returns the URLs of files to delete once the transaction commits."""
+    ad = m.ad
+    db.session.delete(m)
+    ad.image_count = max((ad.image_count or 0) - 1, 0)
+    db.session.flush()
+    if ad.cover_url in (m.url, variant_url(m, 'card')):
+        # the cover went away: the next oldest image takes over
+        nxt = Media.query.filter(Media.ad_id == ad.id).order_by(Media.created_at, Media.id).first()
+        ad.cover_url = variant_url(nxt, 'card') if nxt else None
+    ad.updated_at = datetime.utcnow()
+    return _release(m)
+
+
+def remove_ad_media(ad):
+    """Delete all media of an ad that is being deleted; returns the URLs to delete after commit."""
+    items = list(ad.media)
+    for m in items:
+        db.session.delete(m)
+    db.session.flush()
+    return [url for m in items for url in _release(m)]
+
+
+def delete_files(urls):
+    storage = get_storage()
+    for url in urls:
+        key = storage.key_for(url)
+        if key is None:
+            continue
+        try:
+            storage.delete(key)
+        except Exception:
+            # the row is gone already; scripts/media_gc.py picks the file up later
+            current_app.logger.warning('could not delete media file %s', key, exc_info=True)
+
 
 @ns.route('/<string:id>')
 class MediaItem(Resource):
@@ -19,13 +189,8 @@ class MediaItem(Resource):
         claims = get_jwt()
         if current != ad.author_id and claims.get('role') not in ('admin','moderator'):
             return {'status':'error','error':{'code':'forbidden','message':'Not allowed'}},403
-        # try remove file
-        uploads_dir = os.path.join(current_app.root_path, '..', 'uploads')
-        filename = m.url.split('/')[-1]
-        try:
-            os.remove(os.path.join(uploads_dir, filename))
-        except Exception:
-            pass
-        db.session.delete(m)
+        files = remove_media(m)
         db.session.commit()
+        delete_files(files)
+        cache.purge('ad:' + ad.id, 'ad-card:' + ad.id)
         return {'status':'ok'}
\ No newline at end of file
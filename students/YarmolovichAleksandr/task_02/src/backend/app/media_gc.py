@@ -0,0 +1,174 @@
+"""Garbage collection of media files nothing refers to any more.
+
+Deleting media normally removes its files right after the commit, but files can
+still be left behind: a crash between commit and delete, a storage error, an
+expired direct upload, or rows removed outside the API. ``sweep`` reconciles the
+storage with the database in batches:
+
+1. ``media_blobs.refcount`` is recounted from ``media`` and blobs without any
+   media row are dropped, each with a conditional statement that loses to
+   concurrent uploads and deletions;
+2. every stored file is checked: content-addressed files (and their renditions)
+   are kept while their blob row exists or a live upload session declared that
+   content, files under the old names while a media row (or its renditions)
+   points at them;
+3. partial files of resumable uploads without a session are removed.
+
+Files younger than ``min_age`` are never touched, so uploads in flight are
+safe, and deletions are paced to ``rate`` files per second.
+"""
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from .extensions import db
+from .images import VARIANTS
+from .models import Media, MediaBlob, UploadSession
+from .storage import get_storage
+from .uploads import expire_sessions
+
+# ab/cd/<sha256><ext>, ab/cd/<sha256>.<variant>.webp
+CONTENT_KEY = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[\w.]*)?$')
+# <name>.<variant>.webp next to an original stored under its old name
+VARIANT_KEY = re.compile(r'^(.*)\.(?:%s)\.webp$' % '|'.join(VARIANTS))
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def reconcile_blobs(batch=500, min_age=3600, dry_run=False):
+    """Fix refcounts that drifted from the media rows; returns the number of blobs changed.
+
+    Blobs are walked in hash order, a batch at a time. Each repair is one conditional
+    statement that recounts in the database and only applies if the refcount is still
+    the one that was read, so a reference taken or dropped meanwhile is never
+    overwritten; a blob is only dropped while no media row points at it. Blobs younger
+    than min_age seconds may belong to an upload in flight and are left alone.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=min_age)
+    media_count = db.select(db.func.count(Media.id)).where(Media.blob_hash == MediaBlob.hash).scalar_subquery()
+    unused = ~db.exists().where(Media.blob_hash == MediaBlob.hash)
+    changed = 0
+    last = ''
+    while True:
+        rows = db.session.query(MediaBlob.hash, MediaBlob.refcount).filter(
+            MediaBlob.hash > last, db.or_(MediaBlob.created_at.is_(None), MediaBlob.created_at <= cutoff),
+        ).order_by(MediaBlob.hash).limit(batch).all()
+        if not rows:
+            break
+        last = rows[-1][0]
+        actual = dict(db.session.query(Media.blob_hash, db.func.count(Media.id)).filter(
+            Media.blob_hash.in_([h for h, _ in rows])).group_by(Media.blob_hash))
+        for hash, seen in rows:
+            count = actual.get(hash, 0)
+            if seen == count:
+                continue
+            if dry_run:
+                changed += 1
+                continue
+            same = (MediaBlob.hash == hash) & (MediaBlob.refcount == seen)
+            if count:
+                done = db.session.execute(db.update(MediaBlob).where(same).values(refcount=media_count)
+                                          .execution_options(synchronize_session=False)).rowcount
+            else:
+                done = db.session.execute(db.delete(MediaBlob).where(same, unused)
+                                          .execution_options(synchronize_session=False)).rowcount
+            changed += done
+        db.session.commit()
+    return changed
+
+
+def _legacy_in_use(storage, keys):
+    """Keys (of files stored before content addressing) a media row or its renditions points at."""
+    urls = {storage.url(k): k for k in keys}
+    # a rendition is named after its original, whose extension is unknown here
+    prefixes = {storage.url(m.group(1)) + '.' for m in map(VARIANT_KEY.match, keys) if m}
+    rows = db.session.query(Media.url, Media.variants).filter(
+        Media.blob_hash.is_(None), db.or_(Media.url.in_(urls), *(Media.url.startswith(p, autoescape=True) for p in prefixes)))
+    used = set()
+    for url, variants in rows:
+        for u in [url, *(variants or {}).values()]:
+            if u in urls:
+                used.add(urls[u])
+    return used
+
+
+def _in_use(storage, files):
+    """Keys of files (one batch) that are still referenced."""
+    hashes = {}
+    for f in files:
+        match = CONTENT_KEY.match(f.key)
+        if match:
+            hashes[f.key] = match.group(1)
+    wanted = set(hashes.values())
+    stored = {h for (h,) in db.session.query(MediaBlob.hash).filter(MediaBlob.hash.in_(wanted))} if wanted else set()
+    pending = {h for (h,) in db.session.query(UploadSession.sha256).filter(UploadSession.sha256.in_(wanted))} if wanted else set()
+    used = {k for k, h in hashes.items() if h in stored or h in pending}
+    legacy = [f.key for f in files if f.key not in hashes]
+    return used | (_legacy_in_use(storage, legacy) if legacy else set())
+
+
+def _sweep_partials(cutoff, dry_run):
+    folder = current_app.config['UPLOAD_PARTIAL_FOLDER']
+    if not os.path.isdir(folder):
+        return 0, 0
+    live = {id for (id,) in db.session.query(UploadSession.id)}
+    removed = reclaimed = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if name in live or datetime.utcfromtimestamp(st.st_mtime) > cutoff:
+            continue
+        if not dry_run:
+            try:
+                os.remove(path)
+            except OSError:
+                current_app.logger.warning('could not delete partial upload %s', path, exc_info=True)
+                continue
+        removed += 1
+        reclaimed += st.st_size
+    return removed, reclaimed
+
+
+def sweep(batch=500, rate=50, max_deletes=None, min_age=3600, dry_run=False):
+    """Delete unreferenced media files; returns a report of what was (or would be) reclaimed."""
+    storage = get_storage()
+    cutoff = datetime.utcnow() - timedelta(seconds=min_age)
+    report = {'expired_sessions': 0 if dry_run else expire_sessions(), 'blobs_fixed': reconcile_blobs(batch, min_age, dry_run),
+              'scanned': 0, 'deleted': 0, 'bytes': 0, 'errors': 0}
+    for files in _batches(storage.files(), batch):
+        report['scanned'] += len(files)
+        used = _in_use(storage, files)
+        orphans = [f for f in files if f.key not in used and f.modified <= cutoff]
+        if max_deletes is not None:
+            orphans = orphans[:max(max_deletes - report['deleted'], 0)]
+        for f in orphans:
+            if not dry_run:
+                try:
+                    storage.delete(f.key)
+                except Exception:
+                    current_app.logger.warning('could not delete media file %s', f.key, exc_info=True)
+                    report['errors'] += 1
+                    continue
+                if rate:
+                    time.sleep(1.0 / rate)
+            report['deleted'] += 1
+            report['bytes'] += f.size
+        if max_deletes is not None and report['deleted'] >= max_deletes:
+            break
+    partials, partial_bytes = _sweep_partials(cutoff, dry_run)
+    report['partials'] = partials
+    report['bytes'] += partial_bytes
+    return report
@@ -14,20 +14,37 @@ class User(db.Model):
     email = db.Column(db.String(120), nullable=False, unique=True)
     password_hash = db.Column(db.String(200), nullable=False)
     role = db.Column(db.String(20), nullable=False, default='user')
+    # unread messages across all conversations (header badge), kept by app/conversations.py
+    unread_messages = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     ads = db.relationship('Ad', backref='author', lazy=True)
     reports = db.relationship('Report', backref='reporter', lazy=True)
 
 
+class VersionCounter(db.Model):
+    """Named counters bumped on writes; shared by all worker processes through the DB."""
+    __tablename__ = 'version_counters'
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Category(db.Model):
     __tablename__ = 'categories'
     id = db.Column(db.String(36), primary_key=True, default=gen_uuid)
     name = db.Column(db.String(120), nullable=False)
-    parent_id = db.Column(db.String(36), db.ForeignKey('categories.id'), nullable=True)
+    parent_id = db.Column(db.String(36), db.ForeignKey('categories.id'), nullable=True, index=True)
 
     children = db.relationship('Category')
 
 
+class CategoryClosure(db.Model):
+    """Every (ancestor, descendant) pair of the category tree, including (c, c) at depth 0."""
+    __tablename__ = 'category_closure'
+    ancestor_id = db.Column(db.String(36), db.ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True)
+    descendant_id = db.Column(db.String(36), db.ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True, index=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+
 class Ad(db.Model):
     __tablename__ = 'ads'
     id = db.Column(db.String(36), primary_key=True, default=gen_uuid)
@@ -39,29 +56,105 @@ class Ad(db.Model):
     location = db.Column(db.String(200))
     status = db.Column(db.String(20), nullable=False, default='active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # bumped on every change of the ad or its media; the ETag of the ad endpoints
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # first image and number of images, kept by app/media.py so the listing never reads media
+    cover_url = db.Column(db.String(500))
+    image_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     category = db.relationship('Category', backref='ads')
-    media = db.relationship('Media', backref='ad', lazy=True)
+    media = db.relationship('Media', backref='ad', lazy=True, order_by=lambda: (Media.created_at, Media.id))
     reports = db.relationship('Report', backref='ad', lazy=True)
 
+    __table_args__ = (
+        # keyset pagination for the public listing (see AdsList.get sort orders)
+        db.Index('ix_ads_status_created_at_id', 'status', 'created_at', 'id'),
+        db.Index('ix_ads_status_price_id', 'status', 'price', 'id'),
+        # ?categoryId= on the public listing
+        db.Index('ix_ads_status_category_created_at_id', 'status', 'category_id', 'created_at', 'id'),
+        # "my ads" (authorId=me, every status) and the author filter
+        db.Index('ix_ads_author_created_at_id', 'author_id', 'created_at', 'id'),
+        # FK lookups when a category is deleted
+        db.Index('ix_ads_category_id', 'category_id'),
+    )
+
+
+class AdFacetCount(db.Model):
+    """Number of ads per (status, category, price bucket), maintained by app/facets.py."""
+    __tablename__ = 'ad_facet_counts'
+    status = db.Column(db.String(20), primary_key=True)
+    category_id = db.Column(db.String(36), primary_key=True)
+    price_bucket = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MediaBlob(db.Model):
+    """One stored file, named by the sha256 of its content and shared by every Media row with that content."""
+    __tablename__ = 'media_blobs'
+    hash = db.Column(db.String(64), primary_key=True)
+    ext = db.Column(db.String(10), nullable=False, default='')
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    # number of Media rows pointing here; the file is removed when it drops to zero
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 
 class Media(db.Model):
     __tablename__ = 'media'
     id = db.Column(db.String(36), primary_key=True, default=gen_uuid)
-    ad_id = db.Column(db.String(36), db.ForeignKey('ads.id'), nullable=False)
+    ad_id = db.Column(db.String(36), db.ForeignKey('ads.id'), nullable=False, index=True)
     url = db.Column(db.String(500), nullable=False)
     type = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # {'thumb'|'card'|'full': url} once app/images.py has rendered them
+    variants = db.Column(db.JSON(none_as_null=True))
+    # None for files stored before content addressing (uploads/<ad_id>_<name>)
+    blob_hash = db.Column(db.String(64), db.ForeignKey('media_blobs.hash'), index=True)
+
+
+class UploadSession(db.Model):
+    """A resumable media upload in progress (app/uploads.py); the bytes so far are in its partial file."""
+    __tablename__ = 'upload_sessions'
+    id = db.Column(db.String(36), primary_key=True, default=gen_uuid)
+    ad_id = db.Column(db.String(36), db.ForeignKey('ads.id', ondelete='CASCADE'), nullable=False, index=True)
+    owner_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    # declared content hash of a direct-to-storage upload (presigned PUT); None for chunked uploads
+    sha256 = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # pushed forward by every chunk; the sweeper drops sessions past it
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
 
 
 class Conversation(db.Model):
     __tablename__ = 'conversations'
     id = db.Column(db.String(36), primary_key=True, default=gen_uuid)
     ad_id = db.Column(db.String(36), db.ForeignKey('ads.id'))
+    # the participants in canonical order, user1_id < user2_id (see conversations.open_conversation)
     user1_id = db.Column(db.String(36), db.ForeignKey('users.id'))
     user2_id = db.Column(db.String(36), db.ForeignKey('users.id'))
+    # kept by the message endpoints so the inbox never scans messages: newest message
+    # (its preview) and when the conversation last changed (inbox order)
+    last_message_id = db.Column(db.String(36))
+    last_activity_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # per participant: messages of the other one newer than this are unread, and how many there are
+    user1_read_at = db.Column(db.DateTime)
+    user2_read_at = db.Column(db.DateTime)
+    user1_unread = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    user2_unread = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     messages = db.relationship('Message', backref='conversation', lazy=True)
 
+    __table_args__ = (
+        # inbox: user1_id = me OR user2_id = me, most recently active first
+        db.Index('ix_conversations_user1_activity', 'user1_id', 'last_activity_at', 'id'),
+        db.Index('ix_conversations_user2_activity', 'user2_id', 'last_activity_at', 'id'),
+        # one conversation per ad and pair of users; backs the insert-or-return on open
+        db.Index('uq_conversations_ad_users', 'ad_id', 'user1_id', 'user2_id', unique=True),
+    )
+
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -71,6 +164,11 @@ class Message(db.Model):
     text = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # history of one conversation in order
+        db.Index('ix_messages_conversation_created_at_id', 'conversation_id', 'created_at', 'id'),
+    )
+
 
 class Report(db.Model):
     __tablename__ = 'reports'
@@ -79,4 +177,10 @@ class Report(db.Model):
     reporter_id = db.Column(db.String(36), db.ForeignKey('users.id'))
     reason = db.Column(db.Text, nullable=False)
     status = db.Column(db.String(20), nullable=False, default='new')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # moderation queue: filter by status, newest first
+        db.Index('ix_reports_status_created_at_id', 'status', 'created_at', 'id'),
+        db.Index('ix_reports_ad_id', 'ad_id'),
+    )
\ No newline at end of file
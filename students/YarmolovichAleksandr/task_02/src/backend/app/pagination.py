@@ -0,0 +1,37 @@
+import base64
+import json
+from flask import current_app, request
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(*values):
+    """Pack the sort key of the last row into an opaque url-safe token."""
+    raw = json.dumps(list(values), separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise InvalidCursor(token)
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(token)
+    return values
+
+
+def get_limit(default=None):
+    """Read ?limit= and clamp it to MAX_PAGE_LIMIT."""
+    max_limit = current_app.config['MAX_PAGE_LIMIT']
+    limit = request.args.get('limit', type=int)
+    if limit is None:
+        limit = default or current_app.config['DEFAULT_PAGE_LIMIT']
+    return max(1, min(limit, max_limit))
+
+
+def invalid_cursor_response():
+    return {'status': 'error', 'error': {'code': 'validation_failed', 'message': 'Invalid cursor'}}, 400
@@ -1,9 +1,13 @@
 from flask_restx import Namespace, Resource, fields
 from flask import request
-from .models import Report, Ad
+from datetime import datetime, timedelta
+from .models import Report, Ad, User
 from .extensions import db
+from .pagination import encode_cursor, decode_cursor, get_limit, InvalidCursor, invalid_cursor_response
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from .utils import role_required
+from .cache import cache
+from . import facets
 
 ns = Namespace('reports', description='Reports and moderation')
 
@@ -17,6 +21,42 @@ status_model = ns.model('ReportStatus', {
 })
 
 
+REPORT_STATUSES = ('new', 'reviewing', 'resolved')
+
+
+def _hours(value):
+    # None when the parameter is absent; ValueError when it is not a number
+    return timedelta(hours=float(value)) if value else None
+
+
+def _serialize(r, ad_title, reporter_username):
+    return {'id': r.id, 'ad_id': r.ad_id, 'ad_title': ad_title, 'reason': r.reason, 'reporter_id': r.reporter_id,
+            'reporter_username': reporter_username or r.reporter_id, 'status': r.status,
+            'created_at': r.created_at.isoformat() if r.created_at else None}
+
+
+def _queue_page(statuses, created_before, created_after, key, size):
+    """Subquery of (id, created_at) of the next size reports in the given statuses, newest first.
+
+    Each status is its own range scan of ix_reports_status_created_at_id, already in
+    order and cut at size rows, so a page never sorts the whole queue; an IN list
+    over several statuses would have to.
+    """
+    parts = []
+    for status in dict.fromkeys(statuses):
+        q = db.select(Report.id, Report.created_at).where(Report.status == status)
+        if created_before is not None:
+            q = q.where(Report.created_at <= created_before)
+        if created_after is not None:
+            q = q.where(Report.created_at >= created_after)
+        if key is not None:
+            q = q.where(db.tuple_(Report.created_at, Report.id) < key)
+        parts.append(q.order_by(Report.created_at.desc(), Report.id.desc()).limit(size).subquery())
+    if len(parts) == 1:
+        return parts[0]
+    return db.union_all(*(db.select(p) for p in parts)).subquery('queue')
+
+
 @ns.route('')
 class ReportList(Resource):
     @jwt_required()
@@ -33,26 +73,36 @@ class ReportList(Resource):
     @jwt_required()
     @role_required(['admin','moderator'])
     def get(self):
-        status = request.args.get('status')
-        q = Report.query
-        if status:
-            q = q.filter_by(status=status)
-        else:
-            q = q.filter(Report.status != 'resolved')
-        items = q.all()
-        data = []
-        for r in items:
-            ad = Ad.query.get(r.ad_id)
-            ad_title = ad.title if ad else None
-            reporter_username = None
+        """Moderation queue, newest first; ?status=new,reviewing (the default), ?min_age= / ?max_age= in hours,
+        keyset-paginated with ?cursor=."""
+        statuses = (request.args.get('status') or 'new,reviewing').split(',')
+        if any(s not in REPORT_STATUSES for s in statuses):
+            return {'status':'error','error':{'code':'validation_failed','message':'Invalid status'}},400
+        try:
+            min_age, max_age = (_hours(request.args.get(name)) for name in ('min_age', 'max_age'))
+        except (ValueError, OverflowError):
+            return {'status':'error','error':{'code':'validation_failed','message':'min_age and max_age are hours'}},400
+        limit = get_limit()
+        key = None
+        cursor = request.args.get('cursor')
+        if cursor:
             try:
-                from .models import User
-                reporter = User.query.get(r.reporter_id)
-                reporter_username = reporter.username if reporter else r.reporter_id
-            except Exception:
-                reporter_username = r.reporter_id
-            data.append({'id': r.id, 'ad_id': r.ad_id, 'ad_title': ad_title, 'reason': r.reason, 'reporter_id': r.reporter_id, 'reporter_username': reporter_username, 'status': r.status})
-        return {'status':'ok','data':data}
+                created_at, last_id = decode_cursor(cursor, 2)
+                key = datetime.fromisoformat(created_at), last_id
+            except (InvalidCursor, ValueError, TypeError):
+                return invalid_cursor_response()
+        now = datetime.utcnow()
+        page = _queue_page(statuses, now - min_age if min_age is not None else None,
+                           now - max_age if max_age is not None else None, key, limit + 1)
+        rows = db.session.query(Report, Ad.title, User.username).join(page, page.c.id == Report.id).outerjoin(
+            Ad, Ad.id == Report.ad_id,
+        ).outerjoin(User, User.id == Report.reporter_id).order_by(Report.created_at.desc(), Report.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1][0]
+            next_cursor = encode_cursor(last.created_at.isoformat(), last.id)
+        return {'status':'ok','data':[_serialize(*row) for row in rows],'next_cursor':next_cursor}
 
 
 @ns.route('/<string:id>')
@@ -60,17 +110,11 @@ class ReportItem(Resource):
     @jwt_required()
     @role_required(['admin','moderator'])
     def get(self,id):
-        r = Report.query.get_or_404(id)
-        ad = Ad.query.get(r.ad_id)
-        ad_title = ad.title if ad else None
-        reporter_username = None
-        try:
-            from .models import User
-            reporter = User.query.get(r.reporter_id)
-            reporter_username = reporter.username if reporter else r.reporter_id
-        except Exception:
-            reporter_username = r.reporter_id
-        return {'status':'ok','data':{'id':r.id,'ad_id':r.ad_id,'ad_title':ad_title,'reason':r.reason,'reporter_id':r.reporter_id,'reporter_username':reporter_username,'status':r.status}}
+        row = db.session.query(Report, Ad.title, User.username).outerjoin(Ad, Ad.id == Report.ad_id).outerjoin(
+            User, User.id == Report.reporter_id,
+        ).filter(Report.id == id).first_or_404()
+        return {'status':'ok','data':_serialize(*row)}
+
     @ns.expect(status_model)
     @jwt_required()
     @role_required(['admin','moderator'])
@@ -78,7 +122,7 @@ class ReportItem(Resource):
         r = Report.query.get_or_404(id)
         data = request.json
         new_status = data.get('status')
-        if new_status not in ('new','reviewing','resolved'):
+        if new_status not in REPORT_STATUSES:
             return {'status':'error','error':{'code':'validation_failed','message':'Invalid status'}},400
         r.status = new_status
         db.session.commit()
@@ -86,6 +130,9 @@ class ReportItem(Resource):
         if data.get('block_ad'):
             ad = Ad.query.get(r.ad_id)
             if ad:
+                facet_key = facets.facet_key(ad)
                 ad.status = 'banned'
+                facets.track(facet_key, facets.facet_key(ad))
                 db.session.commit()
+                cache.purge('ad:' + ad.id, 'ads:list')
         return {'status':'ok','data':{'id':r.id,'status':r.status}}
\ No newline at end of file
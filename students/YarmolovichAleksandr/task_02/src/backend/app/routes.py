@@ -23,6 +23,8 @@ def init_app(app):
     from .media import ns as media_ns
     api.add_namespace(ads_ns, path='/api/ads')
     api.add_namespace(media_ns, path='/api/media')
+    from .uploads import ns as uploads_ns
+    api.add_namespace(uploads_ns, path='/api/uploads')
     from .conversations import ns as conv_ns
     api.add_namespace(conv_ns, path='/api/conversations')
     from .reports import ns as reports_ns
@@ -0,0 +1,339 @@
+"""Full-text search over ads and chat messages.
+
+Every backend keeps a side index next to the ``ads`` table and exposes the same
+three operations: ``index_ad`` / ``remove_ad`` (called by the write handlers in the
+same transaction as the change) and ``matches`` which returns a subquery of
+``(ad_id, rank)`` rows where a lower rank means a better match. Messages get the
+same treatment with ``index_message`` and ``message_matches``, which only returns
+messages of conversations the given user takes part in.
+"""
+import hashlib
+import html
+from abc import ABC, abstractmethod
+import re
+from sqlalchemy import event, text
+from .extensions import db
+from .models import Ad, Conversation, Message
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-яё]+')
+
+# longest first: the first ending that leaves a stem of at least 3 letters wins
+RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ешь', 'ете', 'ишь', 'ите', 'ать', 'ять', 'ить', 'еть', 'ует', 'ют', 'ут', 'ет', 'ит',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ом', 'ем',
+    'ам', 'ям', 'ов', 'ев', 'ью', 'ия', 'ии', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+
+
+def stem_ru(word):
+    """Very small suffix-stripping stemmer for Russian (SQLite has none built in)."""
+    word = word.replace('ё', 'е')
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def _stem_text(value):
+    return CYRILLIC_RE.sub(lambda m: stem_ru(m.group(0)), (value or '').lower())
+
+
+def _query_terms(query):
+    return [_stem_text(w) for w in WORD_RE.findall(query.lower())]
+
+
+def _participant_token(user_id):
+    # one plain token per user, so the message index can be restricted to a user's conversations
+    return 'p' + re.sub(r'\W', '', user_id).lower()
+
+
+def highlight(value, query, words=12):
+    """HTML snippet of value around the first word matching query, matches wrapped in <mark>."""
+    terms = _query_terms(query)
+    tokens = list(WORD_RE.finditer(value))
+    hits = [i for i, m in enumerate(tokens) if any(_stem_text(m.group(0)).startswith(t) for t in terms)]
+    if not tokens:
+        return html.escape(value)
+    first = hits[0] if hits else 0
+    start = max(first - words // 3, 0)
+    end = min(start + words, len(tokens))
+    hits = set(hits)
+    parts, pos = [], tokens[start].start() if start > 0 else 0
+    for i in range(start, end):
+        m = tokens[i]
+        parts.append(html.escape(value[pos:m.start()]))
+        word = html.escape(m.group(0))
+        parts.append(f'<mark>{word}</mark>' if i in hits else word)
+        pos = m.end()
+    if end == len(tokens):
+        parts.append(html.escape(value[pos:]))
+    snippet = ''.join(parts)
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(tokens) else '')
+
+
+class SearchBackend(ABC):
+    """Index maintenance hooks default to no-ops (a backend without a side index needs none);
+    every backend must answer the match queries."""
+
+    def create(self, connection):
+        pass
+
+    def drop(self, connection):
+        pass
+
+    def index_ad(self, ad):
+        pass
+
+    def remove_ad(self, ad_id):
+        pass
+
+    @abstractmethod
+    def matches(self, query):
+        """Subquery of (ad_id, rank) for query, lower rank first; None if query has no words."""
+
+    def create_messages(self, connection):
+        pass
+
+    def drop_messages(self, connection):
+        pass
+
+    def index_message(self, message, conversation):
+        pass
+
+    @abstractmethod
+    def message_matches(self, query, user_id):
+        """Subquery of (message_id, rank) in conversations of user_id; None if query has no words."""
+
+
+class SqliteSearch(SearchBackend):
+    """FTS5 table; English is stemmed by the porter tokenizer, Russian by stem_ru."""
+
+    def create(self, connection):
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS ads_fts USING fts5("
+            "ad_id UNINDEXED, title, description, tokenize='porter unicode61 remove_diacritics 2')"
+        ))
+
+    def drop(self, connection):
+        connection.execute(text('DROP TABLE IF EXISTS ads_fts'))
+
+    @staticmethod
+    def _rowid(ad_id):
+        # ads has a string primary key, so derive a stable integer rowid for O(log n) deletes
+        return int.from_bytes(hashlib.sha1(ad_id.encode()).digest()[:8], 'big') >> 1
+
+    def index_ad(self, ad):
+        self.remove_ad(ad.id)
+        db.session.execute(
+            text('INSERT INTO ads_fts (rowid, ad_id, title, description) VALUES (:rowid, :ad_id, :title, :description)'),
+            {'rowid': self._rowid(ad.id), 'ad_id': ad.id, 'title': _stem_text(ad.title), 'description': _stem_text(ad.description)},
+        )
+
+    def remove_ad(self, ad_id):
+        db.session.execute(text('DELETE FROM ads_fts WHERE rowid = :rowid'), {'rowid': self._rowid(ad_id)})
+
+    def matches(self, query):
+        terms = _query_terms(query)
+        if not terms:
+            return None
+        # every term must match, each as a prefix; quoting keeps FTS5 operators out of user input
+        expr = ' '.join('"%s"*' % t.replace('"', '') for t in terms)
+        # bm25 is negative (lower is better); title weighs more than description
+        return text(
+            'SELECT ad_id, bm25(ads_fts, 0.0, 10.0, 1.0) AS rank FROM ads_fts WHERE ads_fts MATCH :expr'
+        ).bindparams(expr=expr).columns(ad_id=db.String, rank=db.Float).subquery('search')
+
+    def create_messages(self, connection):
+        # participants holds one token per participant, so the MATCH itself is limited to the caller's chats
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+            "message_id UNINDEXED, participants, text, tokenize='porter unicode61 remove_diacritics 2')"
+        ))
+
+    def drop_messages(self, connection):
+        connection.execute(text('DROP TABLE IF EXISTS messages_fts'))
+
+    def index_message(self, message, conversation):
+        participants = ' '.join(_participant_token(u) for u in (conversation.user1_id, conversation.user2_id))
+        db.session.execute(
+            text('INSERT OR REPLACE INTO messages_fts (rowid, message_id, participants, text) VALUES (:rowid, :message_id, :participants, :text)'),
+            {'rowid': self._rowid(message.id), 'message_id': message.id, 'participants': participants, 'text': _stem_text(message.text)},
+        )
+
+    def message_matches(self, query, user_id):
+        terms = _query_terms(query)
+        if not terms:
+            return None
+        expr = 'participants : "%s" AND text : (%s)' % (_participant_token(user_id), ' '.join('"%s"*' % t.replace('"', '') for t in terms))
+        return text(
+            'SELECT message_id, bm25(messages_fts, 0.0, 0.0, 1.0) AS rank FROM messages_fts WHERE messages_fts MATCH :expr'
+        ).bindparams(expr=expr).columns(message_id=db.String, rank=db.Float).subquery('message_search')
+
+
+class PostgresSearch(SearchBackend):
+    """tsvector side table with a GIN index, indexed with both Russian and English configs."""
+
+    DOCUMENT = (
+        "setweight(to_tsvector('russian', coalesce(:title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(:title, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(:description, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(:description, '')), 'B')"
+    )
+
+    def create(self, connection):
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS ads_search ('
+            'ad_id VARCHAR(36) PRIMARY KEY REFERENCES ads (id) ON DELETE CASCADE, '
+            'document TSVECTOR NOT NULL)'
+        ))
+        connection.execute(text('CREATE INDEX IF NOT EXISTS ix_ads_search_document ON ads_search USING GIN (document)'))
+
+    def drop(self, connection):
+        connection.execute(text('DROP TABLE IF EXISTS ads_search'))
+
+    def index_ad(self, ad):
+        db.session.execute(
+            text('INSERT INTO ads_search (ad_id, document) VALUES (:ad_id, %s) '
+                 'ON CONFLICT (ad_id) DO UPDATE SET document = EXCLUDED.document' % self.DOCUMENT),
+            {'ad_id': ad.id, 'title': ad.title, 'description': ad.description},
+        )
+
+    def remove_ad(self, ad_id):
+        db.session.execute(text('DELETE FROM ads_search WHERE ad_id = :ad_id'), {'ad_id': ad_id})
+
+    def matches(self, query):
+        if not WORD_RE.search(query):
+            return None
+        return text(
+            "SELECT s.ad_id, -ts_rank_cd(s.document, q.query) AS rank "
+            "FROM ads_search s, (SELECT websearch_to_tsquery('russian', :query) || "
+            "websearch_to_tsquery('english', :query) AS query) q "
+            "WHERE s.document @@ q.query"
+        ).bindparams(query=query).columns(ad_id=db.String, rank=db.Float).subquery('search')
+
+    def create_messages(self, connection):
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS messages_search ('
+            'message_id VARCHAR(36) PRIMARY KEY REFERENCES messages (id) ON DELETE CASCADE, '
+            'document TSVECTOR NOT NULL)'
+        ))
+        connection.execute(text('CREATE INDEX IF NOT EXISTS ix_messages_search_document ON messages_search USING GIN (document)'))
+
+    def drop_messages(self, connection):
+        connection.execute(text('DROP TABLE IF EXISTS messages_search'))
+
+    def index_message(self, message, conversation):
+        db.session.execute(
+            text("INSERT INTO messages_search (message_id, document) VALUES (:message_id, "
+                 "to_tsvector('russian', :text) || to_tsvector('english', :text)) "
+                 "ON CONFLICT (message_id) DO UPDATE SET document = EXCLUDED.document"),
+            {'message_id': message.id, 'text': message.text},
+        )
+
+    def message_matches(self, query, user_id):
+        if not WORD_RE.search(query):
+            return None
+        return text(
+            "SELECT s.message_id, -ts_rank_cd(s.document, q.query) AS rank "
+            "FROM messages_search s JOIN messages m ON m.id = s.message_id "
+            "JOIN conversations c ON c.id = m.conversation_id, "
+            "(SELECT websearch_to_tsquery('russian', :query) || websearch_to_tsquery('english', :query) AS query) q "
+            "WHERE s.document @@ q.query AND (c.user1_id = :user_id OR c.user2_id = :user_id)"
+        ).bindparams(query=query, user_id=user_id).columns(message_id=db.String, rank=db.Float).subquery('message_search')
+
+
+class LikeSearch(SearchBackend):
+    """Fallback for databases without a full-text engine: unranked substring match."""
+
+    def matches(self, query):
+        pattern = f'%{query}%'
+        return (
+            db.select(Ad.id.label('ad_id'), db.literal(0.0).label('rank'))
+            .where(Ad.title.ilike(pattern) | Ad.description.ilike(pattern))
+            .subquery('search')
+        )
+
+    def message_matches(self, query, user_id):
+        return (
+            db.select(Message.id.label('message_id'), db.literal(0.0).label('rank'))
+            .join(Conversation, Conversation.id == Message.conversation_id)
+            .where(Message.text.ilike(f'%{query}%'), (Conversation.user1_id == user_id) | (Conversation.user2_id == user_id))
+            .subquery('message_search')
+        )
+
+
+BACKENDS = {'sqlite': SqliteSearch(), 'postgresql': PostgresSearch()}
+FALLBACK = LikeSearch()
+
+
+def backend_for(dialect_name):
+    return BACKENDS.get(dialect_name, FALLBACK)
+
+
+def get_backend():
+    return backend_for(db.session.get_bind().dialect.name)
+
+
+def index_ad(ad):
+    get_backend().index_ad(ad)
+
+
+def remove_ad(ad_id):
+    get_backend().remove_ad(ad_id)
+
+
+def matches(query):
+    return get_backend().matches(query)
+
+
+def index_message(message, conversation):
+    get_backend().index_message(message, conversation)
+
+
+def message_matches(query, user_id):
+    return get_backend().message_matches(query, user_id)
+
+
+def rebuild_index():
+    """Re-index every ad, e.g. after restoring a dump or enabling search on an old DB."""
+    backend = get_backend()
+    count = 0
+    for ad in Ad.query.yield_per(500):
+        backend.index_ad(ad)
+        count += 1
+    db.session.commit()
+    return count
+
+
+def rebuild_message_index():
+    """Re-index every message; returns how many."""
+    backend = get_backend()
+    count = 0
+    rows = db.session.query(Message, Conversation).join(Conversation, Conversation.id == Message.conversation_id)
+    for message, conversation in rows.yield_per(500):
+        backend.index_message(message, conversation)
+        count += 1
+    db.session.commit()
+    return count
+
+
+@event.listens_for(Ad.__table__, 'after_create')
+def _create_index_table(target, connection, **kw):
+    backend_for(connection.dialect.name).create(connection)
+
+
+@event.listens_for(Ad.__table__, 'before_drop')
+def _drop_index_table(target, connection, **kw):
+    backend_for(connection.dialect.name).drop(connection)
+
+
+@event.listens_for(Message.__table__, 'after_create')
+def _create_message_index_table(target, connection, **kw):
+    backend_for(connection.dialect.name).create_messages(connection)
+
+
+@event.listens_for(Message.__table__, 'before_drop')
+def _drop_message_index_table(target, connection, **kw):
+    backend_for(connection.dialect.name).drop_messages(connection)
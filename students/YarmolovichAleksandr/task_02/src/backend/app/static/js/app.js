@@ -100,6 +100,16 @@ document.addEventListener('DOMContentLoaded', ()=>{
   if (document.getElementById('moderator-report-list')) setupModeratorPage()
 })
 
+// total unread messages in the nav badge (a single counter read on the server)
+async function refreshUnread(){
+  const badge = document.getElementById('nav-unread')
+  if (!badge) return
+  const r = await apiFetch('/conversations/unread')
+  const n = r.status === 'ok' ? r.data.unread : 0
+  badge.innerText = n
+  badge.classList.toggle('d-none', !n)
+}
+
 async function updateNav(){
   const token = localStorage.getItem('accessToken')
   const navLogin = document.getElementById('nav-login')
@@ -126,6 +136,7 @@ async function updateNav(){
     else navAdmin?.classList.add('d-none')
     if (role && role === 'moderator') navModerator?.classList.remove('d-none')
     else navModerator?.classList.add('d-none')
+    refreshUnread()
   } else {
     navLogin?.classList.remove('d-none')
     navRegister?.classList.remove('d-none')
@@ -156,7 +167,7 @@ async function loadAds(){
     emptyState.classList.add('d-none')
     data.data.forEach(a=>{
       const col = document.createElement('div'); col.className='col-sm-6 col-lg-4'
-      const imgHtml = a.images && a.images[0] ? `<div class="card-img-container"><img src="${a.images[0]}" alt="${a.title}"></div>` : '<div style="height: 200px; background: #f3f4f6;"></div>'
+      const imgHtml = a.cover_url ? `<div class="card-img-container"><img src="${a.cover_url}" alt="${a.title}"></div>` : '<div style="height: 200px; background: #f3f4f6;"></div>'
       col.innerHTML = `<a href="/ads/${a.id}" class="ad-card"><div class="card"><div style="overflow:hidden;border-radius:8px 8px 0 0;">${imgHtml}</div><div class="card-body"><h5 class="card-title">${a.title}</h5><div class="card-price">$${parseFloat(a.price).toFixed(2)}</div><div class="card-meta"><span class="text-muted">${a.author_username || 'Unknown'}</span><span class="text-muted">Active</span></div></div></div></a>`
       list.appendChild(col)
     })
@@ -172,16 +183,13 @@ function setupCreateAd(){
     const price = parseFloat(document.getElementById('price').value || 0)
     const category_id = document.getElementById('category_id').value
     if (!category_id){ showToast('Select category','error'); return }
-    const r = await apiFetch('/ads', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({title,description,price,category_id})})
+    // the ad and its images go in one multipart request (one round trip, one transaction)
+    const body = new FormData()
+    Object.entries({title,description,price,category_id}).forEach(([k, v])=> body.append(k, v))
+    for (const f of document.getElementById('images').files) body.append('files', f)
+    const r = await apiFetch('/ads', {method:'POST', body})
     if (r.status==='ok'){
       const adId = r.data.id
-      const files = document.getElementById('images').files
-      if (files.length>0){
-        for (const f of files){
-          const fd = new FormData(); fd.append('file', f)
-          await apiFetch(`/ads/${adId}/media`, {method:'POST', body: fd})
-        }
-      }
       showToast('Ad created','success')
       location.href = `/ads/${adId}`
     } else showToast('Create failed','error')
@@ -205,7 +213,7 @@ function setupEditAd(){
           const container = document.getElementById('existing-media'); container.innerHTML = ''
           m.data.forEach(mm=>{
             const el = document.createElement('div'); el.className='position-relative'
-            el.innerHTML = `<img src="${mm.url}" class="media-thumb"><button class="btn btn-sm btn-danger position-absolute top-0 end-0 delete-media" data-id="${mm.id}">x</button>`
+            el.innerHTML = `<img src="${mm.thumb || mm.url}" class="media-thumb"><button class="btn btn-sm btn-danger position-absolute top-0 end-0 delete-media" data-id="${mm.id}">x</button>`
             container.appendChild(el)
           })
           // attach delete handlers
@@ -231,8 +239,7 @@ function setupEditAd(){
       const files = document.getElementById('images').files
       if (files.length>0){
         for (const f of files){
-          const fd = new FormData(); fd.append('file', f)
-          await apiFetch(`/ads/${adId}/media`, {method:'POST', body: fd})
+          await uploadFile(adId, f)
         }
       }
       showToast('Ad updated','success')
@@ -320,6 +327,7 @@ async function openAdConversation(convId){
   list.innerHTML = ''
   const msgs = await apiFetch(`/conversations/${convId}/messages`)
   if (msgs.status !== 'ok') return
+  if (msgs.data.length) apiFetch(`/conversations/${convId}/read`, {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({message_id: msgs.data[msgs.data.length - 1].id})})
   msgs.data.forEach(m=>{
     const msgDiv = document.createElement('div')
     msgDiv.className = 'message'
@@ -349,7 +357,9 @@ async function loadConversations(){
     list.innerHTML = ''
     r.data.forEach(c=>{
       const el = document.createElement('div'); el.className='p-2 border mb-2'
-      el.innerHTML = `Ad: ${c.ad_title || c.ad_id} — with ${c.partner_username || c.partner_id} — <a href="#" data-id="${c.id}" class="open-conv">Open</a>`
+      const unread = c.unread_count ? ` <span class="badge bg-primary">${c.unread_count}</span>` : ''
+      const preview = c.last_message ? `<div class="text-muted small">${c.last_message.text}</div>` : ''
+      el.innerHTML = `Ad: ${c.ad_title || c.ad_id} — with ${c.partner_username || c.partner_id}${unread} — <a href="#" data-id="${c.id}" class="open-conv">Open</a>${preview}`
       list.appendChild(el)
     })
     document.querySelectorAll('.open-conv').forEach(a=>a.addEventListener('click', async (e)=>{
@@ -364,7 +374,7 @@ async function loadConversations(){
 async function loadMyAds(){
   const myId = localStorage.getItem('userId')
   if (!myId) { document.getElementById('my-ads-list').innerHTML = '<div class="text-muted">Please login</div>'; return }
-  const r = await apiFetch(`/ads?authorId=${myId}&limit=1000`)
+  const r = await apiFetch(`/ads?authorId=${myId}&limit=100`)
   const list = document.getElementById('my-ads-list')
   list.innerHTML = ''
   if (r.status!=='ok') { list.innerHTML = '<div class="text-danger">Failed to load</div>'; return }
@@ -423,14 +433,77 @@ function setupModeratorPage(){
   } else tgt.innerHTML = '<div class="text-danger">Failed to load</div>' })
 }
 
+// live messages of a conversation over Server-Sent Events. fetch() instead of
+// EventSource so the JWT goes in the Authorization header; on disconnect it
+// reconnects with Last-Event-ID and the server replays what was missed.
+let conversationStream = null
+function streamConversation(id, lastId, onMessage, onReset, onRead){
+  if (conversationStream) conversationStream.abort()
+  const controller = conversationStream = new AbortController()
+  const connect = async ()=>{
+    const token = localStorage.getItem('accessToken')
+    const headers = {...(token ? {'Authorization': `Bearer ${token}`} : {}), ...(lastId ? {'Last-Event-ID': lastId} : {})}
+    try {
+      const r = await fetch(`${API_ROOT}/conversations/${id}/events`, {headers, signal: controller.signal})
+      if (!r.ok) return
+      const reader = r.body.pipeThrough(new TextDecoderStream()).getReader()
+      let buffer = ''
+      while (true){
+        const {value, done} = await reader.read()
+        if (done) break
+        buffer += value
+        let end
+        while ((end = buffer.indexOf('\n\n')) >= 0){
+          const fields = {}
+          buffer.slice(0, end).split('\n').forEach(line=>{ const i = line.indexOf(': '); if (i > 0) fields[line.slice(0, i)] = line.slice(i + 2) })
+          buffer = buffer.slice(end + 2)
+          if (fields.event === 'message'){ lastId = fields.id; onMessage(JSON.parse(fields.data)) }
+          else if (fields.event === 'read' && onRead) onRead(JSON.parse(fields.data))
+          else if (fields.event === 'reset' && onReset) { onReset(); return }
+        }
+      }
+    } catch (e) {
+      if (controller.signal.aborted) return
+    }
+    if (!controller.signal.aborted) setTimeout(connect, 3000)
+  }
+  connect()
+  return controller
+}
+
 async function openConversation(id){
   const pane = document.getElementById('conv-pane'); pane.classList.remove('d-none')
   const header = document.getElementById('conv-header'); header.innerText = 'Conversation ' + id
   const msgs = await apiFetch(`/conversations/${id}/messages`)
   const box = document.getElementById('messages'); box.innerHTML = ''
-  msgs.data.forEach(m=>{ const p = document.createElement('div'); p.innerText = `${m.author_username || m.author_id}: ${m.text}`; box.appendChild(p) })
+  // the newest page comes first; older pages are prepended on demand
+  const prepend = (page)=>{
+    box.querySelector('.load-older')?.remove()
+    page.data.slice().reverse().forEach(m=>{ const p = document.createElement('div'); p.innerText = `${m.author_username || m.author_id}: ${m.text}`; box.prepend(p) })
+    if (page.before_cursor){
+      const more = document.createElement('a'); more.href = '#'; more.className = 'load-older d-block small mb-2'; more.innerText = 'Load older messages'
+      more.onclick = async (e)=>{ e.preventDefault(); const older = await apiFetch(`/conversations/${id}/messages?before=${page.before_cursor}`); if (older.status === 'ok') prepend(older) }
+      box.prepend(more)
+    }
+  }
+  if (msgs.status === 'ok') prepend(msgs)
+  const newest = msgs.status === 'ok' && msgs.data.length ? msgs.data[msgs.data.length - 1].id : null
+  // fetching history does not mark it read: say so for the page that is now on screen
+  if (newest) await apiFetch(`/conversations/${id}/read`, {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({message_id: newest})})
+  // read receipt under the history
+  const seen = document.getElementById('conv-seen') || Object.assign(document.createElement('div'), {id: 'conv-seen', className: 'text-muted small'})
+  box.after(seen)
+  const showSeen = (at)=>{ seen.innerText = at ? `Seen ${new Date(at + 'Z').toLocaleString()}` : '' }
+  showSeen(msgs.partner_read_at)
+  refreshUnread()
+  const myId = localStorage.getItem('userId')
+  streamConversation(id, newest, m=>{
+    const p = document.createElement('div'); p.innerText = `${m.author_username || m.author_id}: ${m.text}`; box.appendChild(p)
+    if (m.author_id !== myId) apiFetch(`/conversations/${id}/read`, {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({message_id: m.id})})
+  }, ()=> openConversation(id), e=>{ if (e.user_id !== myId) showSeen(e.read_at) })
   const form = document.getElementById('msg-form')
-  form.onsubmit = async (e)=>{ e.preventDefault(); const text = document.getElementById('msg-text').value; await apiFetch(`/conversations/${id}/messages`, {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({text})}); openConversation(id) }
+  // the posted message comes back over the stream
+  form.onsubmit = async (e)=>{ e.preventDefault(); const input = document.getElementById('msg-text'); await apiFetch(`/conversations/${id}/messages`, {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({text: input.value})}); input.value = '' }
 }
 
 async function loadReports(){
@@ -448,8 +521,52 @@ async function loadReports(){
   }
 }
 
+// depth-first list of [category, depth] pairs from the nested tree
+function flattenTree(nodes, depth=0, out=[]){
+  nodes.forEach(n=>{ out.push([n, depth]); flattenTree(n.children || [], depth + 1, out) })
+  return out
+}
+
+// hex sha256 of a file, or null where WebCrypto is unavailable (plain http)
+async function fileSha256(file){
+  if (!(window.crypto && crypto.subtle)) return null
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+  return Array.from(new Uint8Array(digest)).map(b=>b.toString(16).padStart(2, '0')).join('')
+}
+
+// resumable upload: create a session, PUT chunks, then complete; a failed chunk
+// is retried from the offset the server reports instead of from the start.
+// With S3 storage the session is direct: the file goes to the bucket in one PUT.
+const UPLOAD_CHUNK = 1024 * 1024
+async function uploadFile(adId, file){
+  const sha256 = await fileSha256(file)
+  const created = await apiFetch('/uploads', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({ad_id: adId, filename: file.name, size: file.size, sha256})})
+  if (created.status !== 'ok') return created
+  const id = created.data.id
+  if (created.data.direct){
+    const upload = created.data.upload
+    if (upload){
+      const put = await fetch(upload.url, {method: upload.method, headers: upload.headers, body: file}).catch(e=>null)
+      if (!put || !put.ok) return {status:'error', error:{message:'Upload to storage failed'}}
+    }
+    return apiFetch(`/uploads/${id}/complete`, {method:'POST'})
+  }
+  let offset = 0, failures = 0
+  while (offset < file.size){
+    const end = Math.min(offset + UPLOAD_CHUNK, file.size)
+    const r = await apiFetch(`/uploads/${id}`, {method:'PUT', headers:{'Content-Range': `bytes ${offset}-${end - 1}/${file.size}`}, body: file.slice(offset, end)})
+    if (r.status === 'ok') { offset = r.data.offset; failures = 0; continue }
+    if (r.data && typeof r.data.offset === 'number') { offset = r.data.offset; continue }
+    if (++failures > 5) return r
+    const status = await apiFetch(`/uploads/${id}`)
+    if (status.status === 'ok') offset = status.data.offset
+  }
+  return apiFetch(`/uploads/${id}/complete`, {method:'POST'})
+}
+
 async function loadCategories(){
-  const r = await apiFetch('/categories')
+  // the browser revalidates with If-None-Match and gets a 304 while the tree version is unchanged
+  const r = await apiFetch('/categories/tree')
   if (r.status==='ok'){
     const catSelect = document.getElementById('category_id')
     const filter = document.getElementById('category-filter')
@@ -460,12 +577,13 @@ async function loadCategories(){
     if (filter) {
       filter.innerHTML = '<option value="">All categories</option>'
     }
-    r.data.forEach(c=>{
+    flattenTree(r.data).forEach(([c, depth])=>{
+      const label = '\u00a0\u00a0'.repeat(depth) + c.name
       if (catSelect) {
-        const o = document.createElement('option'); o.value = c.id; o.innerText = c.name; catSelect.appendChild(o)
+        const o = document.createElement('option'); o.value = c.id; o.innerText = label; catSelect.appendChild(o)
       }
       if (filter) {
-        const o = document.createElement('option'); o.value = c.id; o.innerText = c.name; filter.appendChild(o)
+        const o = document.createElement('option'); o.value = c.id; o.innerText = label; filter.appendChild(o)
       }
     })
     // reload ads when filter changes
@@ -545,24 +663,30 @@ async function loadAdminCategories(){
   }))
 }
 
-async function loadAdminReports(){
+async function loadAdminReports(cursor){
   const list = document.getElementById('admin-report-list')
   const token = localStorage.getItem('accessToken')
   if (!token){ if (list) list.innerHTML = '<div class="text-muted">Please login to view reports</div>'; return }
   const role = localStorage.getItem('role')
   if (!role || (role !== 'admin' && role !== 'moderator')){ if (list) list.innerHTML = '<div class="text-danger">Insufficient permissions</div>'; return }
-  const r = await apiFetch('/reports')
+  // the queue is keyset-paginated: "Load more" appends the next page
+  const r = await apiFetch('/reports' + (cursor ? '?cursor=' + encodeURIComponent(cursor) : ''))
   if (r.status !== 'ok'){ list.innerHTML = '<div class="text-danger">Failed to load reports</div>'; return }
-  list.innerHTML = ''
+  if (cursor) list.querySelector('.load-more-reports')?.remove(); else list.innerHTML = ''
   r.data.forEach(rep=>{
     const el = document.createElement('div'); el.className='p-2 border mb-2'
     el.innerHTML = `<div><strong>Report ${rep.id}:</strong> <strong>${rep.ad_title || rep.ad_id}</strong> — reason: ${rep.reason || ''} — reported by ${rep.reporter_username || rep.reporter_id}</div><div class="mt-2">status: <select class="form-select form-select-sm report-status" data-id="${rep.id}"><option value="new" ${rep.status==='new'?'selected':''}}>new</option><option value="reviewing" ${rep.status==='reviewing'?'selected':''}}>reviewing</option><option value="resolved" ${rep.status==='resolved'?'selected':''}}>resolved</option></select> <label class="ms-2"><input type="checkbox" class="block-ad"> block ad on resolve</label> <button class="btn btn-sm btn-primary ms-2 save-report">Save</button></div>`
     list.appendChild(el)
+    el.querySelector('.save-report').addEventListener('click', async (e)=>{
+      const container = e.target.closest('div'); const id = container.querySelector('.report-status').dataset.id; const status = container.querySelector('.report-status').value; const block = container.querySelector('.block-ad').checked
+      if (block && !confirm('You are about to block the ad if resolved. Continue?')) return
+      const res = await apiFetch(`/reports/${id}`, {method:'PUT', headers:{'Content-Type':'application/json'}, body: JSON.stringify({status, block_ad: block})})
+      if (res.status==='ok'){ showToast('Saved','success'); if (status==='resolved') container.closest('.p-2').remove(); else loadAdminReports() } else showToast(res.error?.message || 'Save failed','error')
+    })
   })
-  list.querySelectorAll('.save-report').forEach(btn=> btn.addEventListener('click', async (e)=>{
-    const container = e.target.closest('div'); const id = container.querySelector('.report-status').dataset.id; const status = container.querySelector('.report-status').value; const block = container.querySelector('.block-ad').checked
-    if (block && !confirm('You are about to block the ad if resolved. Continue?')) return
-    const res = await apiFetch(`/reports/${id}`, {method:'PUT', headers:{'Content-Type':'application/json'}, body: JSON.stringify({status, block_ad: block})})
-    if (res.status==='ok'){ showToast('Saved','success'); if (status==='resolved') container.closest('.p-2').remove(); else loadAdminReports() } else showToast(res.error?.message || 'Save failed','error')
-  }))
+  if (r.next_cursor){
+    const more = document.createElement('a'); more.href = '#'; more.className = 'load-more-reports d-block small'; more.innerText = 'Load more reports'
+    more.addEventListener('click', (e)=>{ e.preventDefault(); loadAdminReports(r.next_cursor) })
+    list.appendChild(more)
+  }
 }
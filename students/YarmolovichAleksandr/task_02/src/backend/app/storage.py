@@ -0,0 +1,193 @@
+"""Where media files live.
+
+Files are addressed by key (``ab/cd/<sha256>.png``, renditions next to them) and
+every driver turns a key into the public URL stored on ``Media.url``:
+
+* ``LocalStorage`` keeps them under ``UPLOAD_FOLDER``, served by ``/uploads``;
+* ``S3Storage`` keeps them in an S3-compatible bucket (AWS, MinIO, ...), served
+  by the bucket or a CDN in front of it (``S3_PUBLIC_URL``). It can also presign
+  direct uploads, so the bytes of an upload never pass through a Flask worker.
+
+``STORAGE_BACKEND`` picks the driver; ``get_storage()`` returns the app's instance.
+"""
+import base64
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from flask import current_app
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover - optional dependency
+    boto3 = None
+
+# every key is content-addressed, so stored objects can be cached forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_lock = threading.Lock()
+
+
+# one stored file as listed by files(); modified is naive UTC like the model timestamps
+StoredFile = namedtuple('StoredFile', 'key size modified')
+
+
+def content_type(key):
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+class LocalStorage:
+    name = 'local'
+    # uploads reach local storage through the /api/uploads chunks
+    direct_uploads = False
+
+    def __init__(self, root, base_url='/uploads/'):
+        self.root = root
+        self.base_url = base_url
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def url(self, key):
+        return self.base_url + key
+
+    def key_for(self, url):
+        return url[len(self.base_url):] if url.startswith(self.base_url) else None
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.path(key))
+        except OSError:
+            return None
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def save(self, key, src):
+        """Store the file at src under key; src is moved, not copied."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(src, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def local_copy(self, key):
+        yield self.path(key)
+
+    def files(self):
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                yield StoredFile(key, st.st_size, datetime.utcfromtimestamp(st.st_mtime))
+
+
+class S3Storage:
+    name = 's3'
+    direct_uploads = True
+
+    def __init__(self, bucket, endpoint_url=None, region=None, access_key=None, secret_key=None, public_url=None, presign_expires=900, client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError('STORAGE_BACKEND=s3 needs boto3 installed')
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self.client = client
+        self.bucket = bucket
+        if not public_url:
+            public_url = f'{endpoint_url}/{bucket}' if endpoint_url else f'https://{bucket}.s3.amazonaws.com'
+        self.public_url = public_url.rstrip('/') + '/'
+        self.presign_expires = presign_expires
+
+    def url(self, key):
+        return self.public_url + key
+
+    def key_for(self, url):
+        return url[len(self.public_url):] if url.startswith(self.public_url) else None
+
+    def _head(self, key, **kwargs):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key, **kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def size(self, key):
+        head = self._head(key)
+        return head['ContentLength'] if head else None
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def save(self, key, src):
+        self.client.upload_file(src, self.bucket, key, ExtraArgs={'ContentType': content_type(key), 'CacheControl': IMMUTABLE_CACHE_CONTROL})
+        os.remove(src)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    @contextmanager
+    def local_copy(self, key):
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, key, path)
+            yield path
+        finally:
+            os.remove(path)
+
+    def files(self):
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket):
+            for obj in page.get('Contents', []):
+                yield StoredFile(obj['Key'], obj['Size'], obj['LastModified'].astimezone(timezone.utc).replace(tzinfo=None))
+
+    def presign_put(self, key, size, sha256):
+        """URL and headers for a direct PUT of exactly size bytes with the given sha256 (hex)."""
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        headers = {'Content-Type': content_type(key), 'Cache-Control': IMMUTABLE_CACHE_CONTROL, 'x-amz-checksum-sha256': checksum}
+        url = self.client.generate_presigned_url('put_object', ExpiresIn=self.presign_expires, Params={
+            'Bucket': self.bucket, 'Key': key, 'ContentLength': size, 'ContentType': headers['Content-Type'],
+            'CacheControl': headers['Cache-Control'], 'ChecksumSHA256': checksum})
+        return {'method': 'PUT', 'url': url, 'headers': headers}
+
+    def checksum(self, key):
+        """sha256 (hex) the bucket verified on upload, or None if it did not keep one."""
+        head = self._head(key, ChecksumMode='ENABLED')
+        value = (head or {}).get('ChecksumSHA256')
+        # multipart uploads report a checksum of checksums ("...-<parts>"), not of the content
+        if not value or '-' in value:
+            return None
+        return base64.b64decode(value).hex()
+
+
+def create_storage(config):
+    if config['STORAGE_BACKEND'] == 's3':
+        return S3Storage(config['S3_BUCKET'], endpoint_url=config['S3_ENDPOINT_URL'], region=config['S3_REGION'],
+                         access_key=config['S3_ACCESS_KEY_ID'], secret_key=config['S3_SECRET_ACCESS_KEY'],
+                         public_url=config['S3_PUBLIC_URL'], presign_expires=config['S3_PRESIGN_EXPIRES'])
+    return LocalStorage(config['UPLOAD_FOLDER'])
+
+
+def get_storage():
+    app = current_app._get_current_object()
+    storage = app.extensions.get('storage')
+    if storage is None:
+        with _lock:
+            storage = app.extensions.get('storage')
+            if storage is None:
+                storage = app.extensions['storage'] = create_storage(app.config)
+    return storage
@@ -0,0 +1,267 @@
+"""Resumable chunked media uploads.
+
+A client creates a session for one file, PUTs the bytes in chunks (each with the
+offset it starts at) and completes the session, which turns the file into a
+Media row exactly like ``POST /api/ads/<id>/media``. Chunks are streamed from the
+request body to the partial file, never buffered whole, and an interrupted
+upload resumes from the offset ``GET /api/uploads/<id>`` reports. Sessions that
+stop receiving chunks expire after ``UPLOAD_SESSION_TTL`` seconds.
+
+When the storage driver supports it (S3) and the client sends the file's sha256,
+the session is *direct* instead: the response carries a presigned PUT straight to
+the storage under the content-addressed key (none at all if that content is
+already stored), and completing it only checks the stored object.
+"""
+import os
+import re
+from datetime import datetime, timedelta
+from flask import request, current_app
+from flask_restx import Namespace, Resource, fields
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from werkzeug.http import parse_content_range_header
+from werkzeug.utils import secure_filename
+from .models import Ad, MediaBlob, UploadSession
+from .extensions import db
+from .cache import cache
+from .media import attach_blob, attach_file, blob_key, file_digest, file_extension
+from .storage import get_storage
+from . import images
+
+ns = Namespace('uploads', description='Resumable media uploads')
+
+upload_model = ns.model('UploadSession', {
+    'ad_id': fields.String(required=True),
+    'filename': fields.String(required=True),
+    'size': fields.Integer(required=True),
+    'sha256': fields.String(description='hex sha256 of the file; enables direct uploads to the storage'),
+})
+
+# bytes read from the request stream per write
+COPY_BUFFER = 64 * 1024
+
+
+def partial_path(session_id):
+    return os.path.join(current_app.config['UPLOAD_PARTIAL_FOLDER'], session_id)
+
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _expiry():
+    return datetime.utcnow() + timedelta(seconds=current_app.config['UPLOAD_SESSION_TTL'])
+
+
+def _serialize(s):
+    data = {'id': s.id, 'ad_id': s.ad_id, 'filename': s.filename, 'size': s.size, 'offset': s.received, 'expires_at': s.expires_at.isoformat(), 'direct': s.sha256 is not None}
+    if s.sha256:
+        data['upload'] = _direct_upload(s)
+    return data
+
+
+def _direct_key(s):
+    """(key, ext) the content of a direct upload is stored under."""
+    blob = db.session.get(MediaBlob, s.sha256)
+    ext = blob.ext if blob else file_extension(s.filename)
+    return blob_key(s.sha256, ext), ext
+
+
+def _direct_upload(s):
+    """Presigned request the client sends the file with, or None if the content is already stored."""
+    storage = get_storage()
+    key, _ = _direct_key(s)
+    if storage.exists(key):
+        return None
+    return storage.presign_put(key, s.size, s.sha256)
+
+
+def _error(code, message, status):
+    return {'status': 'error', 'error': {'code': code, 'message': message}}, status
+
+
+def expire_sessions(now=None, batch=500):
+    """Drop sessions past their expiry together with their partial files; returns how many."""
+    now = now or datetime.utcnow()
+    removed = 0
+    while True:
+        expired = UploadSession.query.filter(UploadSession.expires_at < now).limit(batch).all()
+        if not expired:
+            return removed
+        for s in expired:
+            _discard(partial_path(s.id))
+            db.session.delete(s)
+        db.session.commit()
+        removed += len(expired)
+
+
+def remove_ad_sessions(ad):
+    """Drop the upload sessions of an ad that is being deleted; returns their partial files for discard_partials."""
+    ids = [id for (id,) in db.session.query(UploadSession.id).filter(UploadSession.ad_id == ad.id)]
+    if ids:
+        UploadSession.query.filter(UploadSession.id.in_(ids)).delete(synchronize_session=False)
+    return [partial_path(id) for id in ids]
+
+
+def discard_partials(paths):
+    for path in paths:
+        _discard(path)
+
+
+def _own_session(id):
+    s = db.session.get(UploadSession, id)
+    if s is None or s.owner_id != get_jwt_identity() or s.expires_at < datetime.utcnow():
+        return None
+    return s
+
+
+def _chunk_offset():
+    """Start offset of the chunk: Content-Range: bytes <start>-<end>/<total>, or ?offset=."""
+    header = request.headers.get('Content-Range')
+    if header:
+        parsed = parse_content_range_header(header)
+        return parsed.start if parsed else None
+    return request.args.get('offset', type=int)
+
+
+def _write_chunk(path, offset, limit):
+    """Copy the request body to path at offset; returns the byte count, or None if it passes limit."""
+    written = 0
+    stream = request.stream
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        while True:
+            block = stream.read(COPY_BUFFER)
+            if not block:
+                break
+            written += len(block)
+            if offset + written > limit:
+                f.truncate(offset)
+                return None
+            f.write(block)
+        f.truncate(offset + written)
+    return written
+
+
+@ns.route('')
+class UploadList(Resource):
+    @ns.expect(upload_model)
+    @jwt_required()
+    def post(self):
+        data = request.json or {}
+        ad = db.session.get(Ad, data.get('ad_id') or '')
+        if ad is None:
+            return _error('not_found', 'Ad not found', 404)
+        if get_jwt_identity() != ad.author_id and get_jwt().get('role') not in ('admin', 'moderator'):
+            return _error('forbidden', 'Not allowed', 403)
+        filename = secure_filename(data.get('filename') or '')
+        size = data.get('size')
+        if not filename:
+            return _error('validation_failed', 'No file name provided', 400)
+        if not isinstance(size, int) or size <= 0 or size > current_app.config['UPLOAD_MAX_SIZE']:
+            return _error('validation_failed', 'File size must be between 1 and %d bytes' % current_app.config['UPLOAD_MAX_SIZE'], 400)
+        sha256 = (data.get('sha256') or '').lower() or None
+        if sha256 and not re.fullmatch(r'[0-9a-f]{64}', sha256):
+            return _error('validation_failed', 'sha256 must be 64 hex digits', 400)
+        if not get_storage().direct_uploads:
+            sha256 = None
+        # abandoned sessions are swept here as well as by scripts/expire_uploads.py
+        expire_sessions()
+        s = UploadSession(ad_id=ad.id, owner_id=get_jwt_identity(), filename=filename, size=size, sha256=sha256, expires_at=_expiry())
+        db.session.add(s)
+        db.session.flush()
+        if not sha256:
+            os.makedirs(current_app.config['UPLOAD_PARTIAL_FOLDER'], exist_ok=True)
+            open(partial_path(s.id), 'wb').close()
+        db.session.commit()
+        return {'status': 'ok', 'data': _serialize(s)}, 201, {'Location': f'/api/uploads/{s.id}'}
+
+
+@ns.route('/<string:id>')
+class UploadItem(Resource):
+    @jwt_required()
+    def get(self, id):
+        s = _own_session(id)
+        if s is None:
+            return _error('not_found', 'Upload not found', 404)
+        return {'status': 'ok', 'data': _serialize(s)}
+
+    @jwt_required()
+    def put(self, id):
+        s = _own_session(id)
+        if s is None:
+            return _error('not_found', 'Upload not found', 404)
+        if s.sha256:
+            return _error('validation_failed', 'This upload goes directly to the storage', 400)
+        offset = _chunk_offset()
+        if offset is None:
+            return _error('validation_failed', 'Content-Range or offset is required', 400)
+        if offset != s.received:
+            # a retried or out-of-order chunk: tell the client where to resume
+            return {'status': 'error', 'error': {'code': 'offset_mismatch', 'message': 'Expected offset %d' % s.received}, 'data': _serialize(s)}, 409
+        written = _write_chunk(partial_path(s.id), offset, s.size)
+        if written is None:
+            return _error('validation_failed', 'Chunk goes past the declared size', 400)
+        # compare-and-set, so two concurrent chunks for the same offset cannot both count
+        done = db.session.query(UploadSession).filter(UploadSession.id == s.id, UploadSession.received == offset).update(
+            {'received': offset + written, 'expires_at': _expiry()}, synchronize_session=False)
+        db.session.commit()
+        db.session.refresh(s)
+        if not done:
+            return {'status': 'error', 'error': {'code': 'offset_mismatch', 'message': 'Expected offset %d' % s.received}, 'data': _serialize(s)}, 409
+        return {'status': 'ok', 'data': _serialize(s)}
+
+    @jwt_required()
+    def delete(self, id):
+        s = _own_session(id)
+        if s is None:
+            return _error('not_found', 'Upload not found', 404)
+        _discard(partial_path(s.id))
+        db.session.delete(s)
+        db.session.commit()
+        return {'status': 'ok'}
+
+
+@ns.route('/<string:id>/complete')
+class UploadComplete(Resource):
+    @jwt_required()
+    def post(self, id):
+        s = _own_session(id)
+        if s is None:
+            return _error('not_found', 'Upload not found', 404)
+        ad = db.session.get(Ad, s.ad_id)
+        if s.sha256:
+            m, error = _complete_direct(s, ad)
+            if error:
+                return error
+        elif s.received != s.size:
+            return {'status': 'error', 'error': {'code': 'upload_incomplete', 'message': 'Received %d of %d bytes' % (s.received, s.size)}, 'data': _serialize(s)}, 409
+        else:
+            m = attach_file(ad, partial_path(s.id), s.filename)
+        db.session.delete(s)
+        db.session.commit()
+        images.process_later(m)
+        cache.purge('ad:' + ad.id, 'ad-card:' + ad.id)
+        return {'status': 'ok', 'data': {'id': m.id, 'url': m.url}}, 201
+
+
+def _complete_direct(s, ad):
+    """Attach the object a direct upload put into the storage; returns (media, error response)."""
+    storage = get_storage()
+    key, ext = _direct_key(s)
+    stored = storage.size(key)
+    if stored != s.size:
+        return None, ({'status': 'error', 'error': {'code': 'upload_incomplete', 'message': 'Received %d of %d bytes' % (stored or 0, s.size)}, 'data': _serialize(s)}, 409)
+    if db.session.get(MediaBlob, s.sha256) is None:
+        # new content: make sure the object really has the hash its key claims,
+        # otherwise later uploads of that content would be deduplicated onto it
+        checksum = storage.checksum(key)
+        if checksum is None:
+            with storage.local_copy(key) as path:
+                checksum = file_digest(path)[0]
+        if checksum != s.sha256:
+            storage.delete(key)
+            return None, _error('checksum_mismatch', 'Uploaded content does not match sha256', 409)
+    return attach_blob(ad, s.sha256, ext, s.size, storage.url(key)), None
@@ -1,7 +1,9 @@
+from datetime import datetime
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from .models import User
+from .models import User, Ad
 from .extensions import db
+from .cache import cache
 from .utils import role_required
 
 ns = Namespace('users', description='User operations')
@@ -56,12 +58,18 @@ class UserItem(Resource):
                 return {'status': 'error', 'error': {'code': 'forbidden', 'message': 'Admin or self only'}}, 403
         data = ns.payload or {}
         u = User.query.get_or_404(id)
+        renamed = data.get('username', u.username) != u.username
+        if renamed:
+            # ad pages and listings show the author's username: move their stamps with it
+            db.session.query(Ad).filter(Ad.author_id == u.id).update({Ad.updated_at: datetime.utcnow()}, synchronize_session=False)
         u.username = data.get('username', u.username)
         u.email = data.get('email', u.email)
         # allow admin to change role
         if claims and claims.get('role') == 'admin' and 'role' in data:
             u.role = data.get('role', u.role)
         db.session.commit()
+        if renamed:
+            cache.purge('ads:list', 'author:' + u.id)
         return {'status': 'ok', 'data': {'id': u.id, 'username': u.username, 'email': u.email, 'role': u.role}}
 
     @jwt_required()
@@ -1,5 +1,7 @@
 from functools import wraps
 from flask_jwt_extended import verify_jwt_in_request, get_jwt
+from sqlalchemy.dialects import postgresql, sqlite
+from .extensions import db
 
 
 def role_required(roles):
@@ -13,4 +15,21 @@ def role_required(roles):
                 return {'status': 'error', 'error': {'code': 'forbidden', 'message': 'Insufficient permissions'}}, 403
             return fn(*args, **kwargs)
         return decorator
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def increment(model, keys, column, delta=1, defaults=None):
+    """Atomically add delta to model.<column> in the row identified by keys, creating it if missing.
+
+    defaults are the other column values used only when the row is created.
+    """
+    attr = getattr(model, column)
+    values = dict(defaults or {}, **keys, **{column: delta})
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite if dialect == 'sqlite' else postgresql).insert(model).values(**values)
+        db.session.execute(insert.on_conflict_do_update(index_elements=list(keys), set_={column: attr + delta}))
+        return
+    updated = db.session.query(model).filter_by(**keys).update({attr: attr + delta}, synchronize_session=False)
+    if not updated:
+        db.session.add(model(**values))
@@ -0,0 +1,53 @@
+"""indexes for hot query paths
+
+Revision ID: 8b86df427ee7
+Revises: 4e15179efe74
+Create Date: 2026-10-18 02:16:20.718290
+
+On PostgreSQL the indexes are built with CREATE INDEX CONCURRENTLY, which
+cannot run inside a transaction, so they are created in an autocommit block
+and the tables stay writable while the build runs.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b86df427ee7'
+down_revision = '4e15179efe74'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_ads_author_created_at_id', 'ads', ['author_id', 'created_at', 'id']),
+    ('ix_ads_category_id', 'ads', ['category_id']),
+    ('ix_ads_status_category_created_at_id', 'ads', ['status', 'category_id', 'created_at', 'id']),
+    ('ix_categories_parent_id', 'categories', ['parent_id']),
+    ('ix_conversations_ad_users', 'conversations', ['ad_id', 'user1_id', 'user2_id']),
+    ('ix_conversations_user1_id', 'conversations', ['user1_id']),
+    ('ix_conversations_user2_id', 'conversations', ['user2_id']),
+    ('ix_media_ad_id', 'media', ['ad_id']),
+    ('ix_messages_conversation_created_at_id', 'messages', ['conversation_id', 'created_at', 'id']),
+    ('ix_reports_ad_id', 'reports', ['ad_id']),
+    ('ix_reports_status_created_at_id', 'reports', ['status', 'created_at', 'id']),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+    else:
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, columns in reversed(INDEXES):
+                op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    else:
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True)
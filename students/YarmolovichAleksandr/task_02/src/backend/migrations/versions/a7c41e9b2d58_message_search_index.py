@@ -0,0 +1,28 @@
+"""message search index
+
+Revision ID: a7c41e9b2d58
+Revises: d1ccd06d154c
+Create Date: 2026-10-18 04:12:37.514208
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app import search
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c41e9b2d58'
+down_revision = 'd1ccd06d154c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the side index is not a model table; fill it with scripts/reindex_search.py
+    bind = op.get_bind()
+    search.backend_for(bind.dialect.name).create_messages(bind)
+
+
+def downgrade():
+    bind = op.get_bind()
+    search.backend_for(bind.dialect.name).drop_messages(bind)
@@ -0,0 +1,100 @@
+"""Messages per second through POST /api/conversations/<id>/messages, with and without group commit.
+
+Runs against a throwaway SQLite file (so every commit really syncs to disk):
+    python scripts/bench_messages.py --threads 16 --messages 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+# ensure project root is on sys.path so this script can be run directly
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from app import create_app
+from app.config import Config
+from app.extensions import db
+from app.models import User, Category, Ad, Conversation
+
+
+def seed(senders):
+    """One seller and an ad; every sender gets a conversation with the seller."""
+    seller = User(username='seller', email='seller@example.com', password_hash=generate_password_hash('p'))
+    cat = Category(name='Misc')
+    db.session.add_all([seller, cat])
+    db.session.flush()
+    ad = Ad(author_id=seller.id, category_id=cat.id, title='Lamp', price=5)
+    db.session.add(ad)
+    db.session.flush()
+    chats = []
+    for i in range(senders):
+        user = User(username=f'sender{i}', email=f'sender{i}@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+        conv = Conversation(ad_id=ad.id, user1_id=min(user.id, seller.id), user2_id=max(user.id, seller.id))
+        db.session.add(conv)
+        db.session.flush()
+        chats.append((conv.id, create_access_token(identity=user.id)))
+    db.session.commit()
+    return chats
+
+
+def run(group_commit, threads, messages, window):
+    path = tempfile.mkstemp(suffix='.db')[1]
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+        MESSAGE_GROUP_COMMIT = group_commit
+        GROUP_COMMIT_WINDOW = window
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        chats = seed(threads)
+    errors = []
+    commits = []
+    with app.app_context():
+        event.listen(db.engine, 'commit', lambda conn: commits.append(1))
+
+    def sender(conv_id, token):
+        client = app.test_client()
+        headers = {'Authorization': 'Bearer ' + token}
+        for i in range(messages):
+            r = client.post(f'/api/conversations/{conv_id}/messages', json={'text': f'message {i}'}, headers=headers)
+            if r.status_code != 201:
+                errors.append(r.status_code)
+
+    workers = [threading.Thread(target=sender, args=chat) for chat in chats]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    with app.app_context():
+        db.engine.dispose()
+    os.unlink(path)
+    return threads * messages - len(errors), len(errors), len(commits), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16, help='concurrent senders, one conversation each')
+    parser.add_argument('--messages', type=int, default=50, help='messages per sender')
+    parser.add_argument('--window', type=float, default=0.005, help='group commit window in seconds')
+    args = parser.parse_args()
+    for group_commit in (False, True):
+        stored, failed, commits, elapsed = run(group_commit, args.threads, args.messages, args.window)
+        print(f"group commit {'on ' if group_commit else 'off'}: {stored / elapsed:8.1f} messages/s "
+              f"({stored} stored, {failed} failed, {commits} commits, {elapsed:.2f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+import sys
+from pathlib import Path
+# ensure project root is on sys.path so this script can be run directly
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import create_app
+from app.uploads import expire_sessions
+
+app = create_app()
+
+with app.app_context():
+    print('Expired upload sessions:', expire_sessions())
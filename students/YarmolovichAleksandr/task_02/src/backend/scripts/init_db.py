@@ -8,6 +8,7 @@ if str(ROOT) not in sys.path:
 from app import create_app
 from app.extensions import db
 from app.models import User, Category, Ad
+from app.categories import rebuild_closure
 from werkzeug.security import generate_password_hash
 
 app = create_app()
@@ -29,4 +30,5 @@ with app.app_context():
         db.session.add_all([cat1, cat2])
 
     db.session.commit()
+    rebuild_closure()
     print('Done.')
\ No newline at end of file
@@ -0,0 +1,25 @@
+import argparse
+import sys
+from pathlib import Path
+# ensure project root is on sys.path so this script can be run directly
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import create_app
+from app.media_gc import sweep
+
+parser = argparse.ArgumentParser(description='Delete media files no ad refers to any more.')
+parser.add_argument('--dry-run', action='store_true', help='only report what would be deleted')
+parser.add_argument('--batch', type=int, default=500, help='files checked per database round trip')
+parser.add_argument('--rate', type=float, default=50, help='deletions per second (0 = unlimited)')
+parser.add_argument('--max-deletes', type=int, help='stop after this many deletions')
+parser.add_argument('--min-age', type=int, default=3600, help='keep files younger than this many seconds')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    report = sweep(batch=args.batch, rate=args.rate, max_deletes=args.max_deletes, min_age=args.min_age, dry_run=args.dry_run)
+    print('Media GC%s:' % (' (dry run)' if args.dry_run else ''), report)
+    print('Reclaimed %.1f MiB' % (report['bytes'] / 1024 / 1024))
@@ -0,0 +1,49 @@
+import os
+import shutil
+import sys
+import uuid
+from pathlib import Path
+# ensure project root is on sys.path so this script can be run directly
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import create_app
+from app.extensions import db
+from app.images import variant_url
+from app.media import store_file
+from app.storage import LocalStorage
+from app.models import Media
+
+app = create_app()
+
+with app.app_context():
+    # moves files stored as uploads/<ad_id>_<name> into the content-addressed layout
+    # of the configured storage (so with STORAGE_BACKEND=s3 it also uploads them)
+    legacy = LocalStorage(app.config['UPLOAD_FOLDER'])
+    moved = missing = 0
+    tmp_dir = app.config['UPLOAD_PARTIAL_FOLDER']
+    os.makedirs(tmp_dir, exist_ok=True)
+    for m in Media.query.filter(Media.blob_hash.is_(None)).all():
+        name = legacy.key_for(m.url)
+        src = legacy.path(name) if name else None
+        if src is None or not os.path.exists(src):
+            missing += 1
+            continue
+        # the old file stays until the new URL is committed
+        tmp = os.path.join(tmp_dir, uuid.uuid4().hex)
+        shutil.copyfile(src, tmp)
+        # takes the reference on the blob, committed together with the new URL
+        digest, _, _, url = store_file(tmp, m.url)
+        old = [m.url] + sorted(set((m.variants or {}).values()))
+        ad = m.ad
+        if ad.cover_url in (m.url, variant_url(m, 'card')):
+            ad.cover_url = url
+        # renditions are re-rendered under the new name by scripts/render_images.py
+        m.url, m.blob_hash, m.variants = url, digest, None
+        db.session.commit()
+        for old_url in old:
+            if legacy.key_for(old_url):
+                legacy.delete(legacy.key_for(old_url))
+        moved += 1
+    print('Moved media:', moved, 'missing files:', missing)
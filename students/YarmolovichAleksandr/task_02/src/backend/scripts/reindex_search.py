@@ -0,0 +1,20 @@
+import sys
+from pathlib import Path
+# ensure project root is on sys.path so this script can be run directly
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import create_app
+from app.extensions import db
+from app import search
+
+app = create_app()
+
+with app.app_context():
+    # make sure the side index table exists on databases created before search was added
+    with db.engine.begin() as conn:
+        search.get_backend().create(conn)
+        search.get_backend().create_messages(conn)
+    print('Indexed ads:', search.rebuild_index())
+    print('Indexed messages:', search.rebuild_message_index())
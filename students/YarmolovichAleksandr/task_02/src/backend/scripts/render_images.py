@@ -0,0 +1,19 @@
+import sys
+from pathlib import Path
+# ensure project root is on sys.path so this script can be run directly
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import create_app
+from app import images
+from app.models import Media
+
+app = create_app()
+
+with app.app_context():
+    # renditions for media uploaded before they existed (or while rendering was off)
+    todo = Media.query.filter(Media.variants.is_(None), Media.type == 'image').all()
+    queued = [m for m in todo if images.process_later(m)]
+    images.wait_pending()
+    print('Rendered media:', len(queued), 'of', len(todo))
@@ -1,6 +1,8 @@
 from app import create_app
 from app.extensions import db
-from app.models import User, Category, Ad, Media
+from app.models import User, Category, Ad
+from app import search, facets
+from app.media import add_media
 
 app = create_app()
 
@@ -11,9 +13,11 @@ with app.app_context():
     if alice and electronics and not Ad.query.filter_by(title='iPhone X - good condition').first():
         ad = Ad(author_id=alice.id, category_id=electronics.id, title='iPhone X - good condition', description='Used iPhone X, 64GB, works fine', price=250)
         db.session.add(ad)
+        db.session.flush()
+        search.index_ad(ad)
+        facets.track(None, facets.facet_key(ad))
         db.session.commit()
-        m = Media(ad_id=ad.id, url='/uploads/iphone.jpg', type='image')
-        db.session.add(m)
+        add_media(ad, '/uploads/iphone.jpg')
         db.session.commit()
         print('Seeded ad with media')
     else:
@@ -4,9 +4,8 @@ from app.extensions import db
 
 @pytest.fixture
 def app():
-    app = create_app()
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    # the engine is created in init_app, so the test DB URI has to be set before it
+    app = create_app('app.config.TestConfig')
 
     with app.app_context():
         db.create_all()
@@ -16,4 +15,18 @@ def app():
 
 @pytest.fixture
 def client(app):
-    return app.test_client()
\ No newline at end of file
+    return app.test_client()
+
+@pytest.fixture
+def query_counter(app):
+    """Collects every SQL statement executed while the returned list is in use."""
+    from sqlalchemy import event
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,41 @@
+import io
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.models import User, Category
+
+
+def setup_ad(client):
+    db.session.add(User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p')))
+    cat = Category(name='Misc')
+    db.session.add(cat)
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'alice@example.com', 'password': 'p'}).json['data']['accessToken']
+    headers = {'Authorization': 'Bearer ' + token}
+    ad_id = client.post('/api/ads', json={'title': 'Lamp', 'price': 5, 'category_id': cat.id}, headers=headers).json['data']['id']
+    return headers, ad_id
+
+
+def upload(client, headers, ad_id, name, content):
+    r = client.post(f'/api/ads/{ad_id}/media', data={'file': (io.BytesIO(content), name)}, headers=headers, content_type='multipart/form-data')
+    assert r.status_code == 201
+    return r.json['data']
+
+
+def card(client):
+    return client.get('/api/ads').json['data'][0]
+
+
+def test_cover_and_image_count_follow_uploads_and_deletes(client, app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    app.config['UPLOAD_PARTIAL_FOLDER'] = str(tmp_path / 'partial')
+    headers, ad_id = setup_ad(client)
+    assert card(client)['cover_url'] is None and card(client)['image_count'] == 0
+
+    first = upload(client, headers, ad_id, 'a.png', b'first')
+    second = upload(client, headers, ad_id, 'b.png', b'second')
+    assert card(client)['cover_url'] == first['url'] and card(client)['image_count'] == 2
+    # the detail endpoint still returns the whole gallery, cover first
+    assert client.get(f'/api/ads/{ad_id}').json['data']['images'] == [first['url'], second['url']]
+
+    client.delete(f"/api/media/{first['id']}", headers=headers)
+    assert card(client)['cover_url'] == second['url'] and card(client)['image_count'] == 1
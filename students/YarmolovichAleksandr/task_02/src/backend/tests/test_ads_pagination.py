@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from app.extensions import db
+from app.models import User, Category, Ad
+
+
+def make_ads(n, price=None):
+    user = User(username='seller', email='seller@example.com', password_hash='x')
+    cat = Category(name='Misc')
+    db.session.add_all([user, cat])
+    db.session.flush()
+    base = datetime(2025, 1, 1)
+    ads = []
+    for i in range(n):
+        ads.append(Ad(author_id=user.id, category_id=cat.id, title=f'Item {i}', price=price if price is not None else i, created_at=base + timedelta(minutes=i)))
+    db.session.add_all(ads)
+    db.session.commit()
+    return ads
+
+
+def walk(client, url):
+    ids = []
+    r = client.get(url)
+    while True:
+        assert r.status_code == 200
+        ids.extend(a['id'] for a in r.json['data'])
+        cursor = r.json['next_cursor']
+        if not cursor:
+            return ids
+        r = client.get(f'{url}&cursor={cursor}')
+
+
+def test_cursor_walk_newest_is_complete_and_ordered(client, app):
+    ads = make_ads(7)
+    ids = walk(client, '/api/ads?limit=3')
+    assert ids == [a.id for a in reversed(ads)]
+
+
+def test_cursor_walk_price_sorts_break_ties_by_id(client, app):
+    ads = make_ads(5, price=10)
+    asc = walk(client, '/api/ads?limit=2&sort=price_asc')
+    desc = walk(client, '/api/ads?limit=2&sort=price_desc')
+    assert asc == sorted(a.id for a in ads)
+    assert desc == list(reversed(asc))
+
+
+def test_insert_between_pages_does_not_repeat_rows(client, app):
+    ads = make_ads(4)
+    r = client.get('/api/ads?limit=2')
+    first = [a['id'] for a in r.json['data']]
+    newer = Ad(author_id=ads[0].author_id, category_id=ads[0].category_id, title='Newer', price=1, created_at=datetime(2030, 1, 1))
+    db.session.add(newer)
+    db.session.commit()
+    r = client.get('/api/ads?limit=2&cursor=' + r.json['next_cursor'])
+    second = [a['id'] for a in r.json['data']]
+    assert not set(first) & set(second)
+    assert second == [ads[1].id, ads[0].id]
+
+
+def test_limit_is_capped(client, app):
+    app.config['MAX_PAGE_LIMIT'] = 3
+    make_ads(5)
+    r = client.get('/api/ads?limit=1000')
+    assert len(r.json['data']) == 3
+
+
+def test_bad_cursor_and_sort_are_rejected(client, app):
+    assert client.get('/api/ads?cursor=garbage').status_code == 400
+    assert client.get('/api/ads?sort=random').status_code == 400
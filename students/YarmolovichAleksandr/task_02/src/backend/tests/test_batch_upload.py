@@ -0,0 +1,68 @@
+import io
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.models import User, Category, Ad, Media, MediaBlob
+
+
+def setup_user(client, app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    app.config['UPLOAD_PARTIAL_FOLDER'] = str(tmp_path / 'partial')
+    db.session.add(User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p')))
+    cat = Category(name='Misc')
+    db.session.add(cat)
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'alice@example.com', 'password': 'p'}).json['data']['accessToken']
+    return {'Authorization': 'Bearer ' + token}, cat.id
+
+
+def test_ad_is_created_with_all_its_files_in_one_transaction(client, app, tmp_path):
+    headers, category_id = setup_user(client, app, tmp_path)
+    # renditions commit on their own, after the request
+    app.config['IMAGE_WORKERS'] = 0
+    commits = []
+
+    def count(session):
+        commits.append(session)
+
+    event.listen(db.session, 'after_commit', count)
+    try:
+        r = client.post('/api/ads', data={
+            'title': 'Lamp', 'price': '12.50', 'category_id': category_id,
+            'files': [(io.BytesIO(b'front'), 'a.png'), (io.BytesIO(b'back'), 'b.jpg'), (io.BytesIO(b'front'), 'c.png')],
+        }, headers=headers, content_type='multipart/form-data')
+    finally:
+        event.remove(db.session, 'after_commit', count)
+    assert r.status_code == 201
+    assert len(commits) == 1
+    media = r.json['data']['media']
+    assert [m['url'][-4:] for m in media] == ['.png', '.jpg', '.png']
+    # identical files in one request share one stored copy
+    assert media[0]['url'] == media[2]['url']
+    assert {b.refcount for b in MediaBlob.query} == {1, 2}
+
+    ad = client.get(f"/api/ads/{r.json['data']['id']}").json['data']
+    assert ad['price'] == 12.5
+    assert ad['images'] == [m['url'] for m in media]
+    item = client.get('/api/ads').json['data'][0]
+    assert item['cover_url'] == media[0]['url'] and item['image_count'] == 3
+
+
+def test_too_many_files_create_nothing(client, app, tmp_path):
+    headers, category_id = setup_user(client, app, tmp_path)
+    app.config['UPLOAD_MAX_FILES'] = 2
+    r = client.post('/api/ads', data={
+        'title': 'Lamp', 'category_id': category_id,
+        'files': [(io.BytesIO(b'%d' % i), f'{i}.png') for i in range(3)],
+    }, headers=headers, content_type='multipart/form-data')
+    assert r.status_code == 400
+    assert Ad.query.count() == 0 and Media.query.count() == 0
+
+
+def test_several_files_can_be_added_to_an_existing_ad(client, app, tmp_path):
+    headers, category_id = setup_user(client, app, tmp_path)
+    ad_id = client.post('/api/ads', json={'title': 'Lamp', 'category_id': category_id}, headers=headers).json['data']['id']
+    r = client.post(f'/api/ads/{ad_id}/media', data={'files': [(io.BytesIO(b'one'), 'a.png'), (io.BytesIO(b'two'), 'b.png')]},
+                    headers=headers, content_type='multipart/form-data')
+    assert r.status_code == 201
+    assert [m['id'] for m in r.json['data']] == [m['id'] for m in client.get(f'/api/ads/{ad_id}/media').json['data']]
@@ -0,0 +1,119 @@
+import pytest
+from werkzeug.security import generate_password_hash
+from app import facets
+from app.categories import rebuild_closure
+from app.extensions import db
+from app.models import User, Ad, CategoryClosure
+
+# closure queries must not fall back to implicit cartesian products
+pytestmark = pytest.mark.filterwarnings('error::sqlalchemy.exc.SAWarning')
+
+
+def admin_headers(client):
+    db.session.add(User(username='admin', email='admin@example.com', password_hash=generate_password_hash('p'), role='admin'))
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'admin@example.com', 'password': 'p'}).json['data']['accessToken']
+    return {'Authorization': 'Bearer ' + token}
+
+
+def create(client, headers, name, parent_id=None):
+    r = client.post('/api/categories', json={'name': name, 'parent_id': parent_id}, headers=headers)
+    assert r.status_code == 201
+    return r.json['data']['id']
+
+
+def closure():
+    return sorted((r.ancestor_id, r.descendant_id, r.depth) for r in CategoryClosure.query)
+
+
+def add_ad(category_id, title):
+    ad = Ad(author_id=User.query.first().id, category_id=category_id, title=title, price=1, status='active')
+    db.session.add(ad)
+    facets.track(None, facets.facet_key(ad))
+    db.session.commit()
+    return ad.id
+
+
+def titles(client, category_id):
+    return sorted(a['title'] for a in client.get(f'/api/ads?categoryId={category_id}').json['data'])
+
+
+def test_category_filter_includes_subtree(client, app):
+    h = admin_headers(client)
+    electronics = create(client, h, 'Electronics')
+    phones = create(client, h, 'Phones', electronics)
+    smartphones = create(client, h, 'Smartphones', phones)
+    books = create(client, h, 'Books')
+    add_ad(electronics, 'TV')
+    add_ad(smartphones, 'Pixel')
+    add_ad(books, 'Novel')
+    assert titles(client, electronics) == ['Pixel', 'TV']
+    assert titles(client, phones) == ['Pixel']
+    facets = client.get(f'/api/ads/facets?categoryId={electronics}').json['data']
+    assert facets['total'] == 2
+
+
+def test_closure_follows_moves_and_deletes(client, app):
+    h = admin_headers(client)
+    electronics = create(client, h, 'Electronics')
+    phones = create(client, h, 'Phones', electronics)
+    smartphones = create(client, h, 'Smartphones', phones)
+    books = create(client, h, 'Books')
+    add_ad(smartphones, 'Pixel')
+    assert titles(client, electronics) == ['Pixel']
+
+    client.put(f'/api/categories/{phones}', json={'parent_id': books}, headers=h)
+    assert titles(client, electronics) == []
+    assert titles(client, books) == ['Pixel']
+    expected = closure()
+    rebuild_closure()
+    assert closure() == expected
+
+    # deleting a middle node hands its children to the grandparent
+    client.delete(f'/api/categories/{phones}', headers=h)
+    assert client.get(f'/api/categories/{smartphones}').json['data']['parent_id'] == books
+    assert titles(client, books) == ['Pixel']
+    expected = closure()
+    rebuild_closure()
+    assert closure() == expected
+
+
+def test_category_cannot_move_into_its_own_subtree(client, app):
+    h = admin_headers(client)
+    electronics = create(client, h, 'Electronics')
+    phones = create(client, h, 'Phones', electronics)
+    r = client.put(f'/api/categories/{electronics}', json={'parent_id': phones}, headers=h)
+    assert r.status_code == 400
+    r = client.put(f'/api/categories/{electronics}', json={'parent_id': electronics}, headers=h)
+    assert r.status_code == 400
+    r = client.post('/api/categories', json={'name': 'Orphan', 'parent_id': 'missing'}, headers=h)
+    assert r.status_code == 400
+
+
+def test_tree_is_nested_and_revalidates_by_version(client, app):
+    h = admin_headers(client)
+    electronics = create(client, h, 'Electronics')
+    phones = create(client, h, 'Phones', electronics)
+    create(client, h, 'Books')
+    r = client.get('/api/categories/tree')
+    assert [n['name'] for n in r.json['data']] == ['Books', 'Electronics']
+    assert r.json['data'][1]['children'][0]['id'] == phones
+    assert client.get('/api/categories/tree', headers={'If-None-Match': r.headers['ETag']}).status_code == 304
+
+    client.put(f'/api/categories/{phones}', json={'name': 'Mobile phones'}, headers=h)
+    r2 = client.get('/api/categories/tree', headers={'If-None-Match': r.headers['ETag']})
+    assert r2.status_code == 200
+    assert r2.json['version'] == r.json['version'] + 1
+    assert r2.json['data'][1]['children'][0]['name'] == 'Mobile phones'
+
+
+def test_tree_is_built_once_per_version(client, app, query_counter):
+    h = admin_headers(client)
+    create(client, h, 'Books')
+    client.get('/api/categories/tree')
+    del query_counter[:]
+    client.get('/api/categories/tree')
+    # only the version lookup, the tree itself comes from memory
+    assert not any('FROM categories' in q for q in query_counter)
+    create(client, h, 'Toys')
+    assert [n['name'] for n in client.get('/api/categories/tree').json['data']] == ['Books', 'Toys']
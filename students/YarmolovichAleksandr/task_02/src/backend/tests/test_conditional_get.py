@@ -0,0 +1,92 @@
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.models import User, Category, Media
+
+
+def login(client, email, role='user'):
+    db.session.add(User(username=email.split('@')[0], email=email, password_hash=generate_password_hash('p'), role=role))
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': email, 'password': 'p'}).json['data']['accessToken']
+    return {'Authorization': 'Bearer ' + token}
+
+
+def create_ad(client):
+    headers = login(client, 'alice@example.com')
+    cat = Category(name='Misc')
+    db.session.add(cat)
+    db.session.commit()
+    ad_id = client.post('/api/ads', json={'title': 'Lamp', 'price': 5, 'category_id': cat.id}, headers=headers).json['data']['id']
+    return headers, ad_id
+
+
+def revalidate(client, url, etag, **kw):
+    return client.get(url, headers={'If-None-Match': etag}, **kw)
+
+
+def test_ad_detail_and_listing_revalidate_until_the_ad_changes(client, app):
+    headers, ad_id = create_ad(client)
+    for url in (f'/api/ads/{ad_id}', '/api/ads'):
+        r = client.get(url)
+        etag = r.headers['ETag']
+        assert etag.startswith('W/')
+        assert revalidate(client, url, etag).status_code == 304
+    detail_etag = client.get(f'/api/ads/{ad_id}').headers['ETag']
+    list_etag = client.get('/api/ads').headers['ETag']
+    client.put(f'/api/ads/{ad_id}', json={'price': 7}, headers=headers)
+    assert revalidate(client, f'/api/ads/{ad_id}', detail_etag).status_code == 200
+    assert revalidate(client, '/api/ads', list_etag).status_code == 200
+
+
+def test_ad_detail_honours_if_modified_since(client, app):
+    headers, ad_id = create_ad(client)
+    r = client.get(f'/api/ads/{ad_id}')
+    r2 = client.get(f'/api/ads/{ad_id}', headers={'If-Modified-Since': r.headers['Last-Modified']})
+    assert r2.status_code == 304
+
+
+def test_media_list_etag_changes_when_media_is_removed(client, app, query_counter):
+    headers, ad_id = create_ad(client)
+    client.get(f'/api/ads/{ad_id}')
+    m = Media(ad_id=ad_id, url='/uploads/x.png', type='image')
+    db.session.add(m)
+    db.session.commit()
+    etag = client.get(f'/api/ads/{ad_id}/media').headers['ETag']
+    del query_counter[:]
+    assert revalidate(client, f'/api/ads/{ad_id}/media', etag).status_code == 304
+    # the 304 is answered from the ad's updated_at alone
+    assert len(query_counter) == 1
+    client.delete(f'/api/media/{m.id}', headers=headers)
+    r = revalidate(client, f'/api/ads/{ad_id}/media', etag)
+    assert r.status_code == 200 and r.json['data'] == []
+
+
+def test_category_list_etag_follows_admin_writes(client, app):
+    admin = login(client, 'admin@example.com', role='admin')
+    client.post('/api/categories', json={'name': 'Books'}, headers=admin)
+    etag = client.get('/api/categories').headers['ETag']
+    assert revalidate(client, '/api/categories', etag).status_code == 304
+    cat_id = client.post('/api/categories', json={'name': 'Toys'}, headers=admin).json['data']['id']
+    etag2 = revalidate(client, '/api/categories', etag).headers['ETag']
+    assert etag2 != etag
+    client.delete(f'/api/categories/{cat_id}', headers=admin)
+    assert revalidate(client, '/api/categories', etag2).status_code == 200
+
+
+def test_ad_validators_change_when_category_or_author_is_renamed(client, app):
+    headers, ad_id = create_ad(client)
+    admin = login(client, 'admin@example.com', role='admin')
+    url = f'/api/ads/{ad_id}'
+    r = client.get(url)
+    etag, list_etag = r.headers['ETag'], client.get('/api/ads').headers['ETag']
+
+    client.put(f"/api/categories/{r.json['data']['category_id']}", json={'name': 'Lighting'}, headers=admin)
+    r = revalidate(client, url, etag)
+    assert r.status_code == 200 and r.json['data']['category_name'] == 'Lighting'
+    assert client.get(url, headers={'If-Modified-Since': r.headers['Last-Modified']}).status_code == 304
+
+    etag = r.headers['ETag']
+    client.put(f"/api/users/{r.json['data']['author_id']}", json={'username': 'alicia'}, headers=headers)
+    r = revalidate(client, url, etag)
+    assert r.status_code == 200 and r.json['data']['author_username'] == 'alicia'
+    r = revalidate(client, '/api/ads', list_etag)
+    assert r.status_code == 200 and r.json['data'][0]['author_username'] == 'alicia'
@@ -0,0 +1,208 @@
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.models import User, Category, Ad
+
+
+def login(client, email, password='p'):
+    token = client.post('/api/auth/login', json={'email': email, 'password': password}).json['data']['accessToken']
+    return {'Authorization': 'Bearer ' + token}
+
+
+def seed(client):
+    users = [User(username=name, email=f'{name}@example.com', password_hash=generate_password_hash('p')) for name in ('alice', 'bob', 'carol')]
+    cat = Category(name='Misc')
+    db.session.add_all(users + [cat])
+    db.session.flush()
+    alice, bob, carol = users
+    ads = [Ad(author_id=alice.id, category_id=cat.id, title=title, price=5) for title in ('Lamp', 'Desk')]
+    db.session.add_all(ads)
+    db.session.commit()
+    return {u.username: (u, login(client, u.email)) for u in users}, ads
+
+
+def start(client, headers, ad, partner):
+    return client.post('/api/conversations', json={'adId': ad.id, 'partnerId': partner.id}, headers=headers).json['data']['id']
+
+
+def send(client, headers, conv_id, text):
+    assert client.post(f'/api/conversations/{conv_id}/messages', json={'text': text}, headers=headers).status_code == 201
+
+
+def test_inbox_has_last_message_and_unread_count_newest_first(client):
+    users, (lamp, desk) = seed(client)
+    alice, alice_h = users['alice']
+    bob, bob_h = users['bob']
+    carol, carol_h = users['carol']
+    with_bob = start(client, bob_h, lamp, alice)
+    with_carol = start(client, carol_h, desk, alice)
+    send(client, bob_h, with_bob, 'Is the lamp still available?')
+    send(client, carol_h, with_carol, 'Hi')
+    send(client, carol_h, with_carol, 'x' * 300)
+
+    inbox = client.get('/api/conversations', headers=alice_h).json['data']
+    assert [c['id'] for c in inbox] == [with_carol, with_bob]
+    assert inbox[0]['partner_username'] == 'carol' and inbox[0]['ad_title'] == 'Desk'
+    assert inbox[0]['last_message']['text'] == 'x' * 100 and inbox[0]['last_message']['author_id'] == carol.id
+    assert [c['unread_count'] for c in inbox] == [2, 1]
+    # the author has read their own messages
+    assert client.get('/api/conversations', headers=carol_h).json['data'][0]['unread_count'] == 0
+
+    # fetching history changes nothing; marking it read clears the count, a reply moves it to the top
+    client.get(f'/api/conversations/{with_bob}/messages', headers=alice_h)
+    assert client.get('/api/conversations', headers=alice_h).json['data'][1]['unread_count'] == 1
+    client.post(f'/api/conversations/{with_bob}/read', headers=alice_h)
+    send(client, alice_h, with_bob, 'Yes')
+    inbox = client.get('/api/conversations', headers=alice_h).json['data']
+    assert [(c['id'], c['unread_count']) for c in inbox] == [(with_bob, 0), (with_carol, 2)]
+    assert inbox[0]['last_message']['text'] == 'Yes'
+    assert client.get('/api/conversations', headers=bob_h).json['data'][0]['unread_count'] == 1
+
+
+def test_inbox_is_keyset_paginated(client):
+    users, (lamp, desk) = seed(client)
+    alice, alice_h = users['alice']
+    ids = [start(client, users[name][1], ad, alice) for name in ('bob', 'carol') for ad in (lamp, desk)]
+    for conv_id in ids:
+        send(client, alice_h, conv_id, 'Hello')
+
+    seen, cursor = [], None
+    while True:
+        r = client.get('/api/conversations?limit=3' + (f'&cursor={cursor}' if cursor else ''), headers=alice_h).json
+        seen += [c['id'] for c in r['data']]
+        cursor = r['next_cursor']
+        if not cursor:
+            break
+    assert seen == ids[::-1]
+    assert client.get('/api/conversations?cursor=bogus', headers=alice_h).status_code == 400
+
+
+def test_history_pages_backwards_and_polls_forwards(client):
+    users, (lamp, _) = seed(client)
+    alice, alice_h = users['alice']
+    bob, bob_h = users['bob']
+    conv_id = start(client, bob_h, lamp, alice)
+    for i in range(7):
+        send(client, bob_h if i % 2 else alice_h, conv_id, f'm{i}')
+    url = f'/api/conversations/{conv_id}/messages?limit=3'
+
+    page = client.get(url, headers=alice_h).json
+    assert [m['text'] for m in page['data']] == ['m4', 'm5', 'm6']
+    assert {m['author_username'] for m in page['data']} == {'alice', 'bob'}
+    texts, cursor = [], page['before_cursor']
+    while cursor:
+        older = client.get(f'{url}&before={cursor}', headers=alice_h).json
+        texts = [m['text'] for m in older['data']] + texts
+        cursor = older['before_cursor']
+    assert texts == ['m0', 'm1', 'm2', 'm3']
+
+    after = page['after_cursor']
+    assert client.get(f'{url}&after={after}', headers=alice_h).json['data'] == []
+    send(client, bob_h, conv_id, 'm7')
+    newer = client.get(f'{url}&after={after}', headers=alice_h).json
+    assert [m['text'] for m in newer['data']] == ['m7'] and newer['after_cursor'] != after
+    assert client.get(f'{url}&before=bogus', headers=alice_h).status_code == 400
+
+
+def unread_total(client, headers):
+    return client.get('/api/conversations/unread', headers=headers).json['data']['unread']
+
+
+def test_unread_counters_follow_posts_and_read_markers(client):
+    users, (lamp, desk) = seed(client)
+    alice, alice_h = users['alice']
+    bob, bob_h = users['bob']
+    carol, carol_h = users['carol']
+    with_bob = start(client, bob_h, lamp, alice)
+    with_carol = start(client, carol_h, desk, alice)
+    for text in ('one', 'two', 'three'):
+        send(client, bob_h, with_bob, text)
+    send(client, carol_h, with_carol, 'hi')
+    assert unread_total(client, alice_h) == 4 and unread_total(client, bob_h) == 0
+
+    first = client.get(f'/api/conversations/{with_bob}/messages?limit=1&before=' +
+                       client.get(f'/api/conversations/{with_bob}/messages?limit=2', headers=bob_h).json['before_cursor'], headers=bob_h).json['data'][0]
+    r = client.post(f'/api/conversations/{with_bob}/read', json={'message_id': first['id']}, headers=alice_h).json['data']
+    assert (r['unread'], r['total_unread']) == (2, 3)
+    # the marker never moves back
+    client.post(f'/api/conversations/{with_bob}/read', json={'message_id': first['id']}, headers=alice_h)
+    assert unread_total(client, alice_h) == 3
+
+    r = client.post(f'/api/conversations/{with_carol}/read', headers=alice_h).json['data']
+    assert (r['unread'], r['total_unread']) == (0, 2)
+    assert [c['unread_count'] for c in client.get('/api/conversations', headers=alice_h).json['data']] == [0, 2]
+
+    # replying reads the conversation
+    send(client, alice_h, with_bob, 'sure')
+    assert unread_total(client, alice_h) == 0 and unread_total(client, bob_h) == 1
+
+
+def test_read_receipts(client):
+    users, (lamp, _) = seed(client)
+    alice, alice_h = users['alice']
+    bob, bob_h = users['bob']
+    conv_id = start(client, bob_h, lamp, alice)
+    send(client, bob_h, conv_id, 'Hi')
+    assert client.get(f'/api/conversations/{conv_id}/messages', headers=bob_h).json['partner_read_at'] is None
+    read_at = client.post(f'/api/conversations/{conv_id}/read', headers=alice_h).json['data']['read_at']
+    assert client.get(f'/api/conversations/{conv_id}/messages', headers=bob_h).json['partner_read_at'] == read_at
+    assert client.post(f'/api/conversations/{conv_id}/read', json={'message_id': 'nope'}, headers=alice_h).status_code == 404
+
+
+def test_both_sides_open_the_same_conversation(client):
+    from app.conversations import open_conversation
+    from app.models import Conversation
+    users, (lamp, desk) = seed(client)
+    alice, alice_h = users['alice']
+    bob, bob_h = users['bob']
+    r = client.post('/api/conversations', json={'adId': lamp.id, 'partnerId': alice.id}, headers=bob_h)
+    assert r.status_code == 201
+    again = client.post('/api/conversations', json={'adId': lamp.id, 'partnerId': bob.id}, headers=alice_h)
+    assert again.status_code == 200 and again.json['data']['id'] == r.json['data']['id']
+    assert client.post('/api/conversations', json={'adId': desk.id, 'partnerId': alice.id}, headers=bob_h).status_code == 201
+
+    # a request that lost the race to insert gets the winner's row instead of a duplicate
+    conv, created = open_conversation(lamp.id, alice.id, bob.id)
+    assert not created and conv.id == r.json['data']['id']
+    assert (conv.user1_id, conv.user2_id) == tuple(sorted((alice.id, bob.id)))
+    assert Conversation.query.count() == 2
+
+
+def test_message_search_is_limited_to_my_conversations(client):
+    users, (lamp, desk) = seed(client)
+    alice, alice_h = users['alice']
+    bob, bob_h = users['bob']
+    carol, carol_h = users['carol']
+    with_bob = start(client, bob_h, lamp, alice)
+    with_carol = start(client, carol_h, desk, alice)
+    send(client, bob_h, with_bob, 'Можно забрать лампу завтра вечером?')
+    send(client, alice_h, with_bob, 'Tomorrow works <b>fine</b>')
+    send(client, carol_h, with_carol, 'Is the desk still for sale? I could pick it up tomorrow')
+    url = '/api/conversations/search?query='
+
+    found = client.get(url + 'tomorrow', headers=alice_h).json['data']
+    assert {(m['conversation_id'], m['partner_username']) for m in found} == {(with_bob, 'bob'), (with_carol, 'carol')}
+    assert [m['conversation_id'] for m in client.get(url + 'tomorrow', headers=bob_h).json['data']] == [with_bob]
+    assert client.get(url + 'desk', headers=bob_h).json['data'] == []
+
+    hit = client.get(url + 'лампы', headers=bob_h).json['data'][0]
+    assert hit['snippet'] == 'Можно забрать <mark>лампу</mark> завтра вечером?' and hit['ad_title'] == 'Lamp'
+    assert client.get(url + 'fine', headers=bob_h).json['data'][0]['snippet'] == 'Tomorrow works &lt;b&gt;<mark>fine</mark>&lt;/b&gt;'
+    assert client.get(url, headers=bob_h).status_code == 400
+
+
+def test_message_search_is_keyset_paginated(client):
+    users, (lamp, _) = seed(client)
+    alice, alice_h = users['alice']
+    bob, bob_h = users['bob']
+    conv_id = start(client, bob_h, lamp, alice)
+    for i in range(5):
+        send(client, bob_h, conv_id, f'lamp question {i}')
+    seen, cursor = [], None
+    while True:
+        r = client.get('/api/conversations/search?query=lamp&limit=2' + (f'&cursor={cursor}' if cursor else ''), headers=alice_h).json
+        seen += [m['id'] for m in r['data']]
+        cursor = r['next_cursor']
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) == 5
+    assert client.get('/api/conversations/search?query=lamp&cursor=bogus', headers=alice_h).status_code == 400
@@ -0,0 +1,70 @@
+from werkzeug.security import generate_password_hash
+from app import facets
+from app.categories import rebuild_closure
+from app.extensions import db
+from app.models import User, Category, AdFacetCount
+
+
+def setup(client):
+    db.session.add(User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p')))
+    books, toys = Category(name='Books'), Category(name='Toys')
+    db.session.add_all([books, toys])
+    db.session.commit()
+    rebuild_closure()
+    token = client.post('/api/auth/login', json={'email': 'alice@example.com', 'password': 'p'}).json['data']['accessToken']
+    headers = {'Authorization': 'Bearer ' + token}
+    ids = {}
+    for title, price, cat in [('Novel', 5, books), ('Atlas', 60, books), ('Robot toy', 60, toys), ('Ball', 700, toys)]:
+        ids[title] = client.post('/api/ads', json={'title': title, 'price': price, 'category_id': cat.id}, headers=headers).json['data']['id']
+    return headers, books, toys, ids
+
+
+def bucket_counts(data):
+    return {b['from']: b['count'] for b in data['price_buckets'] if b['count']}
+
+
+def category_counts(data):
+    return {c['category_id']: c['count'] for c in data['categories']}
+
+
+def test_facets_count_categories_and_price_buckets(client, app):
+    headers, books, toys, ids = setup(client)
+    data = client.get('/api/ads/facets').json['data']
+    assert data['total'] == 4
+    assert category_counts(data) == {books.id: 2, toys.id: 2}
+    assert bucket_counts(data) == {0: 1, 50: 2, 500: 1}
+
+    data = client.get(f'/api/ads/facets?categoryId={toys.id}').json['data']
+    assert bucket_counts(data) == {50: 1, 500: 1}
+
+
+def test_facets_follow_status_and_price_changes(client, app):
+    headers, books, toys, ids = setup(client)
+    client.get('/api/ads/facets')
+    client.put(f"/api/ads/{ids['Ball']}", json={'status': 'closed'}, headers=headers)
+    client.put(f"/api/ads/{ids['Novel']}", json={'price': 20}, headers=headers)
+    client.delete(f"/api/ads/{ids['Atlas']}", headers=headers)
+    data = client.get('/api/ads/facets').json['data']
+    assert data['total'] == 2
+    assert category_counts(data) == {books.id: 1, toys.id: 1}
+    assert bucket_counts(data) == {10: 1, 50: 1}
+    # the incremental counters agree with a full recount
+    before = sorted((r.status, r.category_id, r.price_bucket, r.count) for r in AdFacetCount.query.filter(AdFacetCount.count > 0))
+    facets.rebuild()
+    after = sorted((r.status, r.category_id, r.price_bucket, r.count) for r in AdFacetCount.query)
+    assert before == after
+
+
+def test_facets_with_price_range_and_search(client, app):
+    headers, books, toys, ids = setup(client)
+    data = client.get('/api/ads/facets?price_from=10&price_to=100').json['data']
+    assert data['total'] == 2
+    data = client.get('/api/ads/facets?query=robot').json['data']
+    assert category_counts(data) == {toys.id: 1}
+
+
+def test_common_facet_request_does_not_touch_ads_table(client, app, query_counter):
+    setup(client)
+    del query_counter[:]
+    client.get('/api/ads/facets')
+    assert query_counter and not any(' ads' in q.replace('ad_facet_counts', '') for q in query_counter)
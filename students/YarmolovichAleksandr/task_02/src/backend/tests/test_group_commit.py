@@ -0,0 +1,79 @@
+import threading
+import pytest
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.group_commit import GroupCommitter
+from app.models import User, Category, Ad
+
+
+def add_category(name):
+    if name == 'bad':
+        raise ValueError(name)
+    c = Category(name=name)
+    db.session.add(c)
+    db.session.flush()
+    return c.id
+
+
+def test_concurrent_writes_share_one_transaction_and_fail_alone(app):
+    # the test database is one shared connection: leave it idle, as a real pool would
+    db.session.commit()
+    committer = GroupCommitter(app, window=0.5, max_batch=10)
+    # driver-level state at every savepoint: a RELEASE outside a transaction commits by itself
+    in_transaction = []
+
+    def watch(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(('SAVEPOINT', 'RELEASE', 'ROLLBACK TO')):
+            in_transaction.append(conn.connection.dbapi_connection.in_transaction)
+
+    names = ['a', 'b', 'bad', 'c', 'd']
+    results = {}
+
+    def submit(name):
+        try:
+            results[name] = committer.submit(add_category, name, timeout=5)
+        except ValueError as e:
+            results[name] = e
+
+    event.listen(db.engine, 'before_cursor_execute', watch)
+    try:
+        threads = [threading.Thread(target=submit, args=(n,)) for n in names]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', watch)
+
+    # the failing write never got as far as its savepoint
+    assert in_transaction == [True] * 2 * (len(names) - 1)
+    assert isinstance(results.pop('bad'), ValueError)
+    assert {db.session.get(Category, id).name for id in results.values()} == {'a', 'b', 'c', 'd'}
+
+
+def test_messages_are_acknowledged_one_by_one_in_group_commit_mode(app, client):
+    app.config['MESSAGE_GROUP_COMMIT'] = True
+    alice = User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p'))
+    bob = User(username='bob', email='bob@example.com', password_hash=generate_password_hash('p'))
+    cat = Category(name='Misc')
+    db.session.add_all([alice, bob, cat])
+    db.session.flush()
+    ad = Ad(author_id=alice.id, category_id=cat.id, title='Lamp', price=5)
+    db.session.add(ad)
+    db.session.commit()
+    alice_id, ad_id = alice.id, ad.id
+    token = client.post('/api/auth/login', json={'email': 'bob@example.com', 'password': 'p'}).json['data']['accessToken']
+    headers = {'Authorization': 'Bearer ' + token}
+    conv_id = client.post('/api/conversations', json={'adId': ad_id, 'partnerId': alice_id}, headers=headers).json['data']['id']
+
+    acks = []
+    for text in ('one', 'two'):
+        r = client.post(f'/api/conversations/{conv_id}/messages', json={'text': text}, headers=headers)
+        assert r.status_code == 201
+        acks.append(r.json['data'])
+    assert [a['text'] for a in acks] == ['one', 'two'] and all(a['id'] and a['created_at'] for a in acks)
+
+    page = client.get(f'/api/conversations/{conv_id}/messages', headers=headers).json['data']
+    assert [m['id'] for m in page] == [a['id'] for a in acks]
+    assert db.session.get(User, alice_id).unread_messages == 2
@@ -0,0 +1,58 @@
+import io
+import os
+import pytest
+from werkzeug.security import generate_password_hash
+from app import images
+from app.extensions import db
+from app.media import add_media
+from app.storage import get_storage
+from app.models import User, Category, Ad
+
+
+def stored_path(url):
+    storage = get_storage()
+    return storage.path(storage.key_for(url))
+
+
+def setup_ad(client):
+    db.session.add(User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p')))
+    cat = Category(name='Misc')
+    db.session.add(cat)
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'alice@example.com', 'password': 'p'}).json['data']['accessToken']
+    headers = {'Authorization': 'Bearer ' + token}
+    ad_id = client.post('/api/ads', json={'title': 'Lamp', 'price': 5, 'category_id': cat.id}, headers=headers).json['data']['id']
+    return headers, ad_id
+
+
+def test_sizes_fall_back_to_the_original_until_rendered(client, app):
+    headers, ad_id = setup_ad(client)
+    add_media(db.session.get(Ad, ad_id), '/uploads/x.png')
+    db.session.commit()
+    item = client.get(f'/api/ads/{ad_id}/media').json['data'][0]
+    assert item['thumb'] == item['card'] == item['full'] == '/uploads/x.png'
+
+
+def test_upload_renders_webp_variants_off_the_request(client, app, tmp_path):
+    PIL = pytest.importorskip('PIL.Image')
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    app.config['UPLOAD_PARTIAL_FOLDER'] = str(tmp_path / 'partial')
+    headers, ad_id = setup_ad(client)
+    buf = io.BytesIO()
+    PIL.new('RGB', (2000, 1000), 'red').save(buf, 'PNG')
+    buf.seek(0)
+    r = client.post(f'/api/ads/{ad_id}/media', data={'file': (buf, 'big.png')}, headers=headers, content_type='multipart/form-data')
+    assert r.status_code == 201
+    images.wait_pending()
+    db.session.expire_all()
+
+    item = client.get(f'/api/ads/{ad_id}/media').json['data'][0]
+    assert item['thumb'].endswith('.thumb.webp') and item['full'].endswith('.full.webp')
+    with PIL.open(stored_path(item['thumb'])) as thumb:
+        assert thumb.format == 'WEBP' and max(thumb.size) == images.VARIANTS['thumb']
+    assert client.get('/api/ads').json['data'][0]['cover_url'] == item['card']
+    assert client.get(f'/api/ads/{ad_id}').json['data']['images'] == [item['full']]
+
+    client.delete(f"/api/media/{item['id']}", headers=headers)
+    assert [f for _, _, files in os.walk(tmp_path / 'uploads') for f in files] == []
+    assert client.get('/api/ads').json['data'][0]['cover_url'] is None
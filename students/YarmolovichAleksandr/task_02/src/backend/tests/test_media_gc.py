@@ -0,0 +1,156 @@
+import io
+import os
+import time
+from datetime import datetime, timedelta
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.storage import get_storage
+from app.media_gc import sweep, reconcile_blobs
+from app.models import User, Category, Media, MediaBlob, Report, Conversation, UploadSession
+
+
+def stored_path(url):
+    storage = get_storage()
+    return storage.path(storage.key_for(url))
+
+
+def setup_ads(client, app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    app.config['UPLOAD_PARTIAL_FOLDER'] = str(tmp_path / 'partial')
+    alice = User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p'))
+    bob = User(username='bob', email='bob@example.com', password_hash=generate_password_hash('p'))
+    cat = Category(name='Misc')
+    db.session.add_all([alice, bob, cat])
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'alice@example.com', 'password': 'p'}).json['data']['accessToken']
+    headers = {'Authorization': 'Bearer ' + token}
+    ads = [client.post('/api/ads', json={'title': t, 'category_id': cat.id}, headers=headers).json['data']['id'] for t in ('Lamp', 'Desk')]
+    return headers, ads, bob
+
+
+def upload(client, headers, ad_id, name, content):
+    r = client.post(f'/api/ads/{ad_id}/media', data={'file': (io.BytesIO(content), name)}, headers=headers, content_type='multipart/form-data')
+    assert r.status_code == 201
+    return r.json['data']
+
+
+def age(path, seconds=7200):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def age_blobs(seconds=7200):
+    for blob in MediaBlob.query:
+        blob.created_at = datetime.utcnow() - timedelta(seconds=seconds)
+    db.session.commit()
+
+
+def test_deleting_an_ad_cascades_to_its_media_and_uploads(client, app, tmp_path):
+    headers, (lamp, desk), bob = setup_ads(client, app, tmp_path)
+    own = upload(client, headers, lamp, 'a.png', b'lamp only')
+    shared = upload(client, headers, lamp, 'b.png', b'shared')
+    kept = upload(client, headers, desk, 'c.png', b'shared')
+    s = client.post('/api/uploads', json={'ad_id': lamp, 'filename': 'd.png', 'size': 10}, headers=headers).json['data']
+    db.session.add_all([Report(ad_id=lamp, reporter_id=bob.id, reason='spam'), Conversation(ad_id=lamp, user1_id=bob.id, user2_id=bob.id)])
+    db.session.commit()
+
+    r = client.delete(f'/api/ads/{lamp}', headers=headers)
+    assert r.status_code == 200
+    assert Media.query.filter_by(ad_id=lamp).count() == 0
+    assert not os.path.exists(stored_path(own['url']))
+    # content another ad still uses stays
+    assert os.path.exists(stored_path(kept['url'])) and shared['url'] == kept['url']
+    assert MediaBlob.query.one().refcount == 1
+    assert db.session.get(UploadSession, s['id']) is None
+    assert not os.path.exists(tmp_path / 'partial' / s['id'])
+    assert Report.query.one().ad_id is None
+    assert Conversation.query.one().ad_id is None
+
+
+def test_sweep_deletes_orphans_and_reports_reclaimed_bytes(client, app, tmp_path):
+    headers, (lamp, _), _ = setup_ads(client, app, tmp_path)
+    kept = upload(client, headers, lamp, 'a.png', b'in use')
+    gone = upload(client, headers, lamp, 'b.png', b'orphaned')
+    # rows removed behind the API's back leave their file and a stale blob
+    db.session.delete(db.session.get(Media, gone['id']))
+    db.session.commit()
+    # blobs younger than min_age may belong to an upload in flight
+    assert sweep(rate=0, dry_run=True)['blobs_fixed'] == 0
+    age_blobs()
+    stray = tmp_path / 'uploads' / 'stray.bin'
+    stray.write_bytes(b'12345')
+    for path in (stored_path(kept['url']), stored_path(gone['url']), stray):
+        age(path)
+
+    report = sweep(rate=0)
+    assert report['blobs_fixed'] == 1
+    assert report['scanned'] == 3
+    assert report['deleted'] == 2
+    assert report['bytes'] == len(b'orphaned') + 5
+    assert os.path.exists(stored_path(kept['url']))
+    assert not os.path.exists(stored_path(gone['url'])) and not stray.exists()
+    assert MediaBlob.query.count() == 1
+
+
+def test_sweep_keeps_recent_files_and_dry_run_deletes_nothing(client, app, tmp_path):
+    setup_ads(client, app, tmp_path)
+    os.makedirs(tmp_path / 'uploads', exist_ok=True)
+    (tmp_path / 'uploads' / 'new.bin').write_bytes(b'fresh')
+    old = tmp_path / 'uploads' / 'old.bin'
+    old.write_bytes(b'stale')
+    age(old)
+
+    report = sweep(rate=0, dry_run=True)
+    assert (report['deleted'], report['bytes']) == (1, 5)
+    assert old.exists()
+
+    report = sweep(rate=0)
+    assert report['deleted'] == 1
+    assert not old.exists() and (tmp_path / 'uploads' / 'new.bin').exists()
+
+
+def test_reconcile_recounts_only_blobs_it_read_unchanged(client, app, tmp_path):
+    headers, (lamp, desk), _ = setup_ads(client, app, tmp_path)
+    upload(client, headers, lamp, 'a.png', b'shared')
+    upload(client, headers, desk, 'b.png', b'shared')
+    age_blobs()
+    blob = MediaBlob.query.one()
+    blob.refcount = 5
+    db.session.commit()
+    assert reconcile_blobs(min_age=3600) == 1
+    assert MediaBlob.query.one().refcount == 2
+
+    # a reference taken after the read wins over the repair
+    db.session.execute(db.update(MediaBlob).values(refcount=7))
+    db.session.commit()
+    seen = {'n': 0}
+
+    def bump(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE media_blobs') and not seen['n']:
+            seen['n'] += 1
+            conn.exec_driver_sql('UPDATE media_blobs SET refcount = refcount + 1')
+
+    from sqlalchemy import event
+    event.listen(db.engine, 'before_cursor_execute', bump)
+    try:
+        assert reconcile_blobs(min_age=3600) == 0
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', bump)
+    db.session.expire_all()
+    assert MediaBlob.query.one().refcount == 8
+
+
+def test_sweep_keeps_files_of_media_stored_under_old_names(client, app, tmp_path):
+    from app.models import Ad
+    setup_ads(client, app, tmp_path)
+    folder = tmp_path / 'uploads'
+    folder.mkdir(exist_ok=True)
+    for name in ('old_a.png', 'old_a.card.webp', 'old_b.card.webp'):
+        (folder / name).write_bytes(b'x')
+        age(folder / name)
+    ad = Ad.query.first()
+    db.session.add(Media(ad_id=ad.id, url='/uploads/old_a.png', type='image', variants={'card': '/uploads/old_a.card.webp'}))
+    db.session.commit()
+
+    assert sweep(rate=0)['deleted'] == 1
+    assert sorted(p.name for p in folder.iterdir()) == ['old_a.card.webp', 'old_a.png']
@@ -0,0 +1,83 @@
+import io
+import os
+import hashlib
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.storage import get_storage
+from app.models import User, Category, MediaBlob
+
+
+def stored_path(url):
+    storage = get_storage()
+    return storage.path(storage.key_for(url))
+
+
+def setup_ads(client, app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    app.config['UPLOAD_PARTIAL_FOLDER'] = str(tmp_path / 'partial')
+    db.session.add(User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p')))
+    cat = Category(name='Misc')
+    db.session.add(cat)
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'alice@example.com', 'password': 'p'}).json['data']['accessToken']
+    headers = {'Authorization': 'Bearer ' + token}
+    ads = [client.post('/api/ads', json={'title': t, 'category_id': cat.id}, headers=headers).json['data']['id'] for t in ('Lamp', 'Desk')]
+    return headers, ads
+
+
+def upload(client, headers, ad_id, name, content):
+    r = client.post(f'/api/ads/{ad_id}/media', data={'file': (io.BytesIO(content), name)}, headers=headers, content_type='multipart/form-data')
+    assert r.status_code == 201
+    return r.json['data']
+
+
+def stored_files(tmp_path):
+    return sorted(os.path.relpath(os.path.join(d, f), tmp_path / 'uploads') for d, _, files in os.walk(tmp_path / 'uploads') for f in files)
+
+
+def test_files_are_named_by_content_hash_and_sharded(client, app, tmp_path):
+    headers, (lamp, _) = setup_ads(client, app, tmp_path)
+    m = upload(client, headers, lamp, '../../etc/Evil Name.PNG', b'pixels')
+    digest = hashlib.sha256(b'pixels').hexdigest()
+    assert m['url'] == f'/uploads/{digest[:2]}/{digest[2:4]}/{digest}.png'
+    assert stored_files(tmp_path) == [os.path.join(digest[:2], digest[2:4], digest + '.png')]
+
+
+def test_duplicates_share_one_file_until_the_last_reference_goes(client, app, tmp_path):
+    headers, (lamp, desk) = setup_ads(client, app, tmp_path)
+    a = upload(client, headers, lamp, 'a.png', b'same')
+    b = upload(client, headers, desk, 'b.jpg', b'same')
+    assert a['url'] == b['url']
+    assert len(stored_files(tmp_path)) == 1
+    assert MediaBlob.query.one().refcount == 2
+
+    client.delete(f"/api/media/{a['id']}", headers=headers)
+    assert os.path.exists(stored_path(b['url']))
+    assert client.get(f'/api/ads/{desk}').json['data']['images'] == [b['url']]
+
+    client.delete(f"/api/media/{b['id']}", headers=headers)
+    assert stored_files(tmp_path) == []
+    assert MediaBlob.query.count() == 0
+
+
+def test_upload_keeps_its_copy_while_the_last_release_is_deleting_the_file(client, app, tmp_path, monkeypatch):
+    headers, (lamp, desk) = setup_ads(client, app, tmp_path)
+    a = upload(client, headers, lamp, 'a.png', b'same')
+    path = stored_path(a['url'])
+    # the last reference was released and committed; its file is not deleted yet
+    db.session.execute(db.text('DELETE FROM media'))
+    db.session.execute(db.text('DELETE FROM media_blobs'))
+    db.session.commit()
+    storage = get_storage()
+    exists = type(storage).exists
+
+    def deleted_meanwhile(self, key):
+        # the release's delete_files lands right after the check
+        found = exists(self, key)
+        self.delete(key)
+        return found
+
+    monkeypatch.setattr(type(storage), 'exists', deleted_meanwhile)
+    b = upload(client, headers, desk, 'b.png', b'same')
+    assert b['url'] == a['url'] and os.path.exists(path)
+    assert MediaBlob.query.one().refcount == 1
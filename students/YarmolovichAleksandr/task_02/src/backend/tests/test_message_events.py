@@ -0,0 +1,99 @@
+import json
+import pytest
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.broker import LocalBroker, RedisBroker
+from app.models import User, Category, Ad
+
+try:
+    import fakeredis
+except ImportError:  # pragma: no cover - optional dependency
+    fakeredis = None
+
+
+@pytest.fixture(params=['local', 'redis'])
+def broker(request, app):
+    if request.param == 'redis':
+        if fakeredis is None:
+            pytest.skip('fakeredis not installed')
+        broker = RedisBroker(client=fakeredis.FakeRedis())
+    else:
+        broker = LocalBroker()
+    app.extensions['broker'] = broker
+    app.config['SSE_HEARTBEAT'] = 0.05
+    return broker
+
+
+def login(client, email, password='p'):
+    token = client.post('/api/auth/login', json={'email': email, 'password': password}).json['data']['accessToken']
+    return {'Authorization': 'Bearer ' + token}
+
+
+def seed(client):
+    alice = User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p'))
+    bob = User(username='bob', email='bob@example.com', password_hash=generate_password_hash('p'))
+    cat = Category(name='Misc')
+    db.session.add_all([alice, bob, cat])
+    db.session.flush()
+    ad = Ad(author_id=alice.id, category_id=cat.id, title='Lamp', price=5)
+    db.session.add(ad)
+    db.session.commit()
+    alice_h, bob_h = login(client, 'alice@example.com'), login(client, 'bob@example.com')
+    conv_id = client.post('/api/conversations', json={'adId': ad.id, 'partnerId': alice.id}, headers=bob_h).json['data']['id']
+    return alice_h, bob_h, conv_id
+
+
+def send(client, headers, conv_id, text):
+    return client.post(f'/api/conversations/{conv_id}/messages', json={'text': text}, headers=headers).json['data']['id']
+
+
+def next_event(chunks):
+    """(event, id, data) of the next event on the stream, skipping keep-alives."""
+    for chunk in chunks:
+        fields = dict(line.split(': ', 1) for line in chunk.decode().strip().split('\n') if not line.startswith(':'))
+        if 'event' in fields:
+            return fields['event'], fields.get('id'), json.loads(fields['data'])
+    raise AssertionError('stream ended')
+
+
+def test_posted_messages_are_pushed_to_the_stream(client, broker):
+    alice_h, bob_h, conv_id = seed(client)
+    r = client.get(f'/api/conversations/{conv_id}/events', headers=alice_h, buffered=False)
+    assert r.status_code == 200 and r.mimetype == 'text/event-stream'
+    chunks = r.iter_encoded()
+    msg_id = send(client, bob_h, conv_id, 'Hi')
+    event, id, data = next_event(chunks)
+    assert (event, id) == ('message', msg_id)
+    assert data['text'] == 'Hi' and data['author_username'] == 'bob'
+    r.close()
+
+
+def test_reconnecting_stream_replays_missed_messages(client, broker):
+    alice_h, bob_h, conv_id = seed(client)
+    seen = send(client, bob_h, conv_id, 'one')
+    send(client, bob_h, conv_id, 'two')
+    send(client, alice_h, conv_id, 'three')
+    r = client.get(f'/api/conversations/{conv_id}/events', headers={**alice_h, 'Last-Event-ID': seen}, buffered=False)
+    chunks = r.iter_encoded()
+    assert [next_event(chunks)[2]['text'] for _ in range(2)] == ['two', 'three']
+    send(client, bob_h, conv_id, 'four')
+    assert next_event(chunks)[2]['text'] == 'four'
+    r.close()
+
+
+def test_only_participants_can_listen(client, broker):
+    alice_h, bob_h, conv_id = seed(client)
+    db.session.add(User(username='eve', email='eve@example.com', password_hash=generate_password_hash('p')))
+    db.session.commit()
+    assert client.get(f'/api/conversations/{conv_id}/events', headers=login(client, 'eve@example.com')).status_code == 403
+
+
+def test_read_receipts_are_pushed_to_the_stream(client, broker):
+    alice_h, bob_h, conv_id = seed(client)
+    send(client, bob_h, conv_id, 'Hi')
+    r = client.get(f'/api/conversations/{conv_id}/events', headers=bob_h, buffered=False)
+    chunks = r.iter_encoded()
+    read_at = client.post(f'/api/conversations/{conv_id}/read', headers=alice_h).json['data']['read_at']
+    event, _, data = next_event(chunks)
+    assert event == 'read' and data['read_at'] == read_at
+    r.close()
@@ -0,0 +1,109 @@
+from app.extensions import db
+from app.media import add_media
+from app.models import User, Category, Ad
+
+
+def seed_ads(n):
+    cat = Category(name='Misc')
+    db.session.add(cat)
+    db.session.flush()
+    for i in range(n):
+        user = User(username=f'user{i}', email=f'user{i}@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+        ad = Ad(author_id=user.id, category_id=cat.id, title=f'Item {i}', price=i)
+        db.session.add(ad)
+        db.session.flush()
+        add_media(ad, f'/uploads/{i}_a.png')
+        add_media(ad, f'/uploads/{i}_b.png')
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def listing_queries(client, query_counter, limit):
+    del query_counter[:]
+    r = client.get(f'/api/ads?limit={limit}')
+    assert r.status_code == 200
+    assert len(r.json['data']) == limit
+    assert all(a['author_username'] and a['image_count'] == 2 and a['cover_url'].endswith('_a.png') for a in r.json['data'])
+    return len(query_counter)
+
+
+def test_ads_listing_query_count_does_not_grow_with_page_size(client, query_counter):
+    seed_ads(12)
+    small = listing_queries(client, query_counter, 2)
+    large = listing_queries(client, query_counter, 12)
+    assert small == large
+
+
+def test_ads_listing_is_a_single_query_without_media(client, query_counter):
+    seed_ads(3)
+    listing_queries(client, query_counter, 3)
+    assert len(query_counter) == 1 and 'media' not in query_counter[0]
+
+
+def seed_conversations(n):
+    from werkzeug.security import generate_password_hash
+    from app.models import Conversation, Message
+    seed_ads(n)
+    me = User(username='me', email='me@example.com', password_hash=generate_password_hash('p'))
+    db.session.add(me)
+    db.session.flush()
+    for ad in Ad.query.all():
+        conv = Conversation(ad_id=ad.id, user1_id=me.id, user2_id=ad.author_id)
+        db.session.add(conv)
+        db.session.flush()
+        msg = Message(conversation_id=conv.id, author_id=ad.author_id, text='Hello')
+        db.session.add(msg)
+        db.session.flush()
+        conv.last_message_id, conv.last_activity_at, conv.user1_unread = msg.id, msg.created_at, 1
+    db.session.commit()
+
+
+def inbox_queries(client, query_counter, limit):
+    token = client.post('/api/auth/login', json={'email': 'me@example.com', 'password': 'p'}).json['data']['accessToken']
+    del query_counter[:]
+    r = client.get(f'/api/conversations?limit={limit}', headers={'Authorization': 'Bearer ' + token})
+    assert len(r.json['data']) == limit
+    assert all(c['partner_username'] and c['ad_title'] and c['last_message']['text'] == 'Hello' and c['unread_count'] == 1 for c in r.json['data'])
+    return len(query_counter)
+
+
+def test_inbox_is_a_single_query_whatever_its_size(client, query_counter):
+    seed_conversations(8)
+    assert inbox_queries(client, query_counter, 2) == inbox_queries(client, query_counter, 8) == 1
+
+
+def test_message_history_query_count_does_not_grow_with_page_size(client, query_counter):
+    from werkzeug.security import generate_password_hash
+    from app.models import Conversation, Message
+    seed_ads(1)
+    ad = Ad.query.one()
+    me = User(username='me', email='me@example.com', password_hash=generate_password_hash('p'))
+    db.session.add(me)
+    db.session.flush()
+    conv = Conversation(ad_id=ad.id, user1_id=me.id, user2_id=ad.author_id)
+    db.session.add(conv)
+    db.session.flush()
+    db.session.add_all([Message(conversation_id=conv.id, author_id=(me.id, ad.author_id)[i % 2], text=str(i)) for i in range(10)])
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'me@example.com', 'password': 'p'}).json['data']['accessToken']
+    counts = []
+    for limit in (2, 10):
+        # a real request starts with an empty session
+        db.session.expire_all()
+        del query_counter[:]
+        r = client.get(f'/api/conversations/{conv.id}/messages?limit={limit}', headers={'Authorization': 'Bearer ' + token})
+        assert len(r.json['data']) == limit and all(m['author_username'] for m in r.json['data'])
+        counts.append(len(query_counter))
+    assert counts[0] == counts[1]
+
+
+def test_unread_badge_is_one_query(client, query_counter):
+    from werkzeug.security import generate_password_hash
+    db.session.add(User(username='me', email='me@example.com', password_hash=generate_password_hash('p'), unread_messages=3))
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'me@example.com', 'password': 'p'}).json['data']['accessToken']
+    del query_counter[:]
+    r = client.get('/api/conversations/unread', headers={'Authorization': 'Bearer ' + token})
+    assert r.json['data']['unread'] == 3 and len(query_counter) == 1
@@ -0,0 +1,63 @@
+import re
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.models import User, Category, Ad, Media, Conversation, Message, Report
+
+HOT_TABLES = ('ads', 'media', 'conversations', 'messages', 'reports', 'categories', 'category_closure')
+FULL_SCAN = re.compile(r'^SCAN (%s)$' % '|'.join(HOT_TABLES))
+
+
+def login(client, email, password='p'):
+    token = client.post('/api/auth/login', json={'email': email, 'password': password}).json['data']['accessToken']
+    return {'Authorization': 'Bearer ' + token}
+
+
+def seed():
+    alice = User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p'))
+    bob = User(username='bob', email='bob@example.com', password_hash=generate_password_hash('p'))
+    mod = User(username='mod', email='mod@example.com', password_hash=generate_password_hash('p'), role='moderator')
+    cat = Category(name='Misc')
+    db.session.add_all([alice, bob, mod, cat])
+    db.session.flush()
+    ad = Ad(author_id=alice.id, category_id=cat.id, title='Lamp', price=5)
+    db.session.add(ad)
+    db.session.flush()
+    conv = Conversation(ad_id=ad.id, user1_id=bob.id, user2_id=alice.id)
+    db.session.add_all([Media(ad_id=ad.id, url='/uploads/x.png', type='image'), conv, Report(ad_id=ad.id, reporter_id=bob.id, reason='Spam')])
+    db.session.flush()
+    db.session.add(Message(conversation_id=conv.id, author_id=bob.id, text='Hi'))
+    db.session.commit()
+    return alice, bob, cat, ad, conv
+
+
+def test_hot_queries_use_indexes(client, app):
+    alice, bob, cat, ad, conv = seed()
+    alice_h, bob_h, mod_h = login(client, 'alice@example.com'), login(client, 'bob@example.com'), login(client, 'mod@example.com')
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        client.get('/api/ads')
+        client.get(f'/api/ads?categoryId={cat.id}')
+        client.get('/api/ads?sort=price_asc&price_from=1')
+        client.get(f'/api/ads?authorId={alice.id}', headers=alice_h)
+        client.get(f'/api/ads/{ad.id}/media')
+        client.get('/api/conversations', headers=bob_h)
+        client.post('/api/conversations', json={'adId': ad.id, 'partnerId': alice.id}, headers=bob_h)
+        client.get(f'/api/conversations/{conv.id}/messages', headers=bob_h)
+        client.get('/api/reports', headers=mod_h)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+
+    assert captured
+    with db.engine.connect() as conn:
+        for statement, parameters in captured:
+            plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+            scans = [row[-1] for row in plan if FULL_SCAN.match(row[-1])]
+            assert not scans, f'full scan {scans} in: {statement}'
@@ -65,3 +65,56 @@ def test_non_moderator_cannot_list_reports(client):
     headers = {'Authorization': 'Bearer ' + token}
     r = client.get('/reports', headers=headers)
     assert r.status_code == 403
+
+
+def seed_queue(client):
+    """A moderator's headers and 6 reports, one per hour, alternating new/reviewing, oldest first; the oldest is resolved."""
+    from datetime import datetime, timedelta
+    from app.models import Report
+    mod = User(username='mod', email='mod@example.com', password_hash=generate_password_hash('p'), role='moderator')
+    alice = User(username='alice', email='alice@example.com', password_hash='x')
+    cat = Category(name='Misc')
+    db.session.add_all([mod, alice, cat])
+    db.session.flush()
+    ad = Ad(author_id=alice.id, category_id=cat.id, title='Lamp', price=5)
+    db.session.add(ad)
+    db.session.flush()
+    now = datetime.utcnow()
+    reports = [Report(ad_id=ad.id, reporter_id=alice.id, reason=f'r{i}', status='resolved' if i == 0 else ('new', 'reviewing')[i % 2],
+                      created_at=now - timedelta(hours=6 - i)) for i in range(6)]
+    db.session.add_all(reports)
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'mod@example.com', 'password': 'p'}).json['data']['accessToken']
+    return {'Authorization': 'Bearer ' + token}
+
+
+def reasons(client, headers, query=''):
+    seen, cursor = [], None
+    while True:
+        r = client.get('/api/reports?limit=2' + query + (f'&cursor={cursor}' if cursor else ''), headers=headers)
+        assert r.status_code == 200
+        seen += [x['reason'] for x in r.json['data']]
+        cursor = r.json['next_cursor']
+        if not cursor:
+            return seen
+
+
+def test_report_queue_is_keyset_paginated_and_filtered(client):
+    headers = seed_queue(client)
+    first = client.get('/api/reports?limit=2', headers=headers).json['data'][0]
+    assert (first['reason'], first['ad_title'], first['reporter_username']) == ('r5', 'Lamp', 'alice')
+    assert reasons(client, headers) == ['r5', 'r4', 'r3', 'r2', 'r1']
+    assert reasons(client, headers, '&status=reviewing') == ['r5', 'r3', 'r1']
+    assert reasons(client, headers, '&status=resolved,new') == ['r4', 'r2', 'r0']
+    assert reasons(client, headers, '&min_age=2.5&max_age=5.5') == ['r3', 'r2', 'r1']
+    for bad in ('status=closed', 'min_age=soon', 'cursor=bogus'):
+        assert client.get('/api/reports?' + bad, headers=headers).status_code == 400
+
+
+def test_report_queue_page_is_one_query(client, query_counter):
+    headers = seed_queue(client)
+    client.get('/api/reports', headers=headers)
+    db.session.expire_all()
+    del query_counter[:]
+    client.get('/api/reports?limit=5', headers=headers)
+    assert len([s for s in query_counter if 'reports' in s]) == 1
@@ -0,0 +1,83 @@
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.models import User, Category, Ad, Media, Report
+
+
+def setup_ad(client):
+    user = User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p'))
+    mod = User(username='mod', email='mod@example.com', password_hash=generate_password_hash('p'), role='moderator')
+    cat = Category(name='Misc')
+    db.session.add_all([user, mod, cat])
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'alice@example.com', 'password': 'p'}).json['data']['accessToken']
+    headers = {'Authorization': 'Bearer ' + token}
+    ad_id = client.post('/api/ads', json={'title': 'Lamp', 'price': 5, 'category_id': cat.id}, headers=headers).json['data']['id']
+    return headers, cat, ad_id
+
+
+def test_anonymous_listing_is_served_from_cache(client, app, query_counter):
+    setup_ad(client)
+    first = client.get('/api/ads?limit=10&sort=newest').json
+    del query_counter[:]
+    # same normalized parameters in a different order
+    second = client.get('/api/ads?sort=newest&limit=10').json
+    assert second == first
+    assert query_counter == []
+
+
+def test_write_paths_purge_affected_entries(client, app):
+    headers, cat, ad_id = setup_ad(client)
+    store = app.extensions['response_cache']
+    assert client.get(f'/api/ads/{ad_id}').json['data']['title'] == 'Lamp'
+    client.get('/api/ads')
+    assert len(store) == 2
+
+    # location is not shown in lists: only the detail entry goes
+    client.put(f'/api/ads/{ad_id}', json={'location': 'Minsk'}, headers=headers)
+    assert len(store) == 1
+    assert client.get(f'/api/ads/{ad_id}').json['data']['location'] == 'Minsk'
+
+    client.put(f'/api/ads/{ad_id}', json={'title': 'Desk lamp'}, headers=headers)
+    assert len(store) == 0
+    assert client.get('/api/ads').json['data'][0]['title'] == 'Desk lamp'
+
+    # a new ad may land on any list page
+    other_ad = client.post('/api/ads', json={'title': 'Chair', 'category_id': cat.id}, headers=headers).json['data']['id']
+    assert len(client.get('/api/ads').json['data']) == 2
+
+    # list pages that do not contain the ad survive a media change
+    client.get(f'/api/ads?query=chair')
+    client.get(f'/api/ads/{ad_id}')
+    m = Media(ad_id=ad_id, url='/uploads/x.png', type='image')
+    db.session.add(m)
+    db.session.commit()
+    client.delete(f'/api/media/{m.id}', headers=headers)
+    assert store.lookup('/api/ads?query=chair')[1] == 'fresh'
+    assert store.lookup(f'/api/ads/{ad_id}?')[1] is None
+    assert store.lookup('/api/ads?')[1] is None
+
+
+def test_block_ad_purges_listing(client, app):
+    headers, cat, ad_id = setup_ad(client)
+    report = Report(ad_id=ad_id, reporter_id=User.query.filter_by(username='mod').first().id, reason='Spam')
+    db.session.add(report)
+    db.session.commit()
+    assert len(client.get('/api/ads').json['data']) == 1
+    token = client.post('/api/auth/login', json={'email': 'mod@example.com', 'password': 'p'}).json['data']['accessToken']
+    client.put(f'/api/reports/{report.id}', json={'status': 'resolved', 'block_ad': True}, headers={'Authorization': 'Bearer ' + token})
+    assert client.get('/api/ads').json['data'] == []
+
+
+def test_stale_entry_is_served_while_refreshing_once(client, app):
+    headers, cat, ad_id = setup_ad(client)
+    store = app.extensions['response_cache']
+    now = [0.0]
+    store.clock = lambda: now[0]
+    client.get('/api/ads')
+    # change the row behind the cache's back, then let the entry expire
+    Ad.query.get(ad_id).title = 'Changed'
+    db.session.commit()
+    now[0] += store.ttl + 1
+    assert client.get('/api/ads').json['data'][0]['title'] == 'Lamp'
+    store.wait_refreshes(5)
+    assert client.get('/api/ads').json['data'][0]['title'] == 'Changed'
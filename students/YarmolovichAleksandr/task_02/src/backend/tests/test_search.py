@@ -0,0 +1,73 @@
+from app import search
+from app.extensions import db
+from app.models import User, Category, Ad
+
+
+def make_ad(title, description=''):
+    user = User.query.first()
+    cat = Category.query.first()
+    if user is None:
+        user = User(username='seller', email='seller@example.com', password_hash='x')
+        cat = Category(name='Misc')
+        db.session.add_all([user, cat])
+        db.session.flush()
+    ad = Ad(author_id=user.id, category_id=cat.id, title=title, description=description, price=1)
+    db.session.add(ad)
+    db.session.flush()
+    search.index_ad(ad)
+    db.session.commit()
+    return ad
+
+
+def found(client, query):
+    r = client.get('/api/ads', query_string={'query': query})
+    assert r.status_code == 200
+    return [a['id'] for a in r.json['data']]
+
+
+def test_stem_ru_strips_inflection():
+    assert search.stem_ru('телефоны') == search.stem_ru('телефона') == 'телефон'
+    assert search.stem_ru('ёлка') == 'елк'
+
+
+def test_search_matches_title_and_description_in_both_languages(client, app):
+    phone = make_ad('Телефон Samsung', 'Почти новый')
+    case = make_ad('Leather case', 'Fits most phones')
+    make_ad('Bicycle', 'Red')
+    assert found(client, 'телефоны') == [phone.id]
+    assert found(client, 'phone') == [case.id]
+    assert found(client, 'новые') == [phone.id]
+    assert found(client, 'phone bicycle') == []
+
+
+def test_title_matches_rank_above_description_matches(client, app):
+    in_description = make_ad('Lamp', 'Goes well with a desk')
+    in_title = make_ad('Desk', 'Oak')
+    assert found(client, 'desk') == [in_title.id, in_description.id]
+
+
+def test_index_follows_update_and_delete(client, app):
+    client.post('/api/auth/register', json={'username': 'u', 'email': 'u@example.com', 'password': 'p'})
+    token = client.post('/api/auth/login', json={'email': 'u@example.com', 'password': 'p'}).json['data']['accessToken']
+    headers = {'Authorization': 'Bearer ' + token}
+    cat = Category(name='Misc')
+    db.session.add(cat)
+    db.session.commit()
+    ad_id = client.post('/api/ads', json={'title': 'Guitar', 'category_id': cat.id}, headers=headers).json['data']['id']
+    assert found(client, 'guitar') == [ad_id]
+    client.put(f'/api/ads/{ad_id}', json={'title': 'Violin'}, headers=headers)
+    assert found(client, 'guitar') == []
+    assert found(client, 'violin') == [ad_id]
+    client.delete(f'/api/ads/{ad_id}', headers=headers)
+    assert found(client, 'violin') == []
+
+
+def test_relevance_cursor_pages_do_not_overlap(client, app):
+    ids = {make_ad(f'Chair {i}').id for i in range(5)}
+    r = client.get('/api/ads', query_string={'query': 'chair', 'limit': 2})
+    seen = [a['id'] for a in r.json['data']]
+    while r.json['next_cursor']:
+        r = client.get('/api/ads', query_string={'query': 'chair', 'limit': 2, 'cursor': r.json['next_cursor']})
+        seen.extend(a['id'] for a in r.json['data'])
+    assert len(seen) == len(set(seen)) == 5
+    assert set(seen) == ids
@@ -0,0 +1,100 @@
+import hashlib
+import pytest
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.models import User, Category, Media
+from app.storage import LocalStorage, S3Storage
+
+
+@pytest.fixture
+def s3(app):
+    """S3Storage against moto's in-process S3 (stands in for MinIO / AWS)."""
+    boto3 = pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+        client.create_bucket(Bucket='media')
+        storage = S3Storage('media', client=client, public_url='https://cdn.example.com/media')
+        app.extensions['storage'] = storage
+        yield storage
+
+
+@pytest.fixture(params=['local', 's3'])
+def storage(request, app, tmp_path):
+    if request.param == 's3':
+        return request.getfixturevalue('s3')
+    storage = app.extensions['storage'] = LocalStorage(str(tmp_path / 'uploads'))
+    return storage
+
+
+def test_storage_drivers_behave_the_same(storage, tmp_path):
+    src = tmp_path / 'src.png'
+    src.write_bytes(b'pixels')
+    key = 'ab/cd/abcd.png'
+    assert not storage.exists(key)
+    storage.save(key, str(src))
+    assert not src.exists()
+    assert storage.exists(key) and storage.size(key) == 6
+    assert storage.key_for(storage.url(key)) == key
+    assert storage.key_for('https://elsewhere.example.com/x.png') is None
+    with storage.local_copy(key) as path:
+        assert open(path, 'rb').read() == b'pixels'
+    assert [(f.key, f.size) for f in storage.files()] == [(key, 6)]
+    storage.delete(key)
+    assert not storage.exists(key) and list(storage.files()) == []
+
+
+def setup_ad(client, app, tmp_path):
+    app.config['UPLOAD_PARTIAL_FOLDER'] = str(tmp_path / 'partial')
+    db.session.add(User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p')))
+    cat = Category(name='Misc')
+    db.session.add(cat)
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'alice@example.com', 'password': 'p'}).json['data']['accessToken']
+    headers = {'Authorization': 'Bearer ' + token}
+    ad_id = client.post('/api/ads', json={'title': 'Lamp', 'category_id': cat.id}, headers=headers).json['data']['id']
+    return headers, ad_id
+
+
+def test_direct_upload_goes_straight_to_the_bucket(client, app, s3, tmp_path):
+    requests = pytest.importorskip('requests')
+    headers, ad_id = setup_ad(client, app, tmp_path)
+    content = b'photo bytes'
+    digest = hashlib.sha256(content).hexdigest()
+    r = client.post('/api/uploads', json={'ad_id': ad_id, 'filename': 'p.jpg', 'size': len(content), 'sha256': digest}, headers=headers)
+    data = r.json['data']
+    assert data['direct'] and data['upload']['method'] == 'PUT'
+    assert client.post(f"/api/uploads/{data['id']}/complete", headers=headers).status_code == 409
+
+    put = requests.put(data['upload']['url'], data=content, headers=data['upload']['headers'])
+    assert put.status_code == 200
+    r = client.post(f"/api/uploads/{data['id']}/complete", headers=headers)
+    assert r.status_code == 201
+    assert r.json['data']['url'] == f'https://cdn.example.com/media/{digest[:2]}/{digest[2:4]}/{digest}.jpg'
+
+    # the same content again needs no upload at all
+    data = client.post('/api/uploads', json={'ad_id': ad_id, 'filename': 'q.jpg', 'size': len(content), 'sha256': digest}, headers=headers).json['data']
+    assert data['upload'] is None
+    assert client.post(f"/api/uploads/{data['id']}/complete", headers=headers).status_code == 201
+    assert Media.query.count() == 2 and len(list(s3.files())) == 1
+
+
+def test_direct_upload_with_wrong_content_is_rejected(client, app, s3, tmp_path):
+    headers, ad_id = setup_ad(client, app, tmp_path)
+    claimed = hashlib.sha256(b'genuine').hexdigest()
+    data = client.post('/api/uploads', json={'ad_id': ad_id, 'filename': 'p.jpg', 'size': 7, 'sha256': claimed}, headers=headers).json['data']
+    # an object put under the key without the checksum being enforced
+    key = f'{claimed[:2]}/{claimed[2:4]}/{claimed}.jpg'
+    s3.client.put_object(Bucket='media', Key=key, Body=b'forgery')
+    r = client.post(f"/api/uploads/{data['id']}/complete", headers=headers)
+    assert r.status_code == 409 and r.json['error']['code'] == 'checksum_mismatch'
+    assert not s3.exists(key) and Media.query.count() == 0
+
+
+def test_multipart_upload_is_stored_through_the_driver(client, app, s3, tmp_path):
+    import io
+    headers, ad_id = setup_ad(client, app, tmp_path)
+    r = client.post(f'/api/ads/{ad_id}/media', data={'file': (io.BytesIO(b'img'), 'a.png')}, headers=headers, content_type='multipart/form-data')
+    assert r.json['data']['url'].startswith('https://cdn.example.com/media/')
+    client.delete(f"/api/media/{r.json['data']['id']}", headers=headers)
+    assert list(s3.files()) == []
@@ -0,0 +1,90 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.models import User, Category, UploadSession
+from app.storage import get_storage
+from app.uploads import expire_sessions, partial_path
+
+
+def stored_path(url):
+    storage = get_storage()
+    return storage.path(storage.key_for(url))
+
+
+@pytest.fixture
+def folders(app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    app.config['UPLOAD_PARTIAL_FOLDER'] = str(tmp_path / 'partial')
+    return tmp_path
+
+
+def setup_ad(client):
+    db.session.add(User(username='alice', email='alice@example.com', password_hash=generate_password_hash('p')))
+    cat = Category(name='Misc')
+    db.session.add(cat)
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'alice@example.com', 'password': 'p'}).json['data']['accessToken']
+    headers = {'Authorization': 'Bearer ' + token}
+    ad_id = client.post('/api/ads', json={'title': 'Lamp', 'price': 5, 'category_id': cat.id}, headers=headers).json['data']['id']
+    return headers, ad_id
+
+
+def put_chunk(client, headers, upload_id, data, start, total):
+    rng = {'Content-Range': f'bytes {start}-{start + len(data) - 1}/{total}'}
+    return client.put(f'/api/uploads/{upload_id}', data=data, headers={**headers, **rng})
+
+
+def test_chunked_upload_resumes_and_completes(client, app, folders):
+    headers, ad_id = setup_ad(client)
+    payload = os.urandom(300 * 1024)
+    r = client.post('/api/uploads', json={'ad_id': ad_id, 'filename': 'photo.jpg', 'size': len(payload)}, headers=headers)
+    assert r.status_code == 201
+    upload_id = r.json['data']['id']
+
+    assert put_chunk(client, headers, upload_id, payload[:100000], 0, len(payload)).json['data']['offset'] == 100000
+    # a retried chunk is rejected with the offset to resume from
+    r = put_chunk(client, headers, upload_id, payload[:100000], 0, len(payload))
+    assert r.status_code == 409 and r.json['data']['offset'] == 100000
+    assert client.post(f'/api/uploads/{upload_id}/complete', headers=headers).status_code == 409
+
+    assert client.get(f'/api/uploads/{upload_id}', headers=headers).json['data']['offset'] == 100000
+    assert put_chunk(client, headers, upload_id, payload[100000:], 100000, len(payload)).status_code == 200
+    r = client.post(f'/api/uploads/{upload_id}/complete', headers=headers)
+    assert r.status_code == 201
+    url = r.json['data']['url']
+    with open(stored_path(url), 'rb') as f:
+        assert f.read() == payload
+    assert client.get('/api/ads').json['data'][0]['cover_url'] == url
+    assert db.session.get(UploadSession, upload_id) is None
+
+
+def test_chunk_past_declared_size_is_rejected(client, app, folders):
+    headers, ad_id = setup_ad(client)
+    upload_id = client.post('/api/uploads', json={'ad_id': ad_id, 'filename': 'a.png', 'size': 10}, headers=headers).json['data']['id']
+    r = client.put(f'/api/uploads/{upload_id}?offset=0', data=b'x' * 11, headers=headers)
+    assert r.status_code == 400
+    assert client.get(f'/api/uploads/{upload_id}', headers=headers).json['data']['offset'] == 0
+    assert os.path.getsize(partial_path(upload_id)) == 0
+
+
+def test_only_the_owner_sees_a_session(client, app, folders):
+    headers, ad_id = setup_ad(client)
+    upload_id = client.post('/api/uploads', json={'ad_id': ad_id, 'filename': 'a.png', 'size': 10}, headers=headers).json['data']['id']
+    db.session.add(User(username='bob', email='bob@example.com', password_hash=generate_password_hash('p')))
+    db.session.commit()
+    token = client.post('/api/auth/login', json={'email': 'bob@example.com', 'password': 'p'}).json['data']['accessToken']
+    bob = {'Authorization': 'Bearer ' + token}
+    assert client.get(f'/api/uploads/{upload_id}', headers=bob).status_code == 404
+    assert client.post('/api/uploads', json={'ad_id': ad_id, 'filename': 'a.png', 'size': 10}, headers=bob).status_code == 403
+
+
+def test_abandoned_sessions_expire(client, app, folders):
+    headers, ad_id = setup_ad(client)
+    upload_id = client.post('/api/uploads', json={'ad_id': ad_id, 'filename': 'a.png', 'size': 10}, headers=headers).json['data']['id']
+    put_chunk(client, headers, upload_id, b'12345', 0, 10)
+    assert expire_sessions() == 0
+    assert expire_sessions(now=datetime.utcnow() + timedelta(seconds=app.config['UPLOAD_SESSION_TTL'] + 1)) == 1
+    assert not os.path.exists(partial_path(upload_id))
+    assert client.get(f'/api/uploads/{upload_id}', headers=headers).status_code == 404
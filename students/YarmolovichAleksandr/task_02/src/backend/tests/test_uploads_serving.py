@@ -0,0 +1,56 @@
+import hashlib
+import os
+import pytest
+from werkzeug.http import http_date
+
+
+@pytest.fixture
+def stored(app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    digest = hashlib.sha256(b'0123456789').hexdigest()
+    name = f'{digest[:2]}/{digest[2:4]}/{digest}.png'
+    os.makedirs(tmp_path / digest[:2] / digest[2:4])
+    (tmp_path / name).write_bytes(b'0123456789')
+    (tmp_path / 'ad_old.png').write_bytes(b'legacy')
+    return name
+
+
+def test_content_addressed_files_are_cached_forever(client, stored):
+    r = client.get(f'/uploads/{stored}')
+    assert r.data == b'0123456789'
+    assert r.cache_control.immutable and r.cache_control.max_age == 365 * 24 * 3600
+    legacy = client.get('/uploads/ad_old.png')
+    assert not legacy.cache_control.immutable and legacy.cache_control.max_age == 3600
+
+
+def test_range_and_conditional_requests(client, stored):
+    r = client.get(f'/uploads/{stored}', headers={'Range': 'bytes=2-5'})
+    assert r.status_code == 206 and r.data == b'2345'
+    assert r.headers['Content-Range'] == 'bytes 2-5/10'
+    last_modified = client.get(f'/uploads/{stored}').headers['Last-Modified']
+    assert client.get(f'/uploads/{stored}', headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert client.get(f'/uploads/{stored}', headers={'If-Modified-Since': http_date(0)}).status_code == 200
+
+
+def test_sendfile_modes_leave_the_bytes_to_the_proxy(client, app, stored, tmp_path):
+    app.config['UPLOAD_SENDFILE'] = 'x-accel-redirect'
+    r = client.get(f'/uploads/{stored}')
+    assert r.headers['X-Accel-Redirect'] == f'/_uploads/{stored}'
+    assert r.data == b'' and r.mimetype == 'image/png' and r.cache_control.immutable
+    assert client.get('/uploads/missing.png').status_code == 404
+    assert client.get('/uploads/../secret').status_code == 404
+
+    app.config['UPLOAD_SENDFILE'] = 'x-sendfile'
+    r = client.get('/uploads/ad_old.png')
+    assert r.headers['X-Sendfile'] == str(tmp_path / 'ad_old.png') and r.data == b''
+
+
+def test_unknown_sendfile_mode_fails_at_startup():
+    from app import create_app
+    from app.config import TestConfig
+
+    class Typo(TestConfig):
+        UPLOAD_SENDFILE = 'x-accel'
+
+    with pytest.raises(RuntimeError, match='UPLOAD_SENDFILE'):
+        create_app(Typo)